@@ -2,9 +2,30 @@
 int ledPin = 4;
 int fanPin = 5;
 
-String incoming; //string holds the incoming serial commands "on"/"off"
+const long BASE_BAUD = 9600; //baudrate after a reset and after "off"
+const long BAUD_RATES[] = {9600, 57600, 115200, 230400, 460800, 921600}; //baudrates accepted by the "baud" command
+
+//framed protocol, see 03-API/protocol.py
+const byte MAGIC[] = {0xA5, 0x5A};
+const byte VERSION = 1;
+const byte DATA_FRAME = 1;
+const byte STATUS_FRAME = 2;
+const int FRAME_PAYLOAD = 32; //random bytes per data frame
+
+String incoming; //string holds the incoming serial commands
 int sensorValue = 0;  //variable to store the value coming from the sensor
 
+long baudRate = BASE_BAUD;
+unsigned long sampleInterval = 8000; //microseconds between two readings, can be changed with "interval <us>"
+bool framed = false; //true after "frames": the bytes are sent in frames with sequence number and CRC
+uint16_t sequence = 0; //sequence number of the next frame
+byte payload[FRAME_PAYLOAD]; //random bytes of the next data frame
+int payloadLength = 0;
+
+unsigned long bitsSampled = 0; //random bits produced since the last rate measurement
+unsigned long rateStarted = 0; //start of the current rate measurement in milliseconds
+unsigned long sampleRate = 0; //random bits produced per second, measured every second
+
 void setup() {
   delay(1000);
   //configure led and fan as output and turn them off by default
@@ -12,49 +33,151 @@ void setup() {
   digitalWrite(fanPin, LOW);
   pinMode(ledPin, OUTPUT);
   digitalWrite(ledPin, LOW);
-  Serial.begin(9600);  //start the serial communication with 9600 baudrate
+  Serial.begin(BASE_BAUD);  //start the serial communication with 9600 baudrate
+  Serial.setTimeout(50); //commands end with a newline, or after 50ms for hosts which send "on"/"off" without one
   delay(1000);
 }
 
-void loop() {
-  
-  static bool active = false; //stores the state of fan and led
+//CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF), the same as binascii.crc_hqx on the host
+uint16_t crc16(uint16_t crc, const byte *data, int length) {
+  for (int i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
 
-  if (Serial.available() > 0) { //As soon as something is received via the serial interface
-    incoming = Serial.readString();
-    if (incoming == "on") { //activate fan and led when "on" is received
-      digitalWrite(fanPin, HIGH);
-      digitalWrite(ledPin, HIGH);
-      delay(2000);
-      active = true;
-    } else if (incoming == "off") { //deactivate fan and led when "off" is received
-      digitalWrite(fanPin, LOW);
-      digitalWrite(ledPin, LOW);                      
-      active = false;
+//send a frame: magic | version | type | sequence | length | payload | CRC, all integers big-endian
+void sendFrame(byte type, const byte *data, uint16_t length) {
+  byte header[6] = {VERSION, type, (byte)(sequence >> 8), (byte)sequence, (byte)(length >> 8), (byte)length};
+  uint16_t crc = crc16(0xFFFF, header, sizeof(header));
+  crc = crc16(crc, data, length);
+  byte checksum[2] = {(byte)(crc >> 8), (byte)crc};
+  Serial.write(MAGIC, sizeof(MAGIC));
+  Serial.write(header, sizeof(header));
+  Serial.write(data, length);
+  Serial.write(checksum, sizeof(checksum));
+  sequence++;
+}
+
+//send the measured sample rate in bits per second and the current baudrate
+void sendStatus() {
+  byte status[8];
+  for (int i = 0; i < 4; i++) {
+    status[i] = (byte)(sampleRate >> (24 - 8 * i));
+    status[4 + i] = (byte)(baudRate >> (24 - 8 * i));
+  }
+  sendFrame(STATUS_FRAME, status, sizeof(status));
+}
+
+bool isSupportedBaud(long rate) {
+  for (unsigned int i = 0; i < sizeof(BAUD_RATES) / sizeof(BAUD_RATES[0]); i++) {
+    if (BAUD_RATES[i] == rate) {
+      return true;
     }
   }
+  return false;
+}
 
+//switch the serial interface to another baudrate after the pending bytes have been sent
+void setBaud(long rate) {
+  Serial.flush();
+  baudRate = rate;
+  Serial.begin(baudRate);
+}
 
-  if (active) { //only run the code, when led and fan are on
-    
-    byte data = 0; //byte which is filled with random bits and later send to the API
+void handleCommand(bool &active) {
+  incoming = Serial.readStringUntil('\n');
+  incoming.trim();
+  if (incoming == "on") { //activate fan and led when "on" is received
+    digitalWrite(fanPin, HIGH);
+    digitalWrite(ledPin, HIGH);
+    delay(2000);
+    active = true;
+    bitsSampled = 0;
+    rateStarted = millis();
+  } else if (incoming == "off") { //deactivate fan and led when "off" is received
+    digitalWrite(fanPin, LOW);
+    digitalWrite(ledPin, LOW);
+    active = false;
+    framed = false; //the next session starts with bare bytes at the base baudrate again
+    payloadLength = 0;
+    if (baudRate != BASE_BAUD) {
+      setBaud(BASE_BAUD);
+    }
+  } else if (incoming == "frames") { //switch to the framed protocol
+    framed = true;
+    sequence = 0;
+    payloadLength = 0;
+    sendStatus();
+  } else if (framed && incoming.startsWith("baud ")) { //confirm the new baudrate at the old one, then switch
+    long rate = incoming.substring(5).toInt();
+    if (isSupportedBaud(rate)) {
+      baudRate = rate;
+      sendStatus();
+      setBaud(rate);
+    }
+  } else if (incoming.startsWith("interval ")) { //change the time between two readings
+    long interval = incoming.substring(9).toInt();
+    if (interval > 0) {
+      sampleInterval = interval;
+    }
+    if (framed) {
+      sendStatus();
+    }
+  } else if (framed && incoming == "rate") {
+    sendStatus();
+  }
+}
 
-    //the loop variable is used later to check if one Byte is filled with Bits before sending it
-    for (int i = 0; i < 50; i++) {
-      
-     for (int a = 0; a < 4; a++) { //read the solar voltage 4 times with an interval of 5ms 
+//read the solar voltage 4 times per bit pair and collect the two LSBs of the sum, 4 pairs make one byte
+byte sampleByte() {
+  byte data = 0; //byte which is filled with random bits and later send to the API
+  for (int i = 0; i < 4; i++) {
+    for (int a = 0; a < 4; a++) {
       int reading = analogRead(A0); //convert the solar voltage to int number (0V=0 |3.3V =1023)
       sensorValue = sensorValue + reading; //add the last reading to sensorValue
-      delay(8); //wait 8ms (4 x 8ms = 32ms for full sensorValue)
+      delayMicroseconds(sampleInterval % 1000); //wait sampleInterval between two readings
+      delay(sampleInterval / 1000);
+    }
+    byte lsb = (sensorValue & 0b11); //extract two LSBs from sensorValue
+    sensorValue = 0; //clear sensorValue
+    data = (data << 2) | lsb; //Add the two last extracted LSBs to data (Byte)
+  }
+  return data;
+}
+
+void loop() {
+
+  static bool active = false; //stores the state of fan and led
+
+  if (Serial.available() > 0) { //As soon as something is received via the serial interface
+    handleCommand(active);
+  }
+
+  if (active) { //only run the code, when led and fan are on
+    //one byte per loop, so commands are answered while the board is sending
+    byte data = sampleByte();
+    bitsSampled += 8;
+
+    if (framed) {
+      payload[payloadLength++] = data;
+      if (payloadLength == FRAME_PAYLOAD) { //send the payload once the frame is full
+        sendFrame(DATA_FRAME, payload, payloadLength);
+        payloadLength = 0;
+      }
+    } else {
+      Serial.write(data); //send the byte via the serial interface
     }
 
-      byte lsb = (sensorValue & 0b11); //extract two LSBs from sensorValue
-      sensorValue = 0; //clear sensorValue
-      data = (data << 2) | lsb; //Add the two last extracted LSBs to data (Byte)
-  
-      if (i % 4 == 3) { //check if data (Byte) is filled with 8 LSBs
-        Serial.write(data); //send the byte via the serial interface
-        data = 0; //reset the byte after it has been sent
+    if (millis() - rateStarted >= 1000) { //measure the sample rate every second and report it in framed mode
+      sampleRate = bitsSampled * 1000 / (millis() - rateStarted);
+      bitsSampled = 0;
+      rateStarted = millis();
+      if (framed) {
+        sendStatus();
       }
     }
   }
@@ -0,0 +1,264 @@
+"""
+This module contains streaming versions of the statistics used by the test battery of tests.py.
+
+The tests in tests.py count their sufficient statistics from the whole bit sequence at once. A Summary holds the same
+statistics for one contiguous segment of bits together with the few bits at its edges, which makes summaries of
+adjacent segments mergeable: patterns, run boundaries and lag differences which cross the boundary are counted during
+the merge. An Accumulator cuts the incoming bytes into segments, summarizes every segment once and maintains the merged
+summary of a sliding or tumbling window of segments, so the statistics of long-running streams are available at any
+time with bounded memory.
+"""
+
+import numpy as np
+
+import tests
+
+EDGE_BITS = max(tests.APPROXIMATE_ENTROPY_M, tests.SERIAL_M - 1, tests.AUTOCORRELATION_D)  # Edge bits kept per side
+ALIGNMENT_BITS = int(np.lcm.reduce([tests.POKER_M, tests.BLOCK_FREQUENCY_M, tests.LONGEST_RUN_M,
+                                     8]))  # Summaries merge at multiples of this
+SEGMENT_BYTES = 1250  # Default segment size of an accumulator, 10000 bits
+
+
+class Summary:
+    """
+    Mergeable sufficient statistics of a contiguous segment of bits.
+
+    Attributes:
+    - n (int): The number of bits.
+    - ones (int): The number of ones.
+    - poker_counts, serial_counts, entropy_counts (numpy.ndarray): Block and pattern counts, see tests.poker_counts and
+      tests.pattern_counts.
+    - longest_runs (numpy.ndarray): Blocks by their longest run of ones, see tests.longest_runs.
+    - transitions, lag_differences (int): Differing bits at lag 1 and at the autocorrelation lag, see
+      tests.lag_differences.
+    - block_count (int), block_squares (float): Complete frequency blocks, see tests.block_squares.
+    - total, max_prefix, min_prefix (int): The sum of the random walk of tests.max_excursion and its extreme values.
+    - head, tail (numpy.ndarray): The first and the last EDGE_BITS bits.
+
+    Description:
+    Summaries are combined with the + operator, which is associative. Poker, longest run and frequency blocks are
+    counted from the start of a summary, so the left operand of a merge must hold a multiple of ALIGNMENT_BITS bits.
+    """
+    def __init__(self):
+        self.n = 0
+        self.ones = 0
+        self.poker_counts = np.zeros(2 ** tests.POKER_M, dtype=np.int64)
+        self.serial_counts = np.zeros(2 ** tests.SERIAL_M, dtype=np.int64)
+        self.entropy_counts = np.zeros(2 ** (tests.APPROXIMATE_ENTROPY_M + 1), dtype=np.int64)
+        self.longest_runs = np.zeros(tests.LONGEST_RUN_CLASSES, dtype=np.int64)
+        self.transitions = 0
+        self.lag_differences = 0
+        self.block_count = 0
+        self.block_squares = 0.0
+        self.total = 0
+        self.max_prefix = 0
+        self.min_prefix = 0
+        self.head = np.zeros(0, dtype=np.uint8)
+        self.tail = np.zeros(0, dtype=np.uint8)
+
+    @classmethod
+    def of(cls, data, length=None):
+        """
+        Summarizes a segment.
+
+        Parameters:
+        - data (bytes-like, numpy.ndarray or str): The segment, see tests.to_bits.
+        - length (int): Optional number of bits to summarize.
+
+        Returns:
+        - Summary: The summary of the segment.
+        """
+        bits = tests.to_bits(data, length)
+        summary = cls()
+        summary.n = bits.size
+        if summary.n == 0:
+            return summary
+        summary.ones = int(np.count_nonzero(bits))
+        summary.poker_counts = tests.poker_counts(bits)
+        summary.serial_counts = tests.pattern_counts(bits, tests.SERIAL_M)
+        summary.entropy_counts = tests.pattern_counts(bits, tests.APPROXIMATE_ENTROPY_M + 1)
+        summary.longest_runs = tests.longest_runs(bits)
+        summary.transitions = tests.lag_differences(bits, 1)
+        summary.lag_differences = tests.lag_differences(bits)
+        summary.block_count, summary.block_squares = tests.block_squares(bits)
+        walk = np.cumsum(2 * bits.astype(np.int64) - 1)
+        summary.total = int(walk[-1])
+        summary.max_prefix = int(walk.max())
+        summary.min_prefix = int(walk.min())
+        summary.head = bits[:EDGE_BITS].copy()
+        summary.tail = bits[-EDGE_BITS:].copy()
+        return summary
+
+    def __add__(self, other):
+        if self.n == 0:
+            return other
+        if other.n == 0:
+            return self
+        if self.n % ALIGNMENT_BITS:
+            raise ValueError(f"The left summary must hold a multiple of {ALIGNMENT_BITS} bits.")
+        merged = Summary()
+        merged.n = self.n + other.n
+        merged.ones = self.ones + other.ones
+        merged.poker_counts = self.poker_counts + other.poker_counts
+        merged.longest_runs = self.longest_runs + other.longest_runs
+        merged.block_count = self.block_count + other.block_count
+        merged.block_squares = self.block_squares + other.block_squares
+
+        # Patterns and lag differences which cross the boundary
+        junction = np.concatenate((self.tail, other.head))
+        a = self.tail.size
+        merged.serial_counts = self.serial_counts + other.serial_counts + _crossing(junction, a, tests.SERIAL_M)
+        merged.entropy_counts = (self.entropy_counts + other.entropy_counts
+                                 + _crossing(junction, a, tests.APPROXIMATE_ENTROPY_M + 1))
+        merged.transitions = self.transitions + other.transitions + tests.lag_differences(junction[a - 1:a + 1], 1)
+        d = tests.AUTOCORRELATION_D
+        merged.lag_differences = (self.lag_differences + other.lag_differences
+                                  + tests.lag_differences(junction[max(a - d, 0):a + d], d))
+
+        merged.total = self.total + other.total
+        merged.max_prefix = max(self.max_prefix, self.total + other.max_prefix)
+        merged.min_prefix = min(self.min_prefix, self.total + other.min_prefix)
+        merged.head = junction[:EDGE_BITS] if self.head.size < EDGE_BITS else self.head
+        merged.tail = junction[-EDGE_BITS:] if other.tail.size < EDGE_BITS else other.tail
+        return merged
+
+    def statistics(self):
+        """
+        Returns the statistics in the format of tests.sufficient_statistics, ready for tests.evaluate.
+        """
+        return {
+            'n': self.n,
+            'ones': self.ones,
+            'transitions': self.transitions,
+            'poker_counts': self.poker_counts,
+            'serial_counts': self.serial_counts,
+            'max_excursion': max(abs(self.max_prefix), abs(self.min_prefix)),
+            'lag_differences': self.lag_differences,
+            'entropy_counts': self.entropy_counts,
+            'longest_runs': self.longest_runs,
+            'block_count': self.block_count,
+            'block_squares': self.block_squares,
+            'head': self.head,
+            'tail': self.tail,
+        }
+
+    def evaluate(self):
+        """
+        Runs the test battery on the summarized bits.
+
+        Returns:
+        - dict: The result of every test, see tests.run_battery.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return tests.evaluate(self.statistics())
+
+
+def _crossing(junction, a, m):
+    """
+    Counts the m-bit patterns of the junction which start before position a and end at or after it.
+    """
+    return tests.pattern_counts(junction[max(a - m + 1, 0):a + m - 1], m)
+
+
+class Accumulator:
+    """
+    Keeps the test statistics of a window over a stream of bytes.
+
+    Attributes:
+    - segment_bytes (int): The number of bytes summarized at once.
+    - window_segments (int): The number of segments in a window.
+    - tumbling (bool): False for a sliding window, True for consecutive non-overlapping windows.
+    - completed (Summary): The last complete tumbling window, or None.
+
+    Description:
+    Incoming bytes are buffered until a segment is complete, which is then summarized once. A sliding window is kept in
+    two stacks: new segments are merged into a running summary of the back stack, and when the oldest segment is evicted
+    while the front stack is empty, the back stack is flipped into the front stack with suffix summaries. Every segment
+    takes part in a constant number of merges, so the cost per byte is O(1) amortized and the memory is bounded by the
+    window size. A tumbling window is merged into a running summary and starts over once it is complete. Accumulators
+    are not thread-safe; callers are expected to hold a lock.
+
+    Example usage:
+    accumulator = Accumulator(125000, tumbling=False)
+    accumulator.update(data)
+    results = accumulator.summary().evaluate()
+    """
+    def __init__(self, window_bytes, segment_bytes=SEGMENT_BYTES, tumbling=False):
+        if segment_bytes * 8 % ALIGNMENT_BITS:
+            raise ValueError(f"The segment size must be a multiple of {ALIGNMENT_BITS // 8} bytes.")
+        if window_bytes < segment_bytes:
+            raise ValueError("The window must hold at least one segment.")
+        self.segment_bytes = segment_bytes
+        self.window_segments = window_bytes // segment_bytes
+        self.tumbling = tumbling
+        self.completed = None
+        self._pending = bytearray()
+        self._front = []  # (segment, summary of this segment and all newer segments in the front stack)
+        self._back = []
+        self._back_summary = Summary()
+
+    @property
+    def segments(self):
+        """
+        Returns the number of complete segments in the current window.
+        """
+        return len(self._front) + len(self._back)
+
+    def update(self, data):
+        """
+        Adds bytes to the stream.
+
+        Parameters:
+        - data (bytes-like): The bytes to add.
+        """
+        self._pending += data
+        start = 0
+        while len(self._pending) - start >= self.segment_bytes:
+            self._push(Summary.of(self._pending[start:start + self.segment_bytes]))
+            start += self.segment_bytes
+        del self._pending[:start]
+
+    def _push(self, segment):
+        self._back.append(segment)
+        self._back_summary = self._back_summary + segment
+        if self.segments < self.window_segments:
+            return
+        if self.tumbling:
+            self.completed = self.summary()
+            self.reset(keep_completed=True)
+        elif self.segments > self.window_segments:
+            self._evict()
+
+    def _evict(self):
+        if not self._front:
+            running = Summary()
+            for segment in reversed(self._back):
+                running = segment + running
+                self._front.append((segment, running))
+            self._back = []
+            self._back_summary = Summary()
+        self._front.pop()
+
+    def summary(self):
+        """
+        Returns the summary of the complete segments of the current window.
+
+        Returns:
+        - Summary: The merged summary, oldest segment first.
+        """
+        front = self._front[-1][1] if self._front else Summary()
+        return front + self._back_summary
+
+    def reset(self, keep_completed=False):
+        """
+        Starts a new window.
+
+        Parameters:
+        - keep_completed (bool): Keep the last complete tumbling window.
+        """
+        self._front = []
+        self._back = []
+        self._back_summary = Summary()
+        if not keep_completed:
+            self._pending = bytearray()
+            self.completed = None
@@ -1,15 +1,30 @@
 """
 Main entry point for the application.
+
+The API is served by the Flask development server, or with SERVER=asgi in the .env file by uvicorn running the ASGI
+application of asgi.py, which needs 'pip3 install uvicorn'.
 """
 
+import os
+from dotenv import load_dotenv
+
 import system
 from routes import app
 
+load_dotenv()
+SERVER = os.getenv("SERVER", "flask")  # 'flask' or 'asgi'
+
 if __name__ == '__main__':
     try:
-        # Initialize the system before running the app
-        system.prep()
-        # Run the Flask application
-        app.run()
+        if SERVER == 'asgi':
+            # Run the ASGI application, which waits for random data without holding a thread per request
+            import uvicorn
+            import asgi
+            uvicorn.run(asgi.app, host='127.0.0.1', port=5000)
+        else:
+            # Prepare the devices in the background, so the server answers right away; see /trng/ready
+            system.start_prep()
+            # Run the Flask application
+            app.run()
     except Exception as e:
         print(f"An error occurred while running the application: {str(e)}")
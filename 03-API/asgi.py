@@ -0,0 +1,250 @@
+"""
+This module contains the ASGI application, an asynchronous way to serve the API.
+
+With the Flask development server, every request which waits for random data holds a thread until the board has
+delivered enough bytes. The ASGI application serves /trng/randomNum/getRandom on the event loop instead: a waiting
+request is a coroutine queued in the scheduler (see scheduler.Scheduler.take_async), so one process can hold
+thousands of pending requests, which share the bytes fairly between clients as they arrive. The background reader
+threads of the devices stay the only ones that touch the serial ports.
+
+All other routes are passed to the Flask application in routes.py and run in a bounded thread pool, so both ways of
+serving answer with the same routes and response shapes.
+
+The module has no dependencies beyond the Flask stack, but an ASGI server is needed to run it, for example uvicorn:
+
+    pip3 install uvicorn
+    uvicorn asgi:app
+
+or SERVER=asgi in the .env file, which makes api.py run it with uvicorn.
+"""
+
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import exceptions
+import metrics
+import scheduler
+import system
+from exceptions import GenerationError, QuotaError
+from generation import enforce_min_value, generate_bytes_async, pack_fixed_width, packed_to_hex, MODES, FORMATS
+from routes import app as flask_app
+
+load_dotenv()
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "32"))  # Threads running the routes which are passed to Flask
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi-wsgi")
+
+
+def _json(body, status):
+    return status, [(b'content-type', b'application/json')], (json.dumps(body, separators=(',', ':')) + '\n').encode()
+
+
+def _int_arg(query, name, default):
+    # Like request.args.get(name, default=default, type=int) in Flask
+    try:
+        return int(query[name][0])
+    except (KeyError, ValueError):
+        return default
+
+
+async def get_random_numbers(query, headers, client):
+    """
+    Generates and returns a set of random numbers, like the route of the same name in routes.py.
+
+    Parameters:
+    - query (dict): The parsed query string, mapping names to lists of values.
+    - headers (dict): The request headers, with lower case names.
+    - client (str): The client which sent the request, see scheduler.client_key.
+
+    Returns:
+    - tuple: The status code, the response headers and the response body.
+    """
+    try:
+        if not system.is_initialized():
+            return _json({'message': 'System not initialized'}, 432)
+
+        length = enforce_min_value(_int_arg(query, 'numBits', 1), 1)
+        count = enforce_min_value(_int_arg(query, 'quantity', 1), 1)
+        mode = query.get('mode', ['raw'])[0]
+        if mode not in MODES:
+            return _json({'error': f"Unknown mode '{mode}'"}, 400)
+        accept = parse_accept_header(headers.get('accept'), MIMEAccept)
+        default_format = 'raw' if accept.best == 'application/octet-stream' else 'hex'
+        output_format = query.get('format', [default_format])[0]
+        if output_format not in FORMATS:
+            return _json({'error': f"Unknown format '{output_format}'"}, 400)
+
+        raw_bits = count * length if mode == 'raw' else 0
+        scheduler.scheduler.admit(raw_bits, client)
+        depth, wait = scheduler.scheduler.estimate((raw_bits + 7) // 8, rate=system.source_rate())
+        queue_headers = [(b'x-queue-depth', str(depth).encode())]
+        if wait is not None:
+            queue_headers.append((b'x-estimated-wait', f'{wait:.3f}'.encode()))
+
+        with scheduler.serving(client, scheduler.INTERACTIVE):
+            data = await generate_bytes_async(count * length, mode)
+        metrics.BITS_SERVED.inc(count * length, endpoint='getRandom')
+
+        with metrics.CONVERSION_SECONDS.time(format=output_format):
+            packed = pack_fixed_width(data, count, length)
+            if output_format == 'raw':
+                return 200, [(b'content-type', b'application/octet-stream'), (b'x-num-bits', str(length).encode()),
+                             (b'x-quantity', str(count).encode())] + queue_headers, packed
+            if output_format == 'base64':
+                status, response_headers, body = _json({'numBits': length, 'quantity': count,
+                                                        'width': (length + 7) // 8,
+                                                        'data': base64.b64encode(packed).decode('ascii')}, 200)
+            else:
+                status, response_headers, body = _json(packed_to_hex(packed, count, length), 200)
+            return status, response_headers + queue_headers, body
+    except QuotaError as e:
+        status, response_headers, body = _json({'error': e.message, 'retry_after': e.retry_after}, 429)
+        if e.retry_after is not None:
+            response_headers.append((b'retry-after', str(math.ceil(e.retry_after)).encode()))
+        return status, response_headers, body
+    except (GenerationError, exceptions.SystemError) as e:
+        return _json({'error': str(e)}, 555)
+
+
+# Routes served on the event loop, by method and path
+ASYNC_ROUTES = {
+    ('GET', '/trng/randomNum/getRandom'): get_random_numbers,
+}
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return bytes(body)
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return bytes(body)
+
+
+def _environ(scope, body):
+    """
+    Builds the WSGI environment of an ASGI HTTP request.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': str(client[0]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _call_flask(scope, receive, send):
+    """
+    Runs a request through the Flask application in the thread pool, streaming the response as it is produced.
+    """
+    environ = _environ(scope, await _read_body(receive))
+    loop = asyncio.get_running_loop()
+
+    def forward(message):
+        # Waits until the event loop has sent the message, which also applies backpressure to streamed responses
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }
+            return lambda data: forward({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        iterable = flask_app(environ, start_response)
+        try:
+            forward(response['start'])
+            for chunk in iterable:
+                if chunk:
+                    forward({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            forward({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    await loop.run_in_executor(_executor, run)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            system.start_prep()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    The ASGI application.
+
+    Parameters:
+    - scope (dict): The connection scope.
+    - receive, send (callable): The ASGI message channels.
+    """
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type '{scope['type']}'")
+
+    handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        return await _call_flask(scope, receive, send)
+
+    start = time.perf_counter()
+    await _read_body(receive)
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    client = scheduler.client_key(headers.get(scheduler.CLIENT_HEADER.lower()), (scope.get('client') or ('',))[0])
+    status, response_headers, body = await handler(query, headers, client)
+    # Answer like Flask-Cors does for the routes beginning with '/trng/'
+    response_headers.append((b'access-control-allow-origin', b'*'))
+    response_headers.append((b'content-length', str(len(body)).encode()))
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, route=scope['path'], method=scope['method'],
+                                    status=status)
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,146 @@
+"""
+This script measures the throughput and latency of the statistical tests and the API endpoints.
+
+The API runs against the simulated board of simulator.py, unthrottled and with a fixed seed, so the results are
+reproducible on any machine without the hardware. Every case is run at 10^3 bits up to --max-bits in powers of ten,
+and the best time of --repeat runs is reported.
+
+Save the results of a known good build and compare later builds against them, for example in CI:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.25
+
+The script exits with status 1 if a case got slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Select the simulator before the system modules read their configuration
+os.environ['TRANSPORT'] = 'simulator'
+os.environ['SIMULATOR_RATE'] = '0'
+os.environ['SIMULATOR_FAULT'] = 'none'
+os.environ['SIMULATOR_SEED'] = '2023'
+
+import numpy as np
+
+import pool
+import quality
+import routes
+import system
+import tests
+
+TEST_FUNCTIONS = (
+    tests.frequency_test,
+    tests.runs_test,
+    tests.serial_test,
+    tests.poker_test,
+    tests.cumulative_sums_test,
+    tests.autocorrelation_test,
+    tests.approximate_entropy_test,
+    tests.longest_run_ones_in_a_block_test,
+    tests.frequency_test_within_a_block,
+    tests.run_battery,
+)
+
+
+def measure(function, repeat):
+    """
+    Returns the best run time of function in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def endpoint_cases(bits):
+    """
+    Returns the endpoint requests which transfer the given number of bits, as (name, method, url, body) tuples.
+    """
+    numbers = max(bits // 32, 1)
+    cases = [
+        ('getRandom_hex', 'GET', f'/trng/randomNum/getRandom?numBits=32&quantity={numbers}&format=hex', None),
+        ('getRandom_base64', 'GET', f'/trng/randomNum/getRandom?numBits=32&quantity={numbers}&format=base64', None),
+        ('getRandom_raw', 'GET', f'/trng/randomNum/getRandom?numBits=32&quantity={numbers}&format=raw', None),
+        ('streamTestdata', 'GET', f'/trng/randomNum/streamTestdata?numBits={bits}', None),
+    ]
+    if bits <= pool.pool.high_water * 8:
+        # A batch is served from a single draw, which cannot exceed the pool
+        cases.append(('batch', 'POST', '/trng/randomNum/batch', {'specs': [{'numBits': 32, 'quantity': numbers}]}))
+    if quality.QUALITY_MIN_BITS <= bits <= quality.QUALITY_HISTORY_BYTES * 8:
+        cases.append(('quality', 'GET', f'/trng/quality?numBits={bits}', None))
+    return cases
+
+
+def run(max_bits, repeat):
+    """
+    Runs all cases.
+
+    Returns:
+    - dict: The best run time in seconds and the throughput in bits per second of every case, keyed by
+      '<case>@<bits>'.
+    """
+    results = {}
+    sizes = [10 ** exponent for exponent in range(3, len(str(max_bits))) if 10 ** exponent <= max_bits]
+    rng = np.random.default_rng(2023)
+
+    for bits in sizes:
+        data = rng.bytes(bits // 8)
+        for function in TEST_FUNCTIONS:
+            seconds = measure(lambda: function(data), repeat)
+            results[f'{function.__name__}@{bits}'] = {'seconds': seconds, 'bits_per_second': bits / seconds}
+
+    client = routes.app.test_client()
+    system.initialize()
+    try:
+        for bits in sizes:
+            # Let the quality history hold the window before it is tested
+            client.get(f'/trng/randomNum/streamTestdata?numBits={min(bits, quality.QUALITY_HISTORY_BYTES * 8)}').data
+            for name, method, url, body in endpoint_cases(bits):
+                def request():
+                    response = client.open(url, method=method, json=body)
+                    response.get_data()
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{name} failed with status {response.status_code}")
+                seconds = measure(request, repeat)
+                results[f'{name}@{bits}'] = {'seconds': seconds, 'bits_per_second': bits / seconds}
+    finally:
+        system.shutdown()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the cases which got slower than the baseline by more than the tolerance.
+    """
+    return sorted(case for case, result in results.items()
+                  if case in baseline and result['seconds'] > baseline[case]['seconds'] * (1 + tolerance))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the statistical tests and the API on the simulator.")
+    parser.add_argument('--max-bits', type=int, default=10 ** 7, help="largest case size in bits")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case, the best one is reported")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare with the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    results = run(args.max_bits, args.repeat)
+    for case, result in results.items():
+        print(f"{case:50} {result['seconds'] * 1000:12.3f} ms {result['bits_per_second'] / 1e6:12.3f} Mbit/s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for case in regressions:
+            print(f"Regression: {case}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,154 @@
+"""
+This module contains the deterministic random bit generator used by the 'drbg' output mode.
+
+Raw bytes from the entropy pool are conditioned with SHA-256 and used to seed and periodically reseed an HMAC_DRBG
+(NIST SP 800-90A, section 10.1.2) with SHA-256. The DRBG then expands the seed into output at software speed, so the
+output rate no longer depends on the sensor rate.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+import scheduler
+
+load_dotenv()
+DRBG_SEED_BYTES = int(os.getenv("DRBG_SEED_BYTES", "128"))  # Raw bytes conditioned into each seed
+DRBG_RESEED_BYTES = int(os.getenv("DRBG_RESEED_BYTES", str(1024 * 1024)))  # Output bytes between reseeds
+DRBG_RESEED_SECONDS = float(os.getenv("DRBG_RESEED_SECONDS", "60"))  # Maximum seed age in seconds
+MAX_REQUEST_BYTES = 65536  # SP 800-90A limit of 2^19 bits per generate request
+
+
+def condition(raw):
+    """
+    Conditions raw sensor bytes into a full-entropy seed.
+
+    Parameters:
+    - raw (bytes-like): The raw bytes taken from the entropy pool.
+
+    Returns:
+    - bytes: The 32 byte SHA-256 digest of the raw bytes.
+    """
+    return hashlib.sha256(raw).digest()
+
+
+class HmacDrbg:
+    """
+    HMAC_DRBG with SHA-256 as specified in NIST SP 800-90A.
+
+    Attributes:
+    - key (bytes): The current key K of the internal state.
+    - value (bytes): The current value V of the internal state.
+
+    Description:
+    The generator is instantiated with seed material, can be reseeded with fresh entropy and produces output with
+    generate(). It is not thread-safe; callers are expected to hold a lock.
+    """
+    def __init__(self, entropy, nonce=b'', personalization=b''):
+        self.key = b'\x00' * 32
+        self.value = b'\x01' * 32
+        self._update(entropy + nonce + personalization)
+
+    def _update(self, provided=b''):
+        self.key = hmac.digest(self.key, self.value + b'\x00' + provided, 'sha256')
+        self.value = hmac.digest(self.key, self.value, 'sha256')
+        if provided:
+            self.key = hmac.digest(self.key, self.value + b'\x01' + provided, 'sha256')
+            self.value = hmac.digest(self.key, self.value, 'sha256')
+
+    def reseed(self, entropy):
+        """
+        Mixes fresh entropy into the internal state.
+
+        Parameters:
+        - entropy (bytes): The conditioned entropy input.
+        """
+        self._update(entropy)
+
+    def generate(self, count):
+        """
+        Generates pseudorandom bytes.
+
+        Parameters:
+        - count (int): The number of bytes to generate, at most MAX_REQUEST_BYTES.
+
+        Returns:
+        - bytes: The generated bytes.
+        """
+        if count > MAX_REQUEST_BYTES:
+            raise ValueError("Cannot generate more than MAX_REQUEST_BYTES bytes per request.")
+        blocks = []
+        key, value = self.key, self.value
+        for _ in range(-(-count // 32)):
+            value = hmac.digest(key, value, 'sha256')
+            blocks.append(value)
+        self.value = value
+        self._update()
+        return b''.join(blocks)[:count]
+
+
+_drbg = None
+_bytes_since_seed = 0
+_seeded_at = 0.0
+_lock = threading.Lock()
+
+
+def _seed():
+    """
+    Seeds a new DRBG or reseeds the current one with conditioned bytes from the entropy pool.
+
+    Raises:
+    - GenerationError, SystemError: If the entropy pool cannot deliver the seed bytes.
+    """
+    global _drbg, _bytes_since_seed, _seeded_at
+    entropy = condition(scheduler.scheduler.take(DRBG_SEED_BYTES, atomic=True))
+    if _drbg is None:
+        _drbg = HmacDrbg(entropy, nonce=time.time_ns().to_bytes(8, 'big'))
+    else:
+        _drbg.reseed(entropy)
+    _bytes_since_seed = 0
+    _seeded_at = time.monotonic()
+
+
+def random_bytes(count):
+    """
+    Returns DRBG output seeded from the entropy pool.
+
+    Parameters:
+    - count (int): The number of bytes to generate.
+
+    Returns:
+    - bytes: The generated bytes.
+
+    Raises:
+    - GenerationError, SystemError: If the entropy pool cannot deliver a required seed.
+
+    Description:
+    The DRBG is reseeded before output is generated whenever DRBG_RESEED_BYTES bytes have been produced since the
+    last seed or the seed is older than DRBG_RESEED_SECONDS.
+    """
+    global _bytes_since_seed
+    chunks = []
+    remaining = count
+    with _lock:
+        while remaining > 0:
+            if (_drbg is None or _bytes_since_seed >= DRBG_RESEED_BYTES
+                    or time.monotonic() - _seeded_at >= DRBG_RESEED_SECONDS):
+                _seed()
+            size = min(remaining, MAX_REQUEST_BYTES, DRBG_RESEED_BYTES - _bytes_since_seed)
+            chunks.append(_drbg.generate(size))
+            _bytes_since_seed += size
+            remaining -= size
+    return b''.join(chunks)
+
+
+def reset():
+    """
+    Discards the DRBG state, so the next request seeds a new generator.
+    """
+    global _drbg
+    with _lock:
+        _drbg = None
@@ -0,0 +1,463 @@
+"""
+This module estimates the min-entropy of the sensor output with the non-IID estimators of NIST SP 800-90B, section 6.3.
+
+The statistical tests of tests.py only decide whether the output looks random. The estimators here tell how many bits
+of entropy every byte actually carries, which is needed to size a conditioning ratio and to back up throughput claims:
+
+- most common value (6.3.1), collision (6.3.2), Markov (6.3.3) and compression (6.3.4)
+- t-tuple (6.3.5) and longest repeated substring (6.3.6)
+
+As in SP 800-90B, section 3.1.3, the bytes are tested as 8 bit samples with the estimators which accept any alphabet,
+and their bits with all estimators, limited to the first MAX_BITS bits. The assessed min-entropy per byte is the
+smaller of the byte estimate and eight times the bit estimate.
+
+All estimators count with NumPy arrays. The t-tuple and LRS estimates share one suffix array, built by prefix doubling,
+and its LCP array, from which the tuple counts of every length follow at once, so a capture of 10^6 samples is
+assessed in seconds.
+
+It can be used as a library:
+
+    report = entropy.estimate_capture('2023-06-01_12-00.bin')
+
+or from the command line:
+
+    python entropy.py 2023-06-01_12-00.bin
+"""
+
+import argparse
+import json
+import math
+
+import numpy as np
+
+from exceptions import GenerationError
+import metrics
+import quality
+
+MAX_SAMPLES = 1000000  # Samples assessed per capture
+MAX_BITS = 1000000  # Bits of the bitstring assessed, see SP 800-90B, section 3.1.3
+Z_ALPHA = 2.576  # Upper bound of the 99% confidence interval
+TUPLE_CUTOFF = 35  # Minimum count of the most common tuple in the t-tuple estimate
+COMPRESSION_BLOCK_BITS = 6  # Bits per block of the compression estimate
+COMPRESSION_DICTIONARY = 1000  # Blocks used to initialize the dictionary of the compression estimate
+COMPRESSION_C = 0.5907  # Variance correction of the compression estimate
+MARKOV_LENGTH = 128  # Length of the sequences scored by the Markov estimate
+MIN_SAMPLES = 1000  # Smallest number of bytes assessed
+
+
+def _upper_bound(p, n):
+    """
+    Returns the upper bound of the 99% confidence interval of a probability estimated from n samples.
+    """
+    return min(1.0, p + Z_ALPHA * math.sqrt(p * (1 - p) / (n - 1)))
+
+
+def _min_entropy(p):
+    """
+    Returns the min-entropy -log2(p) of a most likely outcome with probability p, without a negative zero.
+    """
+    return max(0.0, -math.log2(p))
+
+
+def most_common_value(samples):
+    """
+    Most common value estimate, SP 800-90B, section 6.3.1.
+
+    Parameters:
+    - samples (numpy.ndarray): The samples as unsigned integers.
+
+    Returns:
+    - float: The min-entropy per sample.
+    """
+    p = np.bincount(samples).max() / len(samples)
+    return _min_entropy(_upper_bound(p, len(samples)))
+
+
+def _chain(jumps, start=0):
+    """
+    Returns a boolean mask of the indices visited by following jumps from start until it leaves the array.
+
+    Description:
+    Instead of following the chain one step at a time, the jump table is squared log2(n) times and the visited set is
+    built from the largest jumps down, so every level is a single array operation.
+    """
+    n = len(jumps)
+    table = np.append(np.minimum(jumps, n), n)  # n is the absorbing end
+    levels = [table]
+    while 1 << len(levels) < n:
+        levels.append(levels[-1][levels[-1]])
+    visited = np.zeros(n + 1, dtype=bool)
+    visited[start] = True
+    for table in reversed(levels):
+        visited[table[visited]] = True
+    return visited[:n]
+
+
+def collision(bits):
+    """
+    Collision estimate, SP 800-90B, section 6.3.2.
+
+    Parameters:
+    - bits (numpy.ndarray): The samples, zeros and ones.
+
+    Returns:
+    - float: The min-entropy per bit, or None if the sequence is too short.
+
+    Description:
+    For binary samples, every collision takes two samples if the first two are equal and three otherwise, so its mean
+    length is 2 + 2p(1 - p). This closed form replaces the general equation of the standard, which it equals for two
+    symbols.
+    """
+    n = len(bits)
+    times = np.where(bits[:-1] == bits[1:], 2, 3)
+    complete = np.arange(n - 1) + times <= n
+    visited = _chain(np.append(np.arange(n - 1) + times, n))
+    lengths = times[visited[:-1] & complete]
+    if len(lengths) < 2:
+        return None
+    mean = lengths.mean() - Z_ALPHA * lengths.std(ddof=1) / math.sqrt(len(lengths))
+    product = min(0.25, max(0.0, (mean - 2) / 2))
+    p = 0.5 + math.sqrt(0.25 - product)
+    return _min_entropy(p)
+
+
+def markov(bits):
+    """
+    Markov estimate, SP 800-90B, section 6.3.3.
+
+    Parameters:
+    - bits (numpy.ndarray): The samples, zeros and ones.
+
+    Returns:
+    - float: The min-entropy per bit, or None if the sequence is too short.
+    """
+    n = len(bits)
+    if n < 2:
+        return None
+    p1 = bits.mean()
+    p0 = 1 - p1
+    pairs = np.bincount(bits[:-1] * 2 + bits[1:], minlength=4)
+    zeros, ones = pairs[0] + pairs[1], pairs[2] + pairs[3]
+    p00, p01 = (pairs[0] / zeros, pairs[1] / zeros) if zeros else (0.0, 0.0)
+    p10, p11 = (pairs[2] / ones, pairs[3] / ones) if ones else (0.0, 0.0)
+
+    def log2(x):
+        return math.log2(x) if x > 0 else -math.inf
+
+    steps = MARKOV_LENGTH - 1
+    candidates = (
+        log2(p0) + steps * log2(p00),
+        log2(p0) + (steps + 1) // 2 * log2(p01) + steps // 2 * log2(p10),
+        log2(p0) + log2(p01) + (steps - 1) * log2(p11),
+        log2(p1) + log2(p10) + (steps - 1) * log2(p00),
+        log2(p1) + (steps + 1) // 2 * log2(p10) + steps // 2 * log2(p01),
+        log2(p1) + steps * log2(p11),
+    )
+    return min(max(0.0, -max(candidates) / MARKOV_LENGTH), 1.0)
+
+
+def _compression_expectation(p, blocks):
+    """
+    Returns G(p) + (2^b - 1) G(q) of the compression estimate.
+
+    Description:
+    The double sum of G over the block positions t and distances u is reordered to a single sum over u, weighted by
+    the number of positions t it occurs in.
+    """
+    d = COMPRESSION_DICTIONARY
+    v = blocks - d
+    u = np.arange(1, blocks + 1, dtype=np.float64)
+    log_u = np.log2(u)
+    weights = blocks - np.maximum(d, u)  # Positions t > u, for the distances shorter than t
+    tail = u > d  # The distance u = t, for the positions t after the dictionary
+
+    def g(z):
+        if z <= 0 or z >= 1:
+            # No block has the value, or every block repeats its predecessor at distance log2(1) = 0
+            return 0.0
+        powers = np.exp((u - 1) * math.log1p(-z))
+        return (np.sum(log_u * z * z * powers * weights) + np.sum((log_u * z * powers)[tail])) / v
+
+    q = (1 - p) / (2 ** COMPRESSION_BLOCK_BITS - 1)
+    return g(p) + (2 ** COMPRESSION_BLOCK_BITS - 1) * g(q)
+
+
+def compression(bits):
+    """
+    Compression estimate, SP 800-90B, section 6.3.4.
+
+    Parameters:
+    - bits (numpy.ndarray): The samples, zeros and ones.
+
+    Returns:
+    - float: The min-entropy per bit, or None if the sequence is too short.
+    """
+    b = COMPRESSION_BLOCK_BITS
+    d = COMPRESSION_DICTIONARY
+    blocks = len(bits) // b
+    v = blocks - d
+    if v < 2:
+        return None
+    symbols = bits[:blocks * b].reshape(blocks, b) @ (1 << np.arange(b - 1, -1, -1))
+    # Distance of every block to the previous block with the same value, or its 1-based position if there is none
+    order = np.lexsort((np.arange(blocks), symbols))
+    previous = np.full(blocks, -1)
+    same = symbols[order[1:]] == symbols[order[:-1]]
+    previous[order[1:][same]] = order[:-1][same]
+    positions = np.arange(d, blocks)
+    distances = np.where(previous[d:] >= 0, positions - previous[d:], positions + 1)
+    logs = np.log2(distances)
+    mean = logs.mean()
+    sigma = COMPRESSION_C * math.sqrt(max(0.0, (logs ** 2).sum() / (v - 1) - mean ** 2))
+    target = mean - Z_ALPHA * sigma / math.sqrt(v)
+
+    low, high = 2.0 ** -b, 1.0
+    if _compression_expectation(low, blocks) <= target:
+        return 1.0
+    for _ in range(60):
+        middle = (low + high) / 2
+        if _compression_expectation(middle, blocks) > target:
+            low = middle
+        else:
+            high = middle
+    return _min_entropy(high) / b
+
+
+def suffix_array(samples):
+    """
+    Builds the suffix array of a sequence by prefix doubling.
+
+    Parameters:
+    - samples (numpy.ndarray): The samples as unsigned integers.
+
+    Returns:
+    - tuple: The suffix array, and the rank of every suffix by its first 2^j samples for j = 0, 1, ... until all ranks
+      differ. The ranks are needed by lcp_array.
+    """
+    n = len(samples)
+    rank = np.unique(samples, return_inverse=True)[1].astype(np.int64)
+    levels = [rank.astype(np.int32)]
+    step = 1
+    while rank.max() < n - 1:
+        second = np.zeros(n, dtype=np.int64)
+        second[:n - step] = rank[step:] + 1
+        key = rank * (n + 1) + second
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        levels.append(rank.astype(np.int32))
+        step *= 2
+    return np.argsort(rank, kind='stable'), levels
+
+
+def lcp_array(sa, levels):
+    """
+    Returns the length of the longest common prefix of every two neighbours in the suffix array.
+
+    Description:
+    The prefix ranks of suffix_array compare 2^j samples at once, so the common prefix of all neighbours is extended
+    from the longest power of two down in one array operation per level.
+    """
+    n = len(sa)
+    first, second = sa[:-1], sa[1:]
+    lengths = np.zeros(n - 1, dtype=np.int64)
+    for j in reversed(range(len(levels))):
+        step = 1 << j
+        a, b = first + lengths, second + lengths
+        equal = (a + step <= n) & (b + step <= n)
+        equal[equal] = levels[j][a[equal]] == levels[j][b[equal]]
+        lengths += step * equal
+    return lengths
+
+
+def _nearest_smaller(values, strict_left=True, strict_right=True):
+    """
+    Returns for every position the index of the nearest smaller value on the left (or -1) and on the right (or n).
+
+    Parameters:
+    - values (numpy.ndarray): The values.
+    - strict_left, strict_right (bool): False to stop at equal values as well on that side.
+
+    Description:
+    A sparse table of range minima lets every position skip 2^j values at once, from the largest j down.
+    """
+    n = len(values)
+    tables = [values]
+    while 1 << len(tables) <= n:
+        half = 1 << (len(tables) - 1)
+        tables.append(np.minimum(tables[-1][:-half], tables[-1][half:]))
+    left = np.arange(n)
+    right = np.arange(n) + 1
+    for j in reversed(range(len(tables))):
+        step = 1 << j
+        table = tables[j]
+        candidate = left - step
+        ok = candidate >= 0
+        window = table[candidate[ok]]
+        ok[ok] = window >= values[ok] if strict_left else window > values[ok]
+        left = np.where(ok, candidate, left)
+        ok = right + step <= n
+        window = table[right[ok]]
+        ok[ok] = window >= values[ok] if strict_right else window > values[ok]
+        right = np.where(ok, right + step, right)
+    return left - 1, right
+
+
+def tuple_estimates(samples):
+    """
+    t-tuple and longest repeated substring (LRS) estimates, SP 800-90B, sections 6.3.5 and 6.3.6.
+
+    Parameters:
+    - samples (numpy.ndarray): The samples as unsigned integers.
+
+    Returns:
+    - tuple: The min-entropy per sample of the t-tuple and of the LRS estimate. Either is None if it does not apply,
+      because no sample occurs often enough or no tuple longer than t repeats.
+
+    Description:
+    Suffixes which share their first W samples are neighbours in the suffix array, so the occurrences of every W-tuple
+    form a run of LCP values >= W. For every LCP value, the size of its run and the number of suffix pairs whose
+    common prefix it is follow from the nearest smaller values, which gives the most common count and the number of
+    colliding pairs for all tuple lengths at once. Both only change at the LCP values, where the estimates take their
+    maximum, so only those lengths are evaluated.
+    """
+    n = len(samples)
+    lcp = lcp_array(*suffix_array(samples)).astype(np.int32)
+    left, right = _nearest_smaller(lcp)
+    run_sizes = right - left  # Suffixes sharing the first lcp[k] samples with the suffixes at k and k + 1
+    left, right_or_equal = _nearest_smaller(lcp, strict_right=False)
+    pair_counts = (np.arange(n - 1) - left) * (right_or_equal - np.arange(n - 1))
+
+    order = np.argsort(-lcp, kind='stable')
+    values = lcp[order]
+    last = np.concatenate((values[1:] != values[:-1], [True]))  # Last entry of every distinct value
+    lengths = values[last]  # Distinct LCP values, descending
+    max_counts = np.maximum.accumulate(run_sizes[order])[last]  # Most common count of the tuples of that length
+    pairs = np.cumsum(pair_counts[order])[last]  # Colliding pairs among the tuples of that length
+    keep = lengths > 0
+    lengths, max_counts, pairs = lengths[keep].astype(np.float64), max_counts[keep], pairs[keep]
+
+    frequent = max_counts >= TUPLE_CUTOFF
+    t = int(lengths[frequent].max()) if frequent.any() else 0
+    t_tuple = lrs = None
+    if t:
+        selected = lengths <= t
+        probabilities = max_counts[selected] / (n - lengths[selected] + 1)
+        p = np.max(probabilities ** (1.0 / lengths[selected]))
+        t_tuple = _min_entropy(_upper_bound(p, n))
+    selected = lengths > t
+    if selected.any():
+        w = lengths[selected]
+        probabilities = pairs[selected] / ((n - w + 1) * (n - w) / 2)
+        p = np.max(probabilities ** (1.0 / w))
+        lrs = _min_entropy(_upper_bound(p, n))
+    return t_tuple, lrs
+
+
+def estimate(data, bits=False):
+    """
+    Estimates the min-entropy of a sequence.
+
+    Parameters:
+    - data (bytes-like or numpy.ndarray): The bytes to assess, or zeros and ones if bits is True.
+    - bits (bool): True if data holds one bit per sample instead of bytes.
+
+    Returns:
+    - dict: The number of bytes and bits assessed, the min-entropy per byte and per bit, and the estimate of every
+      estimator for the byte samples ('bytes', empty for bit input) and for the bitstring ('bitstring'). Estimators
+      which do not apply are None.
+
+    Raises:
+    - ValueError: If there are fewer than MIN_SAMPLES bytes.
+    """
+    samples = np.asarray(data, dtype=np.uint8) if isinstance(data, np.ndarray) else np.frombuffer(data, np.uint8)
+    if bits:
+        bitstring = samples[:MAX_BITS]
+    else:
+        samples = samples[:MAX_SAMPLES]
+        bitstring = np.unpackbits(samples)[:MAX_BITS]
+    if len(bitstring) < MIN_SAMPLES * 8:
+        raise ValueError(f"At least {MIN_SAMPLES * 8} bits are needed for an entropy estimate.")
+
+    byte_results = {}
+    if not bits:
+        t_tuple, lrs = tuple_estimates(samples)
+        byte_results = {
+            'most_common_value': most_common_value(samples),
+            't_tuple': t_tuple,
+            'longest_repeated_substring': lrs,
+        }
+    t_tuple, lrs = tuple_estimates(bitstring)
+    bit_results = {
+        'most_common_value': most_common_value(bitstring),
+        'collision': collision(bitstring),
+        'markov': markov(bitstring),
+        'compression': compression(bitstring),
+        't_tuple': t_tuple,
+        'longest_repeated_substring': lrs,
+    }
+    per_bit = min(value for value in bit_results.values() if value is not None)
+    per_byte = min([value for value in byte_results.values() if value is not None] + [8 * per_bit])
+    return {
+        'bytes_assessed': len(bitstring) // 8 if bits else len(samples),
+        'bits_assessed': len(bitstring),
+        'min_entropy_per_byte': per_byte,
+        'min_entropy_per_bit': per_byte / 8,
+        'bytes': byte_results,
+        'bitstring': bit_results,
+    }
+
+
+def estimate_capture(path, length=None):
+    """
+    Estimates the min-entropy of a capture written by generate_random_numbers_to_file.
+
+    Parameters:
+    - path (str): The capture file. Files ending in '.txt' are read as '0' and '1' characters, all others as bytes.
+    - length (int): Optional number of samples to assess, at most MAX_SAMPLES bytes or MAX_BITS bits.
+
+    Returns:
+    - dict: The estimates, see estimate.
+    """
+    text = path.endswith('.txt')
+    limit = MAX_BITS if text else MAX_SAMPLES
+    count = limit if length is None else min(length, limit)
+    data = np.fromfile(path, dtype=np.uint8, count=count)
+    if text:
+        return estimate(data - ord('0'), bits=True)
+    return estimate(data)
+
+
+def history_entropy(num_bytes=None):
+    """
+    Estimates the min-entropy of the most recent bytes delivered by the devices, see quality.History.
+
+    Parameters:
+    - num_bytes (int): The number of bytes to assess. Defaults to all bytes kept by the history.
+
+    Returns:
+    - dict: The sequence number of the assessed data and the estimates, see estimate.
+
+    Raises:
+    - ValueError: If num_bytes is smaller than MIN_SAMPLES or larger than the history.
+    - GenerationError: If the history does not hold enough bytes yet.
+    """
+    if num_bytes is None:
+        num_bytes = max(quality.history.level, MIN_SAMPLES)
+    if num_bytes < MIN_SAMPLES or num_bytes > min(quality.QUALITY_HISTORY_BYTES, MAX_SAMPLES):
+        raise ValueError(f"numBytes must be between {MIN_SAMPLES} and "
+                         f"{min(quality.QUALITY_HISTORY_BYTES, MAX_SAMPLES)}.")
+    sequence, data = quality.history.recent(num_bytes)
+    if len(data) < num_bytes:
+        raise GenerationError(f"Only {len(data)} bytes have been collected so far.")
+    with metrics.STATISTICAL_TEST_SECONDS.time(source='entropy'):
+        return {'sequence': sequence, **estimate(data)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estimate the min-entropy of a capture with SP 800-90B estimators.")
+    parser.add_argument('path', help="the .bin or .txt capture to assess")
+    parser.add_argument('--samples', type=int, help="number of samples to assess, default: as many as allowed")
+    args = parser.parse_args()
+    print(json.dumps(estimate_capture(args.path, args.samples), indent=2))
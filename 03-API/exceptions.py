@@ -33,3 +33,16 @@ class SystemError(Exception):
     """
     def __init__(self, message):
         self.message = message
+
+
+class QuotaError(Exception):
+    """
+    Exception raised when a client has used up its share of the entropy source, see scheduler.py.
+
+    Attributes:
+    - message (str): Explanation of the error.
+    - retry_after (float): The number of seconds after which the request can be served.
+    """
+    def __init__(self, message, retry_after):
+        self.message = message
+        self.retry_after = retry_after
@@ -0,0 +1,252 @@
+"""
+This module contains randomness extractors, which turn the biased and correlated bits of the sensor into fewer, nearly
+uniform bits.
+
+The board takes the least significant bits of its analog readings, which are neither unbiased nor independent. With
+EXTRACTOR in the .env file, the bytes of every device pass one of the extractors after the health tests and before they
+are mixed into the entropy pool:
+
+- 'von_neumann': Looks at pairs of bits and outputs the first bit of every pair whose bits differ. The output of
+  independent bits is unbiased, but at most a quarter of the input is kept.
+- 'peres': The iterated von Neumann extractor of Peres (1992), which also extracts the bits von Neumann discards from
+  the XOR of every pair and from the pairs of equal bits, up to PERES_DEPTH levels deep. It approaches the entropy of
+  independent biased bits. The stream is split into blocks of PERES_BLOCK_BITS bits, which are extracted one by one.
+- 'toeplitz': Multiplies blocks of TOEPLITZ_INPUT_BITS bits with a seeded random Toeplitz matrix over GF(2). This is a
+  universal hash, so by the leftover hash lemma its output is within 2^-EPSILON_EXPONENT of uniform as long as every
+  block holds TOEPLITZ_OUTPUT_BITS + 2 * EPSILON_EXPONENT bits of min-entropy, also if the bits are correlated. The
+  default output size follows from HEALTH_MIN_ENTROPY, so it keeps as many bits as the assessed entropy allows.
+
+All extractors work on NumPy arrays of unpacked bits, and the Toeplitz products are computed as one matrix product of
+all complete blocks. Every extractor counts its input and output bits, and the efficiency is reported in /trng/devices.
+
+The extractors can be compared on a capture written by the test data endpoints:
+
+    python extractors.py 2023-06-01_12-00.bin
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import secrets
+
+import numpy as np
+from dotenv import load_dotenv
+
+import health
+
+load_dotenv()
+PERES_DEPTH = int(os.getenv("PERES_DEPTH", "5"))  # Levels of recursion of the Peres extractor
+PERES_BLOCK_BITS = int(os.getenv("PERES_BLOCK_BITS", "8192"))  # Bits per block of the Peres extractor
+TOEPLITZ_INPUT_BITS = int(os.getenv("TOEPLITZ_INPUT_BITS", "4096"))  # Bits per block of the Toeplitz extractor
+EPSILON_EXPONENT = 64  # The Toeplitz output is within 2^-64 of uniform in statistical distance
+TOEPLITZ_OUTPUT_BITS = int(os.getenv("TOEPLITZ_OUTPUT_BITS", str(
+    int(TOEPLITZ_INPUT_BITS * health.HEALTH_MIN_ENTROPY / 8) - 2 * EPSILON_EXPONENT)))  # Bits extracted per block
+TOEPLITZ_SEED = os.getenv("TOEPLITZ_SEED")  # Seed of the Toeplitz matrix, a new random seed per start if omitted
+
+
+def unpack(data):
+    """
+    Returns the bits of bytes, most significant bit first, as a NumPy array of zeros and ones.
+    """
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+def von_neumann(bits):
+    """
+    Applies the von Neumann extractor.
+
+    Parameters:
+    - bits (numpy.ndarray): The input bits. A trailing odd bit is ignored.
+
+    Returns:
+    - numpy.ndarray: The first bit of every pair of different bits.
+
+    Example usage:
+    >>> von_neumann(np.array([0, 1, 1, 1, 1, 0, 0, 0], dtype=np.uint8))
+    array([0, 1], dtype=uint8)
+    """
+    pairs = bits[:len(bits) // 2 * 2].reshape(-1, 2)
+    return pairs[pairs[:, 0] != pairs[:, 1], 0]
+
+
+def peres(bits, depth=PERES_DEPTH):
+    """
+    Applies the iterated von Neumann extractor of Peres.
+
+    Parameters:
+    - bits (numpy.ndarray): The input bits. A trailing odd bit is ignored.
+    - depth (int): The number of levels of recursion. A depth of 1 is the von Neumann extractor.
+
+    Returns:
+    - numpy.ndarray: The von Neumann output of the bits, followed by the Peres output of the XOR of every pair and of
+      the first bits of the pairs of equal bits.
+
+    Description:
+    For independent bits with bias p, the output rate approaches the entropy H(p) per input bit as the depth grows,
+    where von Neumann keeps only p(1 - p) bits.
+
+    Example usage:
+    >>> peres(np.array([0, 1, 1, 1, 1, 0, 0, 0], dtype=np.uint8), 2)
+    array([0, 1, 1, 1, 1], dtype=uint8)
+    """
+    if depth < 1 or len(bits) < 2:
+        return bits[:0]
+    pairs = bits[:len(bits) // 2 * 2].reshape(-1, 2)
+    equal = pairs[:, 0] == pairs[:, 1]
+    return np.concatenate((pairs[~equal, 0], peres(pairs[:, 0] ^ pairs[:, 1], depth - 1),
+                           peres(pairs[equal, 0], depth - 1)))
+
+
+def toeplitz_matrix(seed, input_bits, output_bits):
+    """
+    Builds the Toeplitz matrix of a seed.
+
+    Parameters:
+    - seed (bytes): The seed, which is expanded with SHAKE-256 to the input_bits + output_bits - 1 bits which define
+      the matrix.
+    - input_bits (int): The number of columns.
+    - output_bits (int): The number of rows.
+
+    Returns:
+    - numpy.ndarray: The transposed matrix, input_bits x output_bits, as float32 for a fast exact matrix product.
+    """
+    if not 0 < output_bits <= input_bits:
+        raise ValueError("The Toeplitz extractor needs 0 < output bits <= input bits.")
+    size = input_bits + output_bits - 1
+    diagonals = unpack(hashlib.shake_256(seed).digest((size + 7) // 8))[:size]
+    # Row i holds diagonals[i + input_bits - 1 - j] in column j, so every diagonal is constant
+    matrix = np.lib.stride_tricks.sliding_window_view(diagonals, input_bits)[:output_bits, ::-1]
+    return np.ascontiguousarray(matrix.T, dtype=np.float32)
+
+
+def toeplitz(bits, matrix):
+    """
+    Applies the Toeplitz extractor to all complete blocks of the input.
+
+    Parameters:
+    - bits (numpy.ndarray): The input bits. Bits after the last complete block are ignored.
+    - matrix (numpy.ndarray): The transposed Toeplitz matrix, see toeplitz_matrix.
+
+    Returns:
+    - numpy.ndarray: The product of the matrix with every block over GF(2), one block after the other.
+
+    Description:
+    The sums of the matrix product are at most the block size, so they are exact in float32, and their parity is the
+    product over GF(2).
+    """
+    input_bits = matrix.shape[0]
+    blocks = bits[:len(bits) // input_bits * input_bits].reshape(-1, input_bits).astype(np.float32)
+    return ((blocks @ matrix).astype(np.int64) & 1).astype(np.uint8).ravel()
+
+
+class Extractor:
+    """
+    Applies an extractor to a byte stream.
+
+    Attributes:
+    - name (str): The name of the extractor.
+    - input_bits (int): The number of bits fed to the extractor.
+    - output_bits (int): The number of bits it returned.
+
+    Description:
+    Input bits are buffered until a complete block arrives, and output bits until they fill whole bytes. The function
+    is applied to all complete blocks at once and must extract every block on its own, so the output does not depend
+    on how the stream is split into reads. The class is not thread-safe; every device has its own extractor, which
+    only its reader thread feeds.
+    """
+    def __init__(self, name, function, block_bits):
+        self.name = name
+        self.input_bits = 0
+        self.output_bits = 0
+        self._function = function
+        self._block_bits = block_bits
+        self._pending = np.zeros(0, dtype=np.uint8)
+        self._output = np.zeros(0, dtype=np.uint8)
+
+    def feed(self, data):
+        """
+        Extracts random bits from bytes.
+
+        Parameters:
+        - data (bytes-like): The input bytes.
+
+        Returns:
+        - bytes: The extracted bits which fill whole bytes. The others are kept for the next call.
+        """
+        self.input_bits += len(data) * 8
+        bits = np.concatenate((self._pending, unpack(data)))
+        complete = len(bits) // self._block_bits * self._block_bits
+        self._pending = bits[complete:]
+        extracted = self._function(bits[:complete])
+        self.output_bits += len(extracted)
+        output = np.concatenate((self._output, extracted))
+        whole = len(output) // 8 * 8
+        self._output = output[whole:]
+        return np.packbits(output[:whole]).tobytes()
+
+    def efficiency(self):
+        """
+        Returns the fraction of input bits which were kept, or None before the first input.
+        """
+        return self.output_bits / self.input_bits if self.input_bits else None
+
+    def stats(self):
+        """
+        Returns the name of the extractor and its bit counts, suitable for a JSON response.
+        """
+        return {'name': self.name, 'input_bits': self.input_bits, 'output_bits': self.output_bits,
+                'efficiency': self.efficiency()}
+
+
+def create(name, seed=None):
+    """
+    Creates an extractor with the settings of the .env file.
+
+    Parameters:
+    - name (str): 'von_neumann', 'peres' or 'toeplitz'.
+    - seed (bytes): The seed of the Toeplitz matrix. Defaults to TOEPLITZ_SEED, or a random seed if that is not set.
+
+    Returns:
+    - Extractor: The extractor.
+
+    Raises:
+    - ValueError: If the name is unknown or the Toeplitz sizes are invalid.
+    """
+    if name == 'von_neumann':
+        return Extractor(name, von_neumann, 2)
+    if name == 'peres':
+        return Extractor(name, lambda bits: np.concatenate(
+            [peres(block, PERES_DEPTH) for block in bits.reshape(-1, PERES_BLOCK_BITS)] or [bits[:0]]),
+            PERES_BLOCK_BITS)
+    if name == 'toeplitz':
+        if seed is None:
+            seed = TOEPLITZ_SEED.encode() if TOEPLITZ_SEED else secrets.token_bytes(32)
+        matrix = toeplitz_matrix(seed, TOEPLITZ_INPUT_BITS, TOEPLITZ_OUTPUT_BITS)
+        return Extractor(name, lambda bits: toeplitz(bits, matrix), TOEPLITZ_INPUT_BITS)
+    raise ValueError(f"Unknown extractor '{name}'")
+
+
+def compare(data):
+    """
+    Runs every extractor over the same bytes.
+
+    Parameters:
+    - data (bytes-like): The raw bytes.
+
+    Returns:
+    - dict: The statistics of every extractor, see Extractor.stats, together with the share of ones in its output.
+    """
+    report = {}
+    for name in ('von_neumann', 'peres', 'toeplitz'):
+        extractor = create(name)
+        output = unpack(extractor.feed(data))
+        report[name] = {**extractor.stats(), 'ones': float(output.mean()) if len(output) else None}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the efficiency of the randomness extractors on a capture.")
+    parser.add_argument('path', help="the .bin capture of raw bytes to extract from")
+    args = parser.parse_args()
+    print(json.dumps(compare(np.fromfile(args.path, dtype=np.uint8)), indent=2))
@@ -0,0 +1,209 @@
+"""
+This module contains the continuous health tests which are run on the raw byte stream of the serial device.
+
+The Repetition Count Test and the Adaptive Proportion Test follow NIST SP 800-90B, section 4.4. Both keep constant
+state and look at each byte once, so they can run in the ingest path before any byte reaches the entropy pool.
+"""
+
+import math
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+HEALTH_MIN_ENTROPY = float(os.getenv("HEALTH_MIN_ENTROPY", "2"))  # Assessed min-entropy per byte, in bits
+HEALTH_WINDOW = int(os.getenv("HEALTH_WINDOW", "512"))  # Adaptive Proportion Test window size, in bytes
+HEALTH_FAILURE_LIMIT = int(os.getenv("HEALTH_FAILURE_LIMIT", "3"))  # Consecutive bad windows before total failure
+ALPHA_EXPONENT = 20  # False positive probability of 2^-20 per test, as recommended by SP 800-90B
+
+
+def repetition_count_cutoff(min_entropy, alpha_exponent=ALPHA_EXPONENT):
+    """
+    Computes the cutoff of the Repetition Count Test.
+
+    Parameters:
+    - min_entropy (float): The assessed min-entropy per sample, in bits.
+    - alpha_exponent (int): The false positive probability is 2 ** -alpha_exponent.
+
+    Returns:
+    - int: The number of identical consecutive samples at which the test fails.
+
+    Example usage:
+    >>> repetition_count_cutoff(2)
+    11
+    """
+    return 1 + math.ceil(alpha_exponent / min_entropy)
+
+
+def adaptive_proportion_cutoff(min_entropy, window, alpha_exponent=ALPHA_EXPONENT):
+    """
+    Computes the cutoff of the Adaptive Proportion Test.
+
+    Parameters:
+    - min_entropy (float): The assessed min-entropy per sample, in bits.
+    - window (int): The number of samples in one test window.
+    - alpha_exponent (int): The false positive probability is 2 ** -alpha_exponent.
+
+    Returns:
+    - int: The number of occurrences of the first sample of a window at which the test fails.
+
+    Description:
+    The cutoff is 1 + critbinom(window, 2 ** -min_entropy, 1 - alpha) as defined in SP 800-90B, where critbinom is
+    the smallest count whose binomial cumulative distribution function reaches 1 - alpha.
+
+    Example usage:
+    >>> adaptive_proportion_cutoff(2, 512)
+    177
+    """
+    p = 2 ** -min_entropy
+    trials = window
+    alpha = 2 ** -alpha_exponent
+    if p >= 1:
+        return window
+    probability = (1 - p) ** trials
+    cumulative = probability
+    k = 0
+    while cumulative < 1 - alpha and k < trials:
+        probability *= (trials - k) / (k + 1) * p / (1 - p)
+        k += 1
+        cumulative += probability
+    return min(1 + k, window)
+
+
+class HealthMonitor:
+    """
+    Runs the Repetition Count Test and the Adaptive Proportion Test over a byte stream and quarantines bad windows.
+
+    Attributes:
+    - rct_cutoff (int): The Repetition Count Test cutoff.
+    - apt_cutoff (int): The Adaptive Proportion Test cutoff.
+    - window (int): The window size in bytes. Bytes are released in whole windows.
+
+    Description:
+    feed() runs both tests on every incoming byte and buffers the bytes of the current window. When the window is
+    complete it is released if neither test failed inside it, otherwise it is dropped and counted as quarantined.
+    After HEALTH_FAILURE_LIMIT consecutive quarantined windows the monitor reports a total failure until a window
+    passes again.
+    """
+    def __init__(self, min_entropy=HEALTH_MIN_ENTROPY, window=HEALTH_WINDOW, failure_limit=HEALTH_FAILURE_LIMIT):
+        self.rct_cutoff = repetition_count_cutoff(min_entropy)
+        self.apt_cutoff = adaptive_proportion_cutoff(min_entropy, window)
+        self.window = window
+        self.failure_limit = failure_limit
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the test state, the buffered window and all counters.
+        """
+        with self._lock:
+            self._rct_value = None
+            self._rct_count = 0
+            self._apt_value = None
+            self._apt_count = 0
+            self._buffer = bytearray()
+            self._window_failed = False
+            self.bytes_tested = 0
+            self.windows_passed = 0
+            self.windows_quarantined = 0
+            self.rct_failures = 0
+            self.apt_failures = 0
+            self.consecutive_failures = 0
+
+    @property
+    def total_failure(self):
+        """
+        Returns True if the last HEALTH_FAILURE_LIMIT windows have all been quarantined.
+        """
+        return self.consecutive_failures >= self.failure_limit
+
+    def feed(self, data):
+        """
+        Runs the health tests on new bytes.
+
+        Parameters:
+        - data (bytes-like): The raw bytes read from the device.
+
+        Returns:
+        - bytes: The bytes of all windows completed by this call which passed both tests.
+        """
+        released = bytearray()
+        with self._lock:
+            for value in data:
+                # Repetition Count Test
+                if value == self._rct_value:
+                    self._rct_count += 1
+                    if self._rct_count >= self.rct_cutoff:
+                        self.rct_failures += 1
+                        self._window_failed = True
+                        self._rct_count = 1
+                else:
+                    self._rct_value = value
+                    self._rct_count = 1
+
+                # Adaptive Proportion Test, its windows are aligned with the quarantine windows
+                if not self._buffer:
+                    self._apt_value = value
+                    self._apt_count = 1
+                elif value == self._apt_value:
+                    self._apt_count += 1
+                    if self._apt_count == self.apt_cutoff:
+                        self.apt_failures += 1
+                        self._window_failed = True
+
+                self._buffer.append(value)
+                if len(self._buffer) == self.window:
+                    if self._window_failed:
+                        self.windows_quarantined += 1
+                        self.consecutive_failures += 1
+                    else:
+                        released += self._buffer
+                        self.windows_passed += 1
+                        self.consecutive_failures = 0
+                    self._buffer = bytearray()
+                    self._window_failed = False
+            self.bytes_tested += len(data)
+        return bytes(released)
+
+    def stats(self):
+        """
+        Returns the cutoffs and counters of the health tests.
+
+        Returns:
+        - dict: The current counters, suitable for a JSON response.
+        """
+        with self._lock:
+            return {
+                'rct_cutoff': self.rct_cutoff,
+                'apt_cutoff': self.apt_cutoff,
+                'window': self.window,
+                'bytes_tested': self.bytes_tested,
+                'windows_passed': self.windows_passed,
+                'windows_quarantined': self.windows_quarantined,
+                'rct_failures': self.rct_failures,
+                'apt_failures': self.apt_failures,
+                'total_failure': self.total_failure,
+            }
+
+
+def combined_stats(stats):
+    """
+    Combines the health test counters of several devices.
+
+    Parameters:
+    - stats (list): The results of HealthMonitor.stats() of the devices.
+
+    Returns:
+    - dict: The counters summed over the devices. total_failure is True if all devices report a total failure, as no
+      healthy data is produced then.
+    """
+    combined = {
+        'rct_cutoff': repetition_count_cutoff(HEALTH_MIN_ENTROPY),
+        'apt_cutoff': adaptive_proportion_cutoff(HEALTH_MIN_ENTROPY, HEALTH_WINDOW),
+        'window': HEALTH_WINDOW,
+        'total_failure': bool(stats) and all(entry['total_failure'] for entry in stats),
+    }
+    for key in ('bytes_tested', 'windows_passed', 'windows_quarantined', 'rct_failures', 'apt_failures'):
+        combined[key] = sum(entry[key] for entry in stats)
+    return combined
@@ -0,0 +1,232 @@
+"""
+This module contains the background jobs which generate test data captures.
+
+A capture at hardware speed can take from seconds to hours, so generateTestdata only submits a job and returns its ID.
+The job runs on a worker pool and its progress and result can be fetched by ID later on.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from exceptions import GenerationError, SystemError
+import generation
+import metrics
+import scheduler
+import system
+
+load_dotenv()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Number of captures generated at the same time
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "100"))  # Number of jobs which are remembered
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+class Job:
+    """
+    A test data capture which is generated in the background.
+
+    Attributes:
+    - id (str): The unique job ID.
+    - length (int): The number of random bits to generate.
+    - filetype (str): 'bin' or 'txt'.
+    - mode (str): The output mode, see generation.read_bytes.
+    - client (str): The client which requested the capture, see scheduler.client_key.
+    - path (str): The file the capture is written to.
+    - status (str): One of 'queued', 'running', 'finished' or 'failed'.
+    - bits_collected (int): The number of bits written so far.
+    - error (str): Explanation of the error if the job failed.
+    """
+    def __init__(self, length, filetype, mode='raw', client=scheduler.LOCAL):
+        self.id = uuid.uuid4().hex
+        self.length = length
+        self.filetype = filetype
+        self.mode = mode
+        self.client = client
+        self.path = generation.capture_filepath(filetype, self.id[:8])
+        self.status = QUEUED
+        self.bits_collected = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        """
+        Marks the job as running.
+        """
+        self.status = RUNNING
+        self.started_at = time.time()
+
+    def advance(self, bits_collected):
+        """
+        Records the number of bits written so far.
+
+        Parameters:
+        - bits_collected (int): The number of bits written so far.
+        """
+        self.bits_collected = bits_collected
+
+    def finish(self):
+        """
+        Marks the job as finished successfully.
+        """
+        self.bits_collected = self.length
+        self.status = FINISHED
+        self.finished_at = time.time()
+
+    def fail(self, message):
+        """
+        Marks the job as failed.
+
+        Parameters:
+        - message (str): Explanation of the error.
+        """
+        self.error = message
+        self.status = FAILED
+        self.finished_at = time.time()
+
+    def eta(self):
+        """
+        Estimates the remaining run time from the rate observed so far.
+
+        Returns:
+        - float: The estimated number of seconds until the job finishes, or None if no estimate is possible yet.
+        """
+        if self.status == FINISHED:
+            return 0.0
+        if self.status != RUNNING or self.bits_collected == 0:
+            return None
+        rate = self.bits_collected / max(time.time() - self.started_at, 1e-6)
+        return (self.length - self.bits_collected) / rate
+
+    def progress(self):
+        """
+        Returns the state of the job.
+
+        Returns:
+        - dict: The job state, suitable for a JSON response.
+        """
+        stats = system.health_stats()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'numBits': self.length,
+            'filetype': self.filetype,
+            'mode': self.mode,
+            'bits_collected': self.bits_collected,
+            'eta_seconds': self.eta(),
+            'health': {
+                'total_failure': stats['total_failure'],
+                'windows_quarantined': stats['windows_quarantined'],
+            },
+            'error': self.error,
+        }
+
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='capture')
+
+
+def register(job):
+    """
+    Adds a job to the registry, forgetting the oldest jobs beyond JOB_HISTORY.
+
+    Parameters:
+    - job (Job): The job to register.
+
+    Description:
+    Only jobs which have finished or failed are forgotten, and their capture files are deleted, since they can no
+    longer be fetched by ID. Jobs which are still queued or running are kept until a later registration, so the
+    registry may briefly hold more than JOB_HISTORY jobs.
+    """
+    with _lock:
+        _jobs[job.id] = job
+        excess = len(_jobs) - JOB_HISTORY
+        evicted = [old for old in _jobs.values() if old.status in (FINISHED, FAILED)][:max(excess, 0)]
+        for old in evicted:
+            del _jobs[old.id]
+    for old in evicted:
+        try:
+            os.remove(old.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error occurred while deleting capture {old.id}: {str(e)}")
+
+
+def _run(job):
+    """
+    Generates the capture of a job and records the outcome.
+
+    Parameters:
+    - job (Job): The job to run.
+
+    Description:
+    The capture draws from the entropy pool as a bulk request of the client which submitted it, see scheduler.py.
+    """
+    job.start()
+    try:
+        with scheduler.serving(job.client, scheduler.BULK):
+            generation.write_capture(job.path, job.length, job.filetype, job.mode, job.advance)
+        job.finish()
+        metrics.BITS_SERVED.inc(job.length, endpoint='generateTestdata')
+    except (GenerationError, SystemError) as e:
+        print(f"Error occurred while generating capture {job.id}: {str(e)}")
+        job.fail(str(e))
+    except IOError as e:
+        print(f"IOError occurred while writing capture {job.id}: {str(e)}")
+        job.fail(str(e))
+
+
+def submit(length, filetype, mode='raw', client=scheduler.LOCAL):
+    """
+    Creates a capture job and schedules it on the worker pool.
+
+    Parameters:
+    - length (int): The number of random bits to generate.
+    - filetype (str): 'bin' or 'txt'.
+    - mode (str): The output mode, see generation.read_bytes.
+    - client (str): The client which requested the capture, see scheduler.client_key.
+
+    Returns:
+    - Job: The submitted job.
+    """
+    job = Job(length, filetype, mode, client)
+    register(job)
+    _executor.submit(_run, job)
+    return job
+
+
+def get(job_id):
+    """
+    Looks up a job by its ID.
+
+    Parameters:
+    - job_id (str): The job ID.
+
+    Returns:
+    - Job: The job, or None if the ID is unknown.
+    """
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def latest_finished():
+    """
+    Returns the most recently finished job.
+
+    Returns:
+    - Job: The job which finished last, or None if no job has finished yet.
+    """
+    with _lock:
+        finished = [job for job in _jobs.values() if job.status == FINISHED]
+    return max(finished, key=lambda job: job.finished_at, default=None)
@@ -0,0 +1,202 @@
+"""
+This module contains the counters, gauges and histograms exposed on the /metrics endpoint.
+
+The metrics are rendered in the Prometheus text exposition format, so any Prometheus server can scrape them. The
+few metric types needed here are implemented directly instead of adding a client library as a dependency.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base class of all metrics.
+
+    Attributes:
+    - name (str): The metric name.
+    - help (str): The description shown in the exposition.
+    - labels (tuple): The names of the labels which split the metric into series.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric {self.name} expects the labels {self.labels}.")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """
+        Returns the samples of the metric as (suffix, label text, value) tuples.
+        """
+        with self._lock:
+            return [('', _format_labels(self.labels, key), value) for key, value in sorted(self._series.items())]
+
+    def render(self):
+        """
+        Returns the metric in the text exposition format.
+        """
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{self.name}{suffix}{labels} {_format_value(value)}' for suffix, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    A value which only goes up, such as a number of bytes read.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        if not self.labels:
+            self._series[()] = 0
+
+    def inc(self, amount=1, **labels):
+        """
+        Increases the counter.
+
+        Parameters:
+        - amount (float): The non-negative increment.
+        - labels: The label values of the series.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value which can go up and down, such as the pool fill level.
+
+    Description:
+    If a function is given, it is called at every scrape to read the current value, so the instrumented code does not
+    have to update the gauge. A gauge with labels expects the function to return a dictionary which maps tuples of
+    label values to values.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None, labels=()):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value):
+        """
+        Sets the gauge to a value.
+        """
+        with self._lock:
+            self._series[()] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        if not self.labels:
+            return [('', '', self.function())]
+        return [('', _format_labels(self.labels, key), value) for key, value in sorted(self.function().items())]
+
+
+class Histogram(Metric):
+    """
+    Counts observed values, such as latencies, in cumulative buckets.
+
+    Example usage:
+    with READ_SECONDS.time():
+        data = ser.read(size)
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        if not self.labels:
+            self._series[()] = ([0] * len(self.buckets), 0.0)
+
+    def observe(self, value, **labels):
+        """
+        Records an observed value.
+
+        Parameters:
+        - value (float): The observed value, in seconds for durations.
+        - labels: The label values of the series.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the enclosed block, also if it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = (('le', _format_value(bound)),)
+                    samples.append(('_bucket', _format_labels(self.labels, key, le), count))
+                samples.append(('_sum', _format_labels(self.labels, key), total))
+                samples.append(('_count', _format_labels(self.labels, key), counts[-1]))
+        return samples
+
+
+def render():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+
+    Returns:
+    - str: The exposition, ending with a newline.
+    """
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+SERIAL_BYTES = Counter('trng_serial_bytes_read_total', 'Bytes read from the serial device.', ('device',))
+SERIAL_READ_SECONDS = Histogram('trng_serial_read_seconds', 'Duration of a single read from the serial device.')
+POOL_TAKE_SECONDS = Histogram('trng_pool_take_seconds', 'Time a request waited for bytes from the entropy pool.')
+BITS_SERVED = Counter('trng_bits_served_total', 'Random bits served to clients.', ('endpoint',))
+CONVERSION_SECONDS = Histogram('trng_conversion_seconds', 'Time spent packing and encoding random numbers.',
+                               ('format',), FAST_BUCKETS)
+STATISTICAL_TEST_SECONDS = Histogram('trng_statistical_test_seconds', 'Time spent in the statistical test battery.',
+                                     ('source',))
+CONTROL_LOCK_WAIT_SECONDS = Histogram('trng_control_lock_wait_seconds',
+                                      'Time a control command waited for the device control lock.', (), FAST_BUCKETS)
+REQUEST_SECONDS = Histogram('trng_http_request_duration_seconds', 'Latency of HTTP requests until the response starts.',
+                            ('route', 'method', 'status'))
@@ -0,0 +1,129 @@
+"""
+This module runs the statistical test battery over large offline captures on all cores.
+
+A capture written by generate_random_numbers_to_file is memory-mapped and split into about TASKS_PER_WORKER blocks per
+worker, so also captures of a few megabits keep all cores busy. Every block is summarized in a separate process (see
+accumulators.Summary) and the summaries are merged in file order into the final test results, which match running
+tests.run_battery over the whole file at once up to floating point rounding.
+
+It can be used as a library:
+
+    results = parallel.test_capture('2023-06-01_12-00.bin')
+
+or from the command line:
+
+    python parallel.py 2023-06-01_12-00.bin --workers 16
+"""
+
+import argparse
+import functools
+import json
+import mmap
+import operator
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import accumulators
+
+TASKS_PER_WORKER = 4  # Blocks per worker process if the block size is not given, which balances uneven workers
+
+
+def _summarize_block(path, start, stop, length, text):
+    """
+    Summarizes the bytes start to stop of a capture. Runs in a worker process.
+
+    Parameters:
+    - path (str): The capture file.
+    - start, stop (int): The byte range of the block.
+    - length (int): The number of bits of the block to summarize.
+    - text (bool): True if the capture holds '0' and '1' characters instead of packed bytes.
+
+    Returns:
+    - accumulators.Summary: The summary of the block.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        data = m[start:stop]
+    return accumulators.Summary.of(data.decode('ascii') if text else data, length)
+
+
+def block_size(total_bits, workers=None, text=False):
+    """
+    Returns the default number of bytes summarized per task.
+
+    Parameters:
+    - total_bits (int): The number of bits to test.
+    - workers (int): The number of worker processes. Defaults to the number of cores.
+    - text (bool): True if the capture holds '0' and '1' characters instead of packed bytes.
+
+    Returns:
+    - int: The size of the capture divided by TASKS_PER_WORKER tasks per worker, rounded up to the merge alignment.
+    """
+    bits_per_byte = 1 if text else 8
+    alignment = accumulators.ALIGNMENT_BITS // bits_per_byte
+    tasks = (workers or os.cpu_count() or 1) * TASKS_PER_WORKER
+    size = -(-total_bits // bits_per_byte)
+    return max(1, -(-size // (tasks * alignment))) * alignment
+
+
+def summarize_capture(path, length=None, workers=None, block_bytes=None):
+    """
+    Summarizes a capture in parallel.
+
+    Parameters:
+    - path (str): The capture file. Files ending in '.txt' are read as '0' and '1' characters, all others as packed
+      bytes.
+    - length (int): Optional number of bits to test. The whole file is tested if omitted.
+    - workers (int): The number of worker processes. Defaults to the number of cores.
+    - block_bytes (int): The number of bytes summarized per task. Defaults to block_size.
+
+    Returns:
+    - accumulators.Summary: The summary of the capture.
+
+    Raises:
+    - ValueError: If block_bytes does not keep the blocks aligned for merging.
+    """
+    text = path.endswith('.txt')
+    bits_per_byte = 1 if text else 8
+    size = os.path.getsize(path)
+    total_bits = size * bits_per_byte if length is None else min(length, size * bits_per_byte)
+    if block_bytes is None:
+        block_bytes = block_size(total_bits, workers, text)
+    if block_bytes * bits_per_byte % accumulators.ALIGNMENT_BITS:
+        raise ValueError(f"block_bytes must hold a multiple of {accumulators.ALIGNMENT_BITS} bits.")
+    tasks = []
+    for start in range(0, -(-total_bits // bits_per_byte), block_bytes):
+        block_bits = min(block_bytes * bits_per_byte, total_bits - start * bits_per_byte)
+        tasks.append((start, start + block_bytes, block_bits))
+    if not tasks:
+        return accumulators.Summary()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        summaries = executor.map(_summarize_block, *zip(*[(path, start, stop, bits, text)
+                                                          for start, stop, bits in tasks]))
+        return functools.reduce(operator.add, summaries, accumulators.Summary())
+
+
+def test_capture(path, length=None, workers=None, block_bytes=None):
+    """
+    Runs the test battery over a capture in parallel.
+
+    Parameters:
+    - path (str): The capture file, see summarize_capture.
+    - length (int): Optional number of bits to test.
+    - workers (int): The number of worker processes. Defaults to the number of cores.
+    - block_bytes (int): The number of bytes summarized per task. Defaults to block_size.
+
+    Returns:
+    - dict: The result of every test, see tests.run_battery.
+    """
+    return summarize_capture(path, length, workers, block_bytes).evaluate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the statistical test battery over a capture on all cores.")
+    parser.add_argument('path', help="the .bin or .txt capture to test")
+    parser.add_argument('--bits', type=int, help="number of bits to test, default: the whole file")
+    parser.add_argument('--workers', type=int, help="number of worker processes, default: the number of cores")
+    parser.add_argument('--block-bytes', type=int,
+                        help=f"bytes summarized per task, default: about {TASKS_PER_WORKER} tasks per worker")
+    args = parser.parse_args()
+    print(json.dumps(test_capture(args.path, args.bits, args.workers, args.block_bytes), indent=2))
@@ -0,0 +1,316 @@
+"""
+This module contains the entropy pool which buffers the random bytes read from the serial device.
+"""
+
+import asyncio
+import collections
+import os
+import threading
+from dotenv import load_dotenv
+
+from exceptions import GenerationError, SystemError
+import metrics
+import reservoir
+
+load_dotenv()
+POOL_CAPACITY = int(os.getenv("POOL_CAPACITY", "65536"))
+POOL_HIGH_WATER = int(os.getenv("POOL_HIGH_WATER", str(POOL_CAPACITY)))
+POOL_LOW_WATER = int(os.getenv("POOL_LOW_WATER", str(POOL_CAPACITY // 2)))
+POOL_TIMEOUT = float(os.getenv("POOL_TIMEOUT", "60"))
+
+
+class EntropyPool:
+    """
+    Bounded, thread-safe ring buffer holding random bytes that have not been served yet.
+
+    Attributes:
+    - capacity (int): The maximum number of bytes the pool can hold.
+    - high_water (int): Fill level at which the reader stops draining the serial device.
+    - low_water (int): Fill level below which the reader resumes draining the serial device.
+    - reservoir (reservoir.Reservoir): Optional persistent reservoir which takes the bytes that do not fit into the
+      pool, or None.
+
+    Description:
+    The reader thread of the device appends the bytes which passed the health tests with put(), requests take bytes
+    out with take(). Once the fill level reaches the high-water mark the reader waits in wait_for_space() until
+    requests have drained the pool below the low-water mark, so the device is not read while nobody consumes its
+    output. Every byte is served at most once.
+
+    With a reservoir, the reader keeps draining the device until the reservoir is full as well, and take() tops the
+    pool up from the reservoir before it waits for the device.
+
+    take_async() and try_take_async() let coroutines wait for bytes without holding a thread. Their waiters are queued
+    and served in arrival order by put(), on the event loop of each waiter. Requests draw through the scheduler, see
+    scheduler.py, which lets at most one draw at a time wait here.
+    """
+    def __init__(self, capacity=POOL_CAPACITY, high_water=POOL_HIGH_WATER, low_water=POOL_LOW_WATER, reservoir=None):
+        if not 0 <= low_water < high_water <= capacity:
+            raise ValueError("Pool water marks must satisfy 0 <= low_water < high_water <= capacity.")
+        self.capacity = capacity
+        self.high_water = high_water
+        self.low_water = low_water
+        self.reservoir = reservoir
+        self._buffer = bytearray(capacity)
+        self._start = 0
+        self._size = 0
+        self._filling = True
+        self._error = None
+        self._error_type = SystemError
+        self._cond = threading.Condition()
+        self._waiters = collections.deque()
+
+    @property
+    def level(self):
+        """
+        Returns the number of bytes currently held by the pool.
+        """
+        with self._cond:
+            return self._size
+
+    def clear(self):
+        """
+        Discards all buffered bytes and any recorded reader error. The bytes in the reservoir are kept.
+        """
+        with self._cond:
+            self._start = 0
+            self._size = 0
+            self._filling = True
+            self._error = None
+            self._cond.notify_all()
+
+    def fail(self, message, error_type=SystemError):
+        """
+        Records a reader error, which is raised by every waiting and future take() call the pool cannot serve.
+
+        Parameters:
+        - message (str): Explanation of the error.
+        - error_type (type): The exception class to raise, SystemError or GenerationError.
+        """
+        with self._cond:
+            self._error = message
+            self._error_type = error_type
+            self._serve_waiters()
+            self._cond.notify_all()
+
+    def recover(self):
+        """
+        Clears a recorded reader error while keeping the buffered bytes.
+        """
+        with self._cond:
+            self._error = None
+
+    def put(self, data):
+        """
+        Appends bytes to the pool.
+
+        Parameters:
+        - data (bytes-like): The bytes to append.
+
+        Returns:
+        - int: The number of bytes accepted. Bytes that fit neither into the pool nor into the reservoir are dropped.
+        """
+        with self._cond:
+            count = self._append(data)
+            if count < len(data) and self.reservoir is not None:
+                count += self.reservoir.write(memoryview(data)[count:])
+            self._serve_waiters()
+            self._cond.notify_all()
+            return count
+
+    def _append(self, data):
+        """
+        Appends as many bytes as fit into the ring buffer and returns their number. The caller holds the condition.
+        """
+        count = min(len(data), self.capacity - self._size)
+        end = (self._start + self._size) % self.capacity
+        first = min(count, self.capacity - end)
+        self._buffer[end:end + first] = data[:first]
+        self._buffer[:count - first] = data[first:count]
+        self._size += count
+        if self._size >= self.high_water:
+            self._filling = False
+        return count
+
+    def _refill(self, count):
+        """
+        Moves bytes from the reservoir into the pool until it holds count bytes or the reservoir is empty. Returns True
+        once the pool holds count bytes. The caller holds the condition.
+        """
+        if self._size < count and self.reservoir is not None:
+            self._append(self.reservoir.read(count - self._size))
+        return self._size >= count
+
+    def take(self, count, timeout=POOL_TIMEOUT):
+        """
+        Removes and returns exactly count bytes from the pool, waiting until enough bytes are available.
+
+        Parameters:
+        - count (int): The number of bytes to take. Must not exceed the high-water mark.
+        - timeout (float): Maximum time in seconds to wait for the bytes.
+
+        Returns:
+        - bytes: The requested bytes.
+
+        Raises:
+        - GenerationError: If the bytes did not become available within the timeout, or if the health tests report a
+          total failure and the pool cannot serve the request.
+        - SystemError: If the reader failed because the serial connection has been cut.
+
+        Description:
+        The call is atomic: either all requested bytes are removed from the pool, or none are. Bytes that are already
+        in the pool passed the health tests and are still served while a failure is reported.
+        """
+        data = self.try_take(count, timeout)
+        if data is None:
+            raise GenerationError("Timed out waiting for random data.")
+        return data
+
+    def try_take(self, count, timeout=0, reserve=0):
+        """
+        Removes and returns exactly count bytes from the pool like take(), but returns None if they did not become
+        available within the timeout.
+
+        Parameters:
+        - count (int): The number of bytes to take. Together with reserve, it must not exceed the high-water mark.
+        - timeout (float): Maximum time in seconds to wait for the bytes.
+        - reserve (int): The number of bytes which must remain in the pool afterwards, for draws of a higher priority.
+
+        Returns:
+        - bytes: The requested bytes, or None.
+
+        Raises:
+        - GenerationError, SystemError: If the reader failed and the pool cannot serve the request, as for take().
+        """
+        if count + reserve > self.high_water:
+            raise ValueError("Cannot take more bytes than the pool high-water mark.")
+        with metrics.POOL_TAKE_SECONDS.time(), self._cond:
+            if not self._cond.wait_for(lambda: self._refill(count + reserve) or self._error is not None, timeout):
+                return None
+            if not self._refill(count + reserve):
+                raise self._error_type(self._error)
+            data = self._remove(count)
+            self._cond.notify_all()
+            return data
+
+    def _remove(self, count):
+        """
+        Removes and returns count bytes, which the pool holds. The caller holds the condition.
+        """
+        first = min(count, self.capacity - self._start)
+        data = bytes(self._buffer[self._start:self._start + first]) + bytes(self._buffer[:count - first])
+        self._start = (self._start + count) % self.capacity
+        self._size -= count
+        if self._size <= self.low_water:
+            self._filling = True
+        return data
+
+    def _serve_waiters(self):
+        """
+        Hands bytes to the queued try_take_async() waiters in arrival order, or the recorded error once the pool cannot
+        serve them. The caller holds the condition.
+        """
+        while self._waiters:
+            count, reserve, future, loop = self._waiters[0]
+            if self._refill(count + reserve):
+                result = self._remove(count)
+            elif self._error is not None:
+                result = self._error_type(self._error)
+            else:
+                return
+            self._waiters.popleft()
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+    async def take_async(self, count, timeout=POOL_TIMEOUT):
+        """
+        Removes and returns exactly count bytes from the pool like take(), but waits on the event loop.
+
+        Parameters:
+        - count (int): The number of bytes to take. Must not exceed the high-water mark.
+        - timeout (float): Maximum time in seconds to wait for the bytes.
+
+        Returns:
+        - bytes: The requested bytes.
+
+        Raises:
+        - GenerationError, SystemError: As for take().
+
+        Description:
+        A waiting coroutine does not occupy a thread, so a single event loop can hold thousands of pending requests.
+        Waiters are served strictly in arrival order: a small request does not overtake a larger one queued before it.
+        """
+        data = await self.try_take_async(count, timeout)
+        if data is None:
+            raise GenerationError("Timed out waiting for random data.")
+        return data
+
+    async def try_take_async(self, count, timeout=0, reserve=0):
+        """
+        Removes and returns exactly count bytes from the pool like take_async(), but returns None if they did not
+        become available within the timeout.
+
+        Parameters:
+        - count (int): The number of bytes to take. Together with reserve, it must not exceed the high-water mark.
+        - timeout (float): Maximum time in seconds to wait for the bytes.
+        - reserve (int): The number of bytes which must remain in the pool afterwards, see try_take().
+
+        Returns:
+        - bytes: The requested bytes, or None.
+
+        Raises:
+        - GenerationError, SystemError: As for take().
+        """
+        if count + reserve > self.high_water:
+            raise ValueError("Cannot take more bytes than the pool high-water mark.")
+        loop = asyncio.get_running_loop()
+        with metrics.POOL_TAKE_SECONDS.time():
+            with self._cond:
+                if not self._waiters and self._refill(count + reserve):
+                    data = self._remove(count)
+                    self._cond.notify_all()
+                    return data
+                if self._error is not None:
+                    raise self._error_type(self._error)
+                waiter = (count, reserve, loop.create_future(), loop)
+                self._waiters.append(waiter)
+            future = waiter[2]
+            try:
+                await asyncio.wait((future,), timeout=timeout)
+            finally:
+                # Also leave the queue if the waiting task is cancelled, so no bytes are handed to it
+                with self._cond:
+                    queued = waiter in self._waiters
+                    if queued:
+                        self._waiters.remove(waiter)
+            if queued:
+                return None
+            # The waiter was served just as the timeout expired; its result is on the way
+            result = await future
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+    def wait_for_space(self, timeout=None):
+        """
+        Blocks while the pool is above its high-water mark and has not yet been drained below the low-water mark, and
+        the reservoir, if any, is full.
+
+        Parameters:
+        - timeout (float): Maximum time in seconds to wait.
+
+        Returns:
+        - bool: True if the reader should read more bytes, False if the timeout expired first.
+        """
+        def ready():
+            return self._filling or (self.reservoir is not None and self.reservoir.free > 0)
+
+        with self._cond:
+            return self._cond.wait_for(ready, timeout)
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+pool = EntropyPool(reservoir=reservoir.open_reservoir())
+metrics.Gauge('trng_pool_level_bytes', 'Bytes currently held by the entropy pool.', lambda: pool.level)
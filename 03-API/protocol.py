@@ -0,0 +1,156 @@
+"""
+This module contains the framed serial protocol spoken by the NodeMCU firmware.
+
+Without framing, the board sends bare bytes, so bytes which are dropped or corrupted on the line go unnoticed. In
+framed mode, the board sends its output in frames:
+
+    magic (2 bytes, A5 5A) | version (1) | type (1) | sequence (2) | length (2) | payload (length) | CRC (2)
+
+All integers are big-endian. The CRC is CRC-16/CCITT-FALSE over everything between the magic and the CRC. The sequence
+counter increases by one per frame, so lost frames are counted from gaps in the sequence. Data frames carry random
+bytes, status frames carry the sample rate of the board in bits per second and its current baud rate as two 32 bit
+integers.
+
+The host switches the board to framed mode with the 'frames' command after 'on'. Boards with older firmware ignore
+the command and keep sending bare bytes, which the host detects and falls back to.
+"""
+
+import binascii
+import struct
+
+MAGIC = b'\xa5\x5a'
+VERSION = 1
+DATA = 1
+STATUS = 2
+MAX_PAYLOAD = 1024
+HEADER = struct.Struct('>BBHH')  # version, type, sequence, length
+STATUS_PAYLOAD = struct.Struct('>II')  # sample rate in bits per second, baud rate
+FRAME_OVERHEAD = len(MAGIC) + HEADER.size + 2
+
+
+def crc16(data):
+    """
+    Returns the CRC-16/CCITT-FALSE checksum of data.
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(frame_type, sequence, payload):
+    """
+    Builds a frame.
+
+    Parameters:
+    - frame_type (int): DATA or STATUS.
+    - sequence (int): The sequence number, taken modulo 2^16.
+    - payload (bytes): The payload, at most MAX_PAYLOAD bytes.
+
+    Returns:
+    - bytes: The encoded frame.
+    """
+    body = HEADER.pack(VERSION, frame_type, sequence & 0xFFFF, len(payload)) + payload
+    return MAGIC + body + crc16(body).to_bytes(2, 'big')
+
+
+def encode_status(sequence, sample_rate, baud_rate):
+    """
+    Builds a status frame, see encode_frame.
+    """
+    return encode_frame(STATUS, sequence, STATUS_PAYLOAD.pack(sample_rate, baud_rate))
+
+
+class FrameDecoder:
+    """
+    Extracts the payload of data frames from the byte stream of a board.
+
+    Attributes:
+    - frames (int): The number of valid frames received.
+    - crc_errors (int): The number of frames discarded because of a checksum mismatch.
+    - lost_frames (int): The number of frames missing according to the sequence counter.
+    - discarded_bytes (int): The number of bytes skipped while searching for the next frame.
+    - sample_rate (int): The sample rate reported by the last status frame, or None.
+    - baud_rate (int): The baud rate reported by the last status frame, or None.
+
+    Description:
+    Incoming bytes are buffered until a complete frame is available. After a corrupted frame or a garbled header, the
+    decoder skips ahead to the next magic number, so it resynchronizes on its own. Frames are never split between
+    calls to feed(), only buffered.
+    """
+    def __init__(self):
+        self.frames = 0
+        self.crc_errors = 0
+        self.lost_frames = 0
+        self.discarded_bytes = 0
+        self.sample_rate = None
+        self.baud_rate = None
+        self._buffer = bytearray()
+        self._sequence = None
+
+    def feed(self, data):
+        """
+        Decodes bytes read from the board.
+
+        Parameters:
+        - data (bytes-like): The bytes read.
+
+        Returns:
+        - bytes: The payload of all data frames completed by this call.
+        """
+        self._buffer += data
+        buffer = self._buffer
+        payloads = []
+        position = 0
+        while True:
+            start = buffer.find(MAGIC, position)
+            if start < 0:
+                # Keep a trailing first magic byte, the second one may still arrive
+                keep = 1 if buffer.endswith(MAGIC[:1]) else 0
+                self.discarded_bytes += len(buffer) - position - keep
+                position = len(buffer) - keep
+                break
+            self.discarded_bytes += start - position
+            position = start
+            if len(buffer) - start < len(MAGIC) + HEADER.size:
+                break
+            version, frame_type, sequence, length = HEADER.unpack_from(buffer, start + len(MAGIC))
+            if version != VERSION or length > MAX_PAYLOAD:
+                self.discarded_bytes += 1
+                position = start + 1
+                continue
+            end = start + FRAME_OVERHEAD + length
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[start + len(MAGIC):end - 2])
+            if crc16(body) != int.from_bytes(buffer[end - 2:end], 'big'):
+                self.crc_errors += 1
+                self.discarded_bytes += 1
+                position = start + 1
+                continue
+            if self._sequence is not None:
+                self.lost_frames += (sequence - self._sequence - 1) & 0xFFFF
+            self._sequence = sequence
+            self.frames += 1
+            payload = body[HEADER.size:]
+            if frame_type == DATA:
+                payloads.append(payload)
+            elif frame_type == STATUS and length >= STATUS_PAYLOAD.size:
+                self.sample_rate, self.baud_rate = STATUS_PAYLOAD.unpack_from(payload)
+            position = end
+        del buffer[:position]
+        return b''.join(payloads)
+
+    def stats(self):
+        """
+        Returns the counters of the decoder.
+
+        Returns:
+        - dict: The protocol version and the counters, suitable for a JSON response.
+        """
+        return {
+            'version': VERSION,
+            'frames': self.frames,
+            'crc_errors': self.crc_errors,
+            'lost_frames': self.lost_frames,
+            'discarded_bytes': self.discarded_bytes,
+            'sample_rate': self.sample_rate,
+            'baud_rate': self.baud_rate,
+        }
@@ -0,0 +1,258 @@
+"""
+This module runs the statistical test battery of tests.py for the quality monitoring endpoints.
+
+The reader thread appends every byte that passed the health tests to a bounded history of the most recent output, so
+the battery can be run over the most recent N bits without taking bytes away from the entropy pool. Results are cached
+per window size and per capture, so repeated polling is cheap: a window is only tested again once new data arrived,
+and a capture only once its file changed. The same bytes also feed a streaming accumulator, which keeps the test
+statistics of a sliding or tumbling window up to date as the data arrives, so the continuous window is never counted
+from scratch.
+
+The statistics stack (NumPy and SciPy via accumulators.py and tests.py) is imported on first use, so the API starts
+without it. warm_up() loads it ahead of time.
+"""
+
+import functools
+import os
+import threading
+from dotenv import load_dotenv
+
+from exceptions import GenerationError
+import metrics
+
+load_dotenv()
+QUALITY_HISTORY_BYTES = int(os.getenv("QUALITY_HISTORY_BYTES", "125000"))  # Most recent output kept for testing
+QUALITY_MIN_BITS = int(os.getenv("QUALITY_MIN_BITS", "1000"))  # Smallest window the battery is run on
+QUALITY_SEGMENT_BYTES = int(os.getenv("QUALITY_SEGMENT_BYTES", "1250"))  # Window step, see accumulators.py
+QUALITY_WINDOW = os.getenv("QUALITY_WINDOW", "sliding")  # 'sliding' or 'tumbling' continuous window
+
+
+class History:
+    """
+    Bounded ring buffer of the most recent bytes delivered by the device.
+
+    Attributes:
+    - capacity (int): The maximum number of bytes kept.
+    - sequence (int): The total number of bytes appended so far. It identifies the current content of the history.
+    """
+    def __init__(self, capacity=QUALITY_HISTORY_BYTES):
+        if capacity <= 0:
+            raise ValueError("QUALITY_HISTORY_BYTES must be positive.")
+        self.capacity = capacity
+        self.sequence = 0
+        self._buffer = bytearray(capacity)
+        self._lock = threading.Lock()
+
+    @property
+    def level(self):
+        """
+        Returns the number of bytes currently kept.
+        """
+        return min(self.sequence, self.capacity)
+
+    def clear(self):
+        """
+        Forgets all kept bytes.
+        """
+        with self._lock:
+            self.sequence = 0
+
+    def append(self, data):
+        """
+        Appends bytes, overwriting the oldest ones once the history is full.
+
+        Parameters:
+        - data (bytes-like): The bytes to append.
+        """
+        data = memoryview(data)[-self.capacity:]
+        with self._lock:
+            start = self.sequence % self.capacity
+            head = min(len(data), self.capacity - start)
+            self._buffer[start:start + head] = data[:head]
+            self._buffer[:len(data) - head] = data[head:]
+            self.sequence += len(data)
+
+    def recent(self, count):
+        """
+        Returns the most recent bytes.
+
+        Parameters:
+        - count (int): The number of bytes to return. At most the current level is returned.
+
+        Returns:
+        - tuple: The sequence number the bytes end at and the bytes themselves.
+        """
+        with self._lock:
+            count = min(count, self.sequence, self.capacity)
+            end = self.sequence % self.capacity
+            if count <= end:
+                data = bytes(self._buffer[end - count:end])
+            else:
+                data = bytes(self._buffer[self.capacity - (count - end):]) + bytes(self._buffer[:end])
+            return self.sequence, data
+
+
+history = History()
+accumulator = None  # The streaming accumulator, created by the first call of _accumulator()
+_accumulator_lock = threading.Lock()
+
+
+def _accumulator():
+    """
+    Returns the streaming accumulator, creating it on first use. The caller holds _accumulator_lock.
+    """
+    global accumulator
+    if accumulator is None:
+        import accumulators
+        accumulator = accumulators.Accumulator(QUALITY_HISTORY_BYTES, QUALITY_SEGMENT_BYTES,
+                                               tumbling=QUALITY_WINDOW == 'tumbling')
+    return accumulator
+
+
+def warm_up():
+    """
+    Imports the statistics stack and creates the streaming accumulator, so the first quality request and the first
+    bytes of the device do not wait for it.
+    """
+    import scipy.special
+    import scipy.stats
+    import tests
+    with _accumulator_lock:
+        _accumulator()
+
+
+def record(data):
+    """
+    Adds bytes delivered by the device to the history and to the streaming accumulator.
+
+    Parameters:
+    - data (bytes-like): The bytes which passed the health tests.
+    """
+    history.append(data)
+    with _accumulator_lock:
+        _accumulator().update(data)
+
+
+def reset():
+    """
+    Forgets all recorded bytes, at the start of a new session.
+    """
+    history.clear()
+    with _accumulator_lock:
+        if accumulator is not None:
+            accumulator.reset()
+
+
+def stream_quality():
+    """
+    Runs the test battery on the continuous window of the streaming accumulator.
+
+    Returns:
+    - dict: The window size, the sequence number of the recorded data, the overall verdict and the result of every
+      test. For a sliding window, the window covers the most recent complete segments. For a tumbling window, it is the
+      last complete window.
+
+    Raises:
+    - GenerationError: If the window does not hold QUALITY_MIN_BITS bits yet.
+
+    Description:
+    The statistics are maintained as the data arrives, so only the final evaluation runs here and no bits are counted.
+    """
+    with _accumulator_lock:
+        current = _accumulator()
+        summary = current.completed if current.tumbling else current.summary()
+        sequence = history.sequence
+    if summary is None or summary.n < QUALITY_MIN_BITS:
+        raise GenerationError(f"The {QUALITY_WINDOW} window does not hold {QUALITY_MIN_BITS} bits yet.")
+    with metrics.STATISTICAL_TEST_SECONDS.time(source='stream'):
+        results = summary.evaluate()
+    report = _report(summary.n, sequence, False, results)
+    report['window'] = QUALITY_WINDOW
+    return report
+
+_window_results = {}
+_window_lock = threading.Lock()
+
+
+def window_quality(num_bits):
+    """
+    Runs the test battery over the most recent bits delivered by the device.
+
+    Parameters:
+    - num_bits (int): The size of the window in bits.
+
+    Returns:
+    - dict: The window size, the sequence number of the tested data, whether the result came from the cache, the
+      overall verdict and the result of every test.
+
+    Raises:
+    - ValueError: If the window is smaller than QUALITY_MIN_BITS or larger than the history.
+    - GenerationError: If the history does not hold enough bits yet.
+
+    Description:
+    The result of a window size is kept together with the sequence number of the history it was computed from and is
+    returned again as long as no new data has arrived.
+    """
+    if num_bits < QUALITY_MIN_BITS or num_bits > QUALITY_HISTORY_BYTES * 8:
+        raise ValueError(f"numBits must be between {QUALITY_MIN_BITS} and {QUALITY_HISTORY_BYTES * 8}.")
+    sequence = history.sequence
+    with _window_lock:
+        cached = _window_results.get(num_bits)
+    if cached is not None and cached[0] == sequence:
+        return _report(num_bits, sequence, True, cached[1])
+
+    sequence, data = history.recent(-(-num_bits // 8))
+    if len(data) * 8 < num_bits:
+        raise GenerationError(f"Only {len(data) * 8} bits have been collected so far.")
+    import tests
+    with metrics.STATISTICAL_TEST_SECONDS.time(source='window'):
+        results = tests.run_battery(data, num_bits)
+    with _window_lock:
+        _window_results[num_bits] = (sequence, results)
+    return _report(num_bits, sequence, False, results)
+
+
+@functools.lru_cache(maxsize=32)
+def _capture_results(path, modified, length, filetype):
+    if filetype == 'txt':
+        with open(path, 'r') as f:
+            data = f.read()
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+    import tests
+    with metrics.STATISTICAL_TEST_SECONDS.time(source='capture'):
+        return tests.run_battery(data, length)
+
+
+def capture_quality(path, length, filetype):
+    """
+    Runs the test battery over a saved capture.
+
+    Parameters:
+    - path (str): The path of the capture.
+    - length (int): The number of bits in the capture.
+    - filetype (str): 'bin' or 'txt'.
+
+    Returns:
+    - dict: The number of bits, whether the result came from the cache, the overall verdict and the result of every
+      test.
+
+    Description:
+    Results are cached by path and modification time, so a capture is only tested again if its file changes.
+    """
+    modified = os.stat(path).st_mtime_ns
+    hits = _capture_results.cache_info().hits
+    results = _capture_results(path, modified, length, filetype)
+    cached = _capture_results.cache_info().hits > hits
+    return _report(length, None, cached, results)
+
+
+def _report(num_bits, sequence, cached, results):
+    return {
+        'numBits': num_bits,
+        'sequence': sequence,
+        'cached': cached,
+        'passed': all(result['passed'] for result in results.values()),
+        'results': results,
+    }
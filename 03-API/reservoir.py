@@ -0,0 +1,183 @@
+"""
+This module contains the persistent entropy reservoir, an optional file which keeps random bytes across restarts.
+
+While the device is on, the reader keeps draining it after the in-memory pool is full and stores the surplus in the
+reservoir, so bytes collected while nobody calls the API are kept instead of left on the board. When a request needs
+more bytes than the pool holds, the pool is topped up from the reservoir before it waits for the device. A burst far
+larger than the hardware rate can then be served from bytes collected overnight.
+
+The file is memory-mapped. It starts with a header page followed by the data area, which is used as a ring buffer:
+
+    header slot 0 (64 bytes) | header slot 1 (64 bytes) | ... | data (capacity bytes)
+
+Every slot holds the capacity, a sequence number, the total number of bytes read and written, and a CRC-32 of the
+slot. Updates go to the older slot, so a crash while writing the header leaves the other slot intact, and on opening
+the valid slot with the higher sequence number wins. Bytes are written and flushed before the write offset that covers
+them is committed, and the read offset is committed before bytes are handed out, so a crash can lose bytes but never
+serves a byte twice.
+
+The reservoir is enabled by RESERVOIR_PATH in the .env file; RESERVOIR_CAPACITY sets the size of the data area.
+"""
+
+import binascii
+import mmap
+import os
+import struct
+import threading
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+RESERVOIR_PATH = os.getenv("RESERVOIR_PATH")  # The reservoir file, disabled if omitted
+RESERVOIR_CAPACITY = int(os.getenv("RESERVOIR_CAPACITY", str(64 * 1024 * 1024)))  # Bytes held by the reservoir
+
+MAGIC = b'TRNGRSV1'
+SLOT = struct.Struct('>8sQQQQ')  # magic, capacity, sequence, bytes read, bytes written
+SLOT_SIZE = 64
+HEADER_BYTES = mmap.PAGESIZE
+
+
+class Reservoir:
+    """
+    A file-backed, consume-once ring buffer of random bytes.
+
+    Attributes:
+    - path (str): The reservoir file.
+    - capacity (int): The maximum number of bytes held by the reservoir.
+
+    Description:
+    The class is thread-safe. A file written with a different capacity is started over, since its ring positions no
+    longer match.
+    """
+    def __init__(self, path, capacity=RESERVOIR_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("The reservoir capacity must be positive.")
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != HEADER_BYTES + capacity:
+                os.ftruncate(fd, HEADER_BYTES + capacity)
+            self._map = mmap.mmap(fd, HEADER_BYTES + capacity)
+        finally:
+            os.close(fd)
+        self._sequence, self._read, self._written = self._load()
+
+    def _load(self):
+        """
+        Returns the sequence number and offsets of the newest valid header slot, or zeros for a new file.
+        """
+        best = (0, 0, 0)
+        for slot in range(2):
+            raw = self._map[slot * SLOT_SIZE:slot * SLOT_SIZE + SLOT.size + 4]
+            if binascii.crc32(raw[:SLOT.size]) != int.from_bytes(raw[SLOT.size:], 'big'):
+                continue
+            magic, capacity, sequence, read, written = SLOT.unpack(raw[:SLOT.size])
+            if magic == MAGIC and capacity == self.capacity and read <= written <= read + capacity \
+                    and sequence >= best[0]:
+                best = (sequence, read, written)
+        return best
+
+    def _commit(self):
+        """
+        Writes the offsets to the older header slot and flushes it to disk.
+        """
+        self._sequence += 1
+        body = SLOT.pack(MAGIC, self.capacity, self._sequence, self._read, self._written)
+        start = (self._sequence % 2) * SLOT_SIZE
+        self._map[start:start + SLOT.size + 4] = body + binascii.crc32(body).to_bytes(4, 'big')
+        self._map.flush(0, HEADER_BYTES)
+
+    def _flush_data(self, start, count):
+        # msync needs a page-aligned offset
+        offset = HEADER_BYTES + start
+        aligned = offset - offset % mmap.PAGESIZE
+        self._map.flush(aligned, offset + count - aligned)
+
+    @property
+    def level(self):
+        """
+        Returns the number of bytes which have not been served yet.
+        """
+        with self._lock:
+            return self._written - self._read
+
+    @property
+    def free(self):
+        """
+        Returns the number of bytes which can still be stored.
+        """
+        with self._lock:
+            return self.capacity - (self._written - self._read)
+
+    def write(self, data):
+        """
+        Stores bytes in the reservoir.
+
+        Parameters:
+        - data (bytes-like): The bytes to store.
+
+        Returns:
+        - int: The number of bytes stored. Bytes that do not fit into the reservoir are dropped.
+        """
+        data = memoryview(data)
+        with self._lock:
+            count = min(len(data), self.capacity - (self._written - self._read))
+            if count == 0:
+                return 0
+            end = self._written % self.capacity
+            first = min(count, self.capacity - end)
+            self._map[HEADER_BYTES + end:HEADER_BYTES + end + first] = data[:first]
+            self._flush_data(end, first)
+            if count > first:
+                self._map[HEADER_BYTES:HEADER_BYTES + count - first] = data[first:count]
+                self._flush_data(0, count - first)
+            self._written += count
+            self._commit()
+            return count
+
+    def read(self, count):
+        """
+        Removes and returns up to count bytes. Returned bytes are never returned again, also not after a restart.
+
+        Parameters:
+        - count (int): The maximum number of bytes to return.
+
+        Returns:
+        - bytes: The bytes, fewer than count if the reservoir holds fewer.
+        """
+        with self._lock:
+            count = min(count, self._written - self._read)
+            if count <= 0:
+                return b''
+            start = self._read % self.capacity
+            first = min(count, self.capacity - start)
+            data = self._map[HEADER_BYTES + start:HEADER_BYTES + start + first] + \
+                self._map[HEADER_BYTES:HEADER_BYTES + count - first]
+            self._read += count
+            self._commit()
+            return data
+
+    def close(self):
+        """
+        Closes the file. The reservoir cannot be used afterwards.
+        """
+        with self._lock:
+            self._map.close()
+
+
+def open_reservoir():
+    """
+    Opens the reservoir configured in the .env file.
+
+    Returns:
+    - Reservoir: The reservoir, or None if RESERVOIR_PATH is not set.
+    """
+    if not RESERVOIR_PATH:
+        return None
+    reservoir = Reservoir(RESERVOIR_PATH, RESERVOIR_CAPACITY)
+    metrics.Gauge('trng_reservoir_level_bytes', 'Bytes held by the persistent entropy reservoir.',
+                  lambda: reservoir.level)
+    return reservoir
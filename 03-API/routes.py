@@ -1,17 +1,29 @@
 """
 This module defines the Flask API routes for the application.
 """
-from flask import jsonify, send_file, request, Flask
+import base64
+import math
+import os
+import struct
+import time
+
+from flask import jsonify, send_file, request, Flask, Response, g, stream_with_context
 from flask_cors import CORS
 
 # Importing exception and system modules
 import exceptions
+import jobs
+import metrics
+import pool
+import quality
+import scheduler
 import system
 
 # Importing required functions and classes from these modules
-from exceptions import GenerationError
+from exceptions import GenerationError, QuotaError
 from system import initialize, shutdown, restart
-from generation import enforce_min_value, generate_random_numbers, generate_random_numbers_to_file
+from generation import enforce_min_value, generate_bytes, generate_batch, generate_range, number_to_hex, \
+    pack_fixed_width, packed_to_hex, iter_capture, capture_size, MODES, FILETYPES, FORMATS
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -19,8 +31,65 @@ app = Flask(__name__)
 # Enable Cross-Origin Resource Sharing (CORS) for all origins on routes beginning with '/trng/*'
 CORS(app, resources={r"/trng/*": {"origins": "*"}})
 
-# Declare a variable to store file paths
-filepath = ""
+
+@app.before_request
+def start_timer():
+    """
+    Records the start time of the request for the latency histogram and binds the request to its client, see
+    scheduler.py.
+    """
+    g.request_start = time.perf_counter()
+    g.client = scheduler.client_key(request.headers.get(scheduler.CLIENT_HEADER), request.remote_addr)
+    g.scheduler_token = scheduler.bind(g.client)
+
+
+@app.teardown_request
+def release_client(exc):
+    """
+    Unbinds the request from its client.
+    """
+    token = g.pop('scheduler_token', None)
+    if token is not None:
+        scheduler.unbind(token)
+
+
+@app.after_request
+def observe_latency(response):
+    """
+    Records the latency of the request by route, method and status code.
+
+    Description:
+        Streamed responses are measured until the response starts, not until the last chunk has been sent.
+    """
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=route, method=request.method,
+                                    status=response.status_code)
+    if 'queue' in g:
+        depth, wait = g.queue
+        response.headers['X-Queue-Depth'] = str(depth)
+        if wait is not None:
+            response.headers['X-Estimated-Wait'] = f'{wait:.3f}'
+    return response
+
+
+def _schedule(bits, mode, priority=scheduler.INTERACTIVE):
+    """
+    Admits a request to the entropy source and records the queue it joins for the X-Queue-Depth and X-Estimated-Wait
+    response headers.
+
+    Parameters:
+    - bits (int): The number of random bits the request generates.
+    - mode (str): The output mode. Only 'raw' bits are drawn from the entropy pool and charged to the quota.
+    - priority (str): The priority class of the request, see scheduler.py. Bulk requests are throttled to the quota
+      while they draw instead of being admitted up front.
+
+    Raises:
+    - QuotaError: If the quota of the client does not cover an interactive request.
+    """
+    raw_bits = bits if mode == 'raw' else 0
+    if priority == scheduler.INTERACTIVE:
+        scheduler.scheduler.admit(raw_bits, g.client, priority)
+    g.queue = scheduler.scheduler.estimate((raw_bits + 7) // 8, priority, system.source_rate())
 
 
 @app.route('/trng/randomNum/init', methods=['GET'])
@@ -31,10 +100,16 @@ def init_random_number_generator():
     Returns:
         A  JSON response indicating whether initialization was successful or
         an error occurred.
+
+    Description:
+        With the device parameter only the device at that port is initialized, otherwise all devices which are off.
     """
     try:
+        port = request.args.get('device')
+        if port is not None and system.find_device(port) is None:
+            return jsonify({'error': f"Unknown device '{port}'"}), 404
         # Check if initialization is successful
-        if initialize():
+        if initialize(port):
             return jsonify({'message': 'System initialised successfully'}), 200
         else:
             return jsonify({'message': 'System already initialized'}), 409
@@ -49,22 +124,141 @@ def get_random_numbers():
     Generates and returns a set of random numbers.
 
     Returns:
-        A JSON response with the generated random numbers or an error message.
+        The generated random numbers in the requested format, or a JSON response with an error message.
+
+    Description:
+        The numbers are packed into one contiguous buffer of fixed-width big-endian records of ceil(numBits / 8) bytes.
+        format=hex (the default) returns a JSON list of hexadecimal strings, format=base64 returns the buffer base64
+        encoded in a JSON object and format=raw returns the buffer itself. Without a format parameter, raw is chosen
+        if the client prefers application/octet-stream.
     """
     try:
-        system.test_serial()
-        if not system.is_initialized:
+        if not system.is_initialized():
             return jsonify({'message': 'System not initialized'}), 432
 
         # Get the number of bits and quantity from request arguments, default to 1 if not provided
         length = enforce_min_value(request.args.get('numBits', default=1, type=int), 1)
         count = enforce_min_value(request.args.get('quantity', default=1, type=int), 1)
+        mode = request.args.get('mode', default='raw')
+        if mode not in MODES:
+            return jsonify({'error': f"Unknown mode '{mode}'"}), 400
+        default_format = 'raw' if request.accept_mimetypes.best == 'application/octet-stream' else 'hex'
+        output_format = request.args.get('format', default=default_format)
+        if output_format not in FORMATS:
+            return jsonify({'error': f"Unknown format '{output_format}'"}), 400
 
         # Generate the random numbers
-        random_numbers = generate_random_numbers(count, length)
+        _schedule(count * length, mode)
+        data = generate_bytes(count * length, mode)
+        metrics.BITS_SERVED.inc(count * length, endpoint='getRandom')
 
-        # Return the generated random numbers
-        return jsonify(random_numbers), 200
+        # Pack the random numbers into fixed-width records and return them in the requested format
+        with metrics.CONVERSION_SECONDS.time(format=output_format):
+            packed = pack_fixed_width(data, count, length)
+            if output_format == 'raw':
+                headers = {'X-Num-Bits': str(length), 'X-Quantity': str(count)}
+                return Response(packed, mimetype='application/octet-stream', headers=headers), 200
+            if output_format == 'base64':
+                return jsonify({'numBits': length, 'quantity': count, 'width': (length + 7) // 8,
+                                'data': base64.b64encode(packed).decode('ascii')}), 200
+            return jsonify(packed_to_hex(packed, count, length)), 200
+    except (GenerationError, exceptions.SystemError) as e:
+        # If there is a GenerationError or SystemError, return the error message with a custom status code 555
+        return jsonify({'error': str(e)}), 555
+
+
+@app.route('/trng/randomNum/batch', methods=['POST'])
+def get_random_number_batch():
+    """
+    Generates several sets of random numbers, each with its own number of bits and quantity, in one draw.
+
+    Returns:
+        A JSON list with one list of hexadecimal random numbers per requested spec, or a binary response if the
+        client accepts application/octet-stream, or an error message.
+
+    Description:
+        The request body is a JSON object like {"specs": [{"numBits": 8, "quantity": 10}, ...], "mode": "raw"}. The bits
+        for all specs are reserved in one atomic draw, so the request either gets all numbers or fails without consuming
+        any. The binary response consists of one frame per spec: numBits and quantity as big-endian 32 bit unsigned
+        integers, followed by the numbers as big-endian unsigned integers of ceil(numBits / 8) bytes each.
+    """
+    try:
+        if not system.is_initialized():
+            return jsonify({'message': 'System not initialized'}), 432
+
+        # Parse and validate the specs from the request body
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict) or not isinstance(body.get('specs') or [], list):
+            return jsonify({'error': 'The body must be a JSON object with a list of specs'}), 400
+        mode = body.get('mode', 'raw')
+        if mode not in MODES:
+            return jsonify({'error': f"Unknown mode '{mode}'"}), 400
+        specs = []
+        for spec in body.get('specs') or []:
+            if not isinstance(spec, dict):
+                return jsonify({'error': 'Every spec must be a JSON object'}), 400
+            length = spec.get('numBits', 1)
+            count = spec.get('quantity', 1)
+            if not all(isinstance(value, int) and not isinstance(value, bool) and 1 <= value < 2 ** 32
+                       for value in (length, count)):
+                return jsonify({'error': 'Every spec needs a positive integer numBits and quantity below 2^32'}), 400
+            specs.append((length, count))
+        if not specs:
+            return jsonify({'error': 'No specs given'}), 400
+
+        # Generate all random numbers in a single draw
+        _schedule(sum(length * count for length, count in specs), mode)
+        results = generate_batch(specs, mode)
+        metrics.BITS_SERVED.inc(sum(length * count for length, count in specs), endpoint='batch')
+
+        if request.accept_mimetypes.best == 'application/octet-stream':
+            with metrics.CONVERSION_SECONDS.time(format='raw'):
+                frames = []
+                for (length, count), numbers in zip(specs, results):
+                    width = (length + 7) // 8
+                    frames.append(struct.pack('>II', length, count))
+                    frames.extend(number.to_bytes(width, 'big') for number in numbers)
+                return Response(b''.join(frames), mimetype='application/octet-stream'), 200
+        with metrics.CONVERSION_SECONDS.time(format='hex'):
+            return jsonify([[number_to_hex(number, length) for number in numbers]
+                            for (length, _), numbers in zip(specs, results)]), 200
+    except (GenerationError, exceptions.SystemError) as e:
+        # If there is a GenerationError or SystemError, return the error message with a custom status code 555
+        return jsonify({'error': str(e)}), 555
+
+
+@app.route('/trng/randomNum/range', methods=['GET'])
+def get_random_range():
+    """
+    Generates and returns uniformly distributed random integers between min and max, both inclusive.
+
+    Returns:
+        A JSON object with the random integers and the number of random bits they consumed, or a JSON response with
+        an error message.
+
+    Description:
+        The integers are drawn without modulo bias and with close to log2(max - min + 1) random bits each, see
+        generation.generate_range. bitsConsumed counts the bits used by the algorithm, bitsDrawn the bits taken from
+        the entropy pool or the DRBG, which includes the unused bits of the last byte.
+    """
+    try:
+        if not system.is_initialized():
+            return jsonify({'message': 'System not initialized'}), 432
+
+        low = request.args.get('min', type=int)
+        high = request.args.get('max', type=int)
+        if low is None or high is None or high < low:
+            return jsonify({'error': 'min and max must be integers with min <= max'}), 400
+        count = enforce_min_value(request.args.get('quantity', default=1, type=int), 1)
+        mode = request.args.get('mode', default='raw')
+        if mode not in MODES:
+            return jsonify({'error': f"Unknown mode '{mode}'"}), 400
+
+        _schedule(count * (high - low).bit_length(), mode)
+        numbers, consumed, drawn = generate_range(count, low, high, mode)
+        metrics.BITS_SERVED.inc(drawn, endpoint='range')
+        return jsonify({'min': low, 'max': high, 'quantity': count, 'numbers': numbers, 'bitsConsumed': consumed,
+                        'bitsDrawn': drawn}), 200
     except (GenerationError, exceptions.SystemError) as e:
         # If there is a GenerationError or SystemError, return the error message with a custom status code 555
         return jsonify({'error': str(e)}), 555
@@ -73,48 +267,252 @@ def get_random_numbers():
 @app.route('/trng/randomNum/generateTestdata', methods=['GET'])
 def get_testdata():
     """
-    Generates a set of test data.
+    Starts the generation of a set of test data in the background.
 
     Returns:
-        A JSON response indicating whether test data generation was successful
-        or an error occurred.
+        A JSON response with the ID of the generation job, or an error message.
     """
     try:
-        system.test_serial()
-        if not system.is_initialized:
+        if not system.is_initialized():
             return jsonify({'message': 'System not initialized'}), 432
 
         # Get the number of bits and file type from request arguments
         length = enforce_min_value(request.args.get('numBits', default=5000, type=int), 1)
         filetype = request.args.get('filetype', default='bin')
+        mode = request.args.get('mode', default='raw')
+        if mode not in MODES:
+            return jsonify({'error': f"Unknown mode '{mode}'"}), 400
+        if filetype not in FILETYPES:
+            return jsonify({'error': f"Unknown filetype '{filetype}'"}), 400
 
-        # Generate random numbers and write them to a file
-        if generate_random_numbers_to_file(length, filetype):
-            return jsonify({'message': 'Generation successful'}), 200
-        else:
-            return jsonify({'message: Generation failed'}), 555
+        # Submit a job which generates the random numbers and writes them to a file
+        _schedule(length, mode, scheduler.BULK)
+        job = jobs.submit(length, filetype, mode, g.client)
+        return jsonify({'message': 'Generation started', **job.progress()}), 202
     except GenerationError as e:
         # If there is a GenerationError, return the error message with a custom status code 555
         return jsonify({'error': str(e)}), 555
 
 
+@app.route('/trng/randomNum/streamTestdata', methods=['GET'])
+def stream_testdata():
+    """
+    Streams a set of test data directly to the client.
+
+    Returns:
+        A streaming file download of the requested test data, or a JSON response with an error message.
+
+    Description:
+        The data is generated chunk by chunk while the response is sent, so the first bytes arrive immediately and
+        memory use stays flat for large captures. A chunk is only drawn from the entropy source once the client has
+        consumed the previous one. With persist=true every chunk is also written to a file, which is registered as a
+        job whose ID is sent in the X-Job-Id header, so the file can be fetched again once the stream has completed.
+        If the generation fails midway the stream ends early and the client receives fewer bytes than announced in
+        Content-Length.
+    """
+    if not system.is_initialized():
+        return jsonify({'message': 'System not initialized'}), 432
+
+    # Get the number of bits, file type, mode and persistence flag from request arguments
+    length = enforce_min_value(request.args.get('numBits', default=5000, type=int), 1)
+    filetype = request.args.get('filetype', default='bin')
+    mode = request.args.get('mode', default='raw')
+    persist = request.args.get('persist', default='false').lower() in ('1', 'true', 'yes')
+    if mode not in MODES:
+        return jsonify({'error': f"Unknown mode '{mode}'"}), 400
+    if filetype not in FILETYPES:
+        return jsonify({'error': f"Unknown filetype '{filetype}'"}), 400
+    _schedule(length, mode, scheduler.BULK)
+    job = jobs.Job(length, filetype, mode, g.client)
+
+    def generate():
+        capture = open(job.path, 'wb') if persist else None
+        job.start()
+        try:
+            with scheduler.serving(job.client, scheduler.BULK):
+                for chunk in iter_capture(length, filetype, mode):
+                    if capture:
+                        capture.write(chunk)
+                    collected = min(length, job.bits_collected + (len(chunk) if filetype == 'txt' else len(chunk) * 8))
+                    metrics.BITS_SERVED.inc(collected - job.bits_collected, endpoint='streamTestdata')
+                    job.advance(collected)
+                    yield chunk
+        except (GenerationError, exceptions.SystemError) as e:
+            print(f"Error occurred while streaming test data: {str(e)}")
+            job.fail(str(e))
+            return
+        finally:
+            if capture:
+                capture.close()
+        job.finish()
+
+    mimetype = 'text/plain' if filetype == 'txt' else 'application/octet-stream'
+    headers = {
+        'Content-Disposition': f'attachment; filename={os.path.basename(job.path)}',
+        'Content-Length': str(capture_size(length, filetype)),
+    }
+    if persist:
+        jobs.register(job)
+        headers['X-Job-Id'] = job.id
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
 @app.route('/trng/randomNum/downloadFile', methods=['GET'])
 def download():
     """
-    Allows downloading a file.
+    Allows downloading the file of the most recently finished test data job.
 
     Returns:
         The requested file for download, or a Flask JSON response with an error
         message if the file could not be found.
     """
+    job = jobs.latest_finished()
+    if job is None:
+        return jsonify({'error': 'No test data has been generated yet'}), 555
     try:
         # Return the requested file for download
-        return send_file(filepath, as_attachment=True), 200
+        return send_file(job.path, as_attachment=True), 200
     except FileNotFoundError as e:
         # If the file was not found, return a JSON response with the error message and a custom status code 555
         return jsonify({'error':  str(e)}), 555
 
 
+@app.route('/trng/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Reports the progress of a test data job.
+
+    Returns:
+        A JSON response with the job status, the number of bits collected, the estimated remaining time and the
+        health test status, or an error message if the job is unknown.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.progress()), 200
+
+
+@app.route('/trng/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Allows downloading the file of a finished test data job.
+
+    Returns:
+        The file for download, or a JSON response with the job progress if it has not finished yet, or an error
+        message if the job is unknown or failed.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == jobs.FAILED:
+        return jsonify({'error': job.error}), 555
+    if job.status != jobs.FINISHED:
+        return jsonify({'message': 'Generation not finished', **job.progress()}), 409
+    try:
+        return send_file(job.path, as_attachment=True), 200
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 555
+
+
+@app.route('/trng/jobs/<job_id>/quality', methods=['GET'])
+def get_job_quality(job_id):
+    """
+    Runs the statistical test battery over the capture of a finished test data job.
+
+    Returns:
+        A JSON response with the p-values and the pass/fail result of every test, or an error message if the job is
+        unknown, failed or has not finished yet.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == jobs.FAILED:
+        return jsonify({'error': job.error}), 555
+    if job.status != jobs.FINISHED:
+        return jsonify({'message': 'Generation not finished', **job.progress()}), 409
+    try:
+        return jsonify({'job_id': job.id, **quality.capture_quality(job.path, job.length, job.filetype)}), 200
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 555
+
+
+@app.route('/trng/quality', methods=['GET'])
+def get_quality():
+    """
+    Runs the statistical test battery over the most recent random bits delivered by the device.
+
+    Returns:
+        A JSON response with the p-values and the pass/fail result of every test, or an error message if the window
+        size is invalid or not enough bits have been collected yet. Without numBits, the continuous window maintained
+        by the streaming accumulator is reported.
+    """
+    num_bits = request.args.get('numBits', type=int)
+    try:
+        if num_bits is None:
+            return jsonify(quality.stream_quality()), 200
+        return jsonify(quality.window_quality(num_bits)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except GenerationError as e:
+        return jsonify({'error': str(e)}), 409
+
+
+@app.route('/trng/entropy', methods=['GET'])
+def get_entropy():
+    """
+    Estimates the min-entropy of the most recent bytes delivered by the device with the SP 800-90B estimators.
+
+    Returns:
+        A JSON response with the min-entropy per byte and per bit and the result of every estimator, or an error
+        message if the number of bytes is invalid or not enough bytes have been collected yet.
+    """
+    import entropy  # Loads NumPy, which the API does not need at startup
+    num_bytes = request.args.get('numBytes', type=int)
+    try:
+        return jsonify(entropy.history_entropy(num_bytes)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except GenerationError as e:
+        return jsonify({'error': str(e)}), 409
+
+
+@app.route('/trng/randomNum/healthTests', methods=['GET'])
+def get_health_tests():
+    """
+    Reports the state of the continuous health tests running on the raw data stream.
+
+    Returns:
+        A JSON response with the health test cutoffs and the counters of all devices combined, the current fill level
+        of the entropy pool and the state of every device.
+    """
+    reservoir_level = pool.pool.reservoir.level if pool.pool.reservoir is not None else None
+    return jsonify({**system.health_stats(), 'pool_level': pool.pool.level, 'reservoir_level': reservoir_level,
+                    'devices': system.device_status()}), 200
+
+
+@app.route('/trng/ready', methods=['GET'])
+def get_readiness():
+    """
+    Reports whether the background preparation of the devices at startup has finished.
+
+    Returns:
+        A JSON response with the state of the device preparation and of the warm-up, with status code 200 once the
+        devices are prepared or the system is initialized, and 503 before or if the preparation failed.
+    """
+    return jsonify({'ready': system.is_ready(), **system.readiness}), 200 if system.is_ready() else 503
+
+
+@app.route('/trng/devices', methods=['GET'])
+def get_devices():
+    """
+    Reports the state of every connected TRNG board.
+
+    Returns:
+        A JSON response with the port, connection and health state, read rate and health test counters of every device.
+    """
+    return jsonify(system.device_status()), 200
+
+
 @app.route('/trng/randomNum/shutdown', methods=['GET'])
 def shutdown_random_number_generator():
     """
@@ -123,10 +521,16 @@ def shutdown_random_number_generator():
     Returns:
         A JSON response indicating whether shutdown was successful or
         an error occurred.
+
+    Description:
+        With the device parameter only the device at that port is shut down, otherwise all devices.
     """
     try:
+        port = request.args.get('device')
+        if port is not None and system.find_device(port) is None:
+            return jsonify({'error': f"Unknown device '{port}'"}), 404
         # Check if the shutdown process was successful
-        if shutdown():
+        if shutdown(port):
             return jsonify({'message': 'System successfully shutdown'}), 200
         else:
             return jsonify({'message': 'System already in standby'}), 200
@@ -143,10 +547,17 @@ def restart_random_number_generator():
     Returns:
         A JSON response indicating whether restart was successful or
         an error occurred.
+
+    Description:
+        With the device parameter only the device at that port is restarted, otherwise all devices which are on or
+        were dropped after a failure.
     """
     try:
+        port = request.args.get('device')
+        if port is not None and system.find_device(port) is None:
+            return jsonify({'error': f"Unknown device '{port}'"}), 404
         # Check if the restart process was successful
-        if restart():
+        if restart(port):
             return jsonify({'message': 'System successfully restarted'}), 200
         else:
             return jsonify({'message': 'System already in standby'}), 200
@@ -155,6 +566,32 @@ def restart_random_number_generator():
         return jsonify({'error': str(e)}), 555
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Exposes the counters, gauges and histograms of the application for Prometheus.
+
+    Returns:
+        The metrics in the Prometheus text exposition format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4'), 200
+
+
+@app.errorhandler(QuotaError)
+def quota_exceeded(e):
+    """
+    Rejects a request whose client has used up its quota of the entropy source, see scheduler.py.
+
+    Returns:
+        A JSON response with the error message and status code 429, with a Retry-After header if the request can be
+        served later.
+    """
+    response = jsonify({'error': e.message, 'retry_after': e.retry_after})
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+    return response, 429
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """
@@ -0,0 +1,496 @@
+"""
+This module contains the scheduler which shares the scarce output of the entropy source between clients.
+
+The boards deliver a few hundred bits per second, so without a scheduler one bulk capture drains the entropy pool as
+fast as it fills, and every small request waits behind it. All draws of raw bytes from the pool therefore pass the
+scheduler, which hands the pool to one draw at a time:
+
+- Priority classes: draws of interactive requests (getRandom, batch, range) are served before draws of bulk captures
+  (generateTestdata, streamTestdata), whenever both are waiting.
+- Weighted fair queuing: within a class, the waiting draws of different clients are served in the order of their
+  virtual finish times (self-clocked fair queuing), so every client gets a share of the source proportional to its
+  weight in CLIENT_WEIGHTS, however many requests it sends.
+- Quanta: a draw takes at most SCHEDULER_QUANTUM bytes, or whatever the pool already holds, before it queues again. A
+  small request therefore waits for at most one quantum of a running capture instead of the whole capture.
+- Reserve: bulk draws leave SCHEDULER_RESERVE bytes in the pool. The health tests release bytes in whole windows, so
+  a capture would otherwise drain every window as it arrives and a small request would wait for the next one.
+- Token buckets: with CLIENT_RATE_BITS set, every client, identified by its X-API-Key header or its IP address, may draw
+  CLIENT_RATE_BITS raw bits per second on average and CLIENT_BURST_BITS at once. Interactive requests beyond the quota
+  are rejected with 429 and a Retry-After header, bulk captures are slowed down to the quota.
+
+The client and the priority class of a draw are taken from the context of the calling thread, see serving() and bind().
+Coroutines draw with take_async(), which queues them together with the threads, so the ASGI route of getRandom gets the
+same fair share without holding a thread while it waits.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from exceptions import GenerationError, QuotaError
+import metrics
+import pool
+
+load_dotenv()
+SCHEDULER_QUANTUM = int(os.getenv("SCHEDULER_QUANTUM", "32"))  # Bytes a draw takes before it queues again
+SCHEDULER_RESERVE = int(os.getenv("SCHEDULER_RESERVE", "64"))  # Bytes bulk draws leave in the pool
+SCHEDULER_SLICE = 0.1  # Seconds the draw next in line waits for the pool before it queues again
+CLIENT_RATE_BITS = float(os.getenv("CLIENT_RATE_BITS", "0"))  # Raw bits per second and client, 0 disables quotas
+CLIENT_BURST_BITS = int(os.getenv("CLIENT_BURST_BITS", "65536"))  # Raw bits a client may draw at once
+CLIENT_WEIGHTS = {client.strip(): float(weight) for client, weight in (
+    entry.split('=', 1) for entry in os.getenv("CLIENT_WEIGHTS", "").split(',') if '=' in entry)}  # 'key=2,...'
+CLIENT_HEADER = 'X-API-Key'  # Request header which identifies a client, the IP address is used without it
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)  # In the order in which they are served
+LOCAL = 'local'  # The client of draws made outside of a request
+
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+SCHEDULER_WAIT_SECONDS = metrics.Histogram('trng_scheduler_wait_seconds',
+                                           'Time a quantum waited until it was served.', ('priority',),
+                                           WAIT_BUCKETS)
+QUOTA_REJECTIONS = metrics.Counter('trng_scheduler_quota_rejections_total',
+                                   'Requests rejected because the client exceeded its quota.', ('priority',))
+
+_context = contextvars.ContextVar('scheduler_context', default=(LOCAL, INTERACTIVE))
+
+
+def client_key(api_key, address):
+    """
+    Returns the key a client is scheduled by: its API key if it sent one, its IP address otherwise.
+    """
+    return f"key:{api_key}" if api_key else (address or LOCAL)
+
+
+def bind(client, priority=INTERACTIVE):
+    """
+    Makes the current thread draw on behalf of a client until unbind() is called with the returned token.
+    """
+    return _context.set((client, priority))
+
+
+def unbind(token):
+    """
+    Restores the client the current thread drew for before bind().
+    """
+    _context.reset(token)
+
+
+@contextmanager
+def serving(client, priority):
+    """
+    Draws on behalf of a client in the given priority class within the enclosed block.
+    """
+    token = bind(client, priority)
+    try:
+        yield
+    finally:
+        unbind(token)
+
+
+class TokenBucket:
+    """
+    Limits the bits a client draws to a rate, allowing bursts up to a capacity.
+
+    Attributes:
+    - rate (float): The bits added per second.
+    - capacity (int): The maximum number of bits in the bucket.
+    - tokens (float): The bits currently in the bucket.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def consume(self, bits):
+        """
+        Takes bits out of the bucket if it holds enough.
+
+        Returns:
+        - float: 0 if the bits were taken, otherwise the number of seconds until the bucket holds enough, which is
+          infinite if bits exceeds the capacity.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if bits <= self.tokens:
+            self.tokens -= bits
+            return 0.0
+        if bits > self.capacity:
+            return math.inf
+        return (bits - self.tokens) / self.rate
+
+    def is_full(self):
+        return self.tokens + (time.monotonic() - self._updated) * self.rate >= self.capacity
+
+
+class _Draw:
+    def __init__(self, client, priority, size, remaining, loop=None):
+        self.client = client
+        self.priority = priority
+        self.size = size
+        self.remaining = remaining
+        self.finish = 0.0
+        # The event loop of a coroutine's draw, and the future which hands the pool to it
+        self.loop = loop
+        self.turn = loop.create_future() if loop is not None else None
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    """
+    Hands the entropy pool to one draw at a time, by priority class and weighted fair share.
+
+    Attributes:
+    - source (pool.EntropyPool): The pool the bytes are taken from.
+    - quantum (int): The number of bytes a draw takes before it queues again, unless the pool already holds more.
+    - reserve (int): The number of bytes bulk draws leave in the pool for interactive ones.
+    - rate (float): The quota of every client in raw bits per second, 0 for no quotas.
+    - burst (int): The number of raw bits a client may draw at once.
+    - weights (dict): The weight of a client in the fair share, 1 for clients which are not listed.
+
+    Description:
+    Every draw gets the virtual finish time max(V, F) + size / weight, where F is the finish time of the previous draw
+    of the same client and V the finish time of the draw served last. Waiting draws are served by priority class first
+    and by finish time within a class, so a client which queues many draws only delays its own. Threads and coroutines
+    wait in the same queue: a thread waits on the condition for its turn, a coroutine is handed its turn by _dispatch().
+    """
+    def __init__(self, source, quantum=SCHEDULER_QUANTUM, reserve=SCHEDULER_RESERVE, rate=CLIENT_RATE_BITS,
+                 burst=CLIENT_BURST_BITS, weights=None):
+        if quantum < 1 or reserve < 0 or quantum + reserve > source.high_water:
+            raise ValueError("The scheduler needs a positive quantum, which fits into the pool with the reserve.")
+        self.source = source
+        self.quantum = quantum
+        self.reserve = reserve
+        self.rate = rate
+        self.burst = burst
+        self.weights = CLIENT_WEIGHTS if weights is None else weights
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._serving = None
+        self._virtual = 0.0
+        self._finish = {}
+        self._buckets = {}
+
+    def _bucket(self, client):
+        """
+        Returns the token bucket of a client, forgetting full buckets once many clients have been seen. The caller
+        holds the condition.
+        """
+        if len(self._buckets) > 10000:
+            self._buckets = {key: bucket for key, bucket in self._buckets.items() if not bucket.is_full()}
+        return self._buckets.setdefault(client, TokenBucket(self.rate, self.burst))
+
+    def admit(self, bits, client=None, priority=INTERACTIVE):
+        """
+        Charges the raw bits of a request to the quota of its client before the request is served.
+
+        Parameters:
+        - bits (int): The raw bits the request draws from the pool.
+        - client (str): The client, by default the one the current thread draws for.
+        - priority (str): The priority class, only used for the metrics.
+
+        Raises:
+        - QuotaError: If the quota of the client does not cover the bits. Nothing is charged then.
+        """
+        if self.rate <= 0 or bits <= 0:
+            return
+        client = client if client is not None else _context.get()[0]
+        with self._cond:
+            wait = self._bucket(client).consume(bits)
+        if wait:
+            QUOTA_REJECTIONS.inc(priority=priority)
+            if math.isinf(wait):
+                raise QuotaError(f"The request exceeds the quota of {self.burst} bits per request.", None)
+            raise QuotaError("Quota exceeded, please retry later.", wait)
+
+    def _throttle(self, client, bits):
+        """
+        Waits until the quota of a client covers the bits of a bulk draw and charges them.
+        """
+        while True:
+            wait = self._charge(client, bits)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def _throttle_async(self, client, bits):
+        """
+        Waits like _throttle, but on the event loop.
+        """
+        while True:
+            wait = self._charge(client, bits)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def _charge(self, client, bits):
+        """
+        Charges the bits of a bulk draw to the quota of a client, at most a burst at once. Returns 0 if they were
+        charged, otherwise the number of seconds until the quota covers them.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._cond:
+            return self._bucket(client).consume(min(bits, self.burst))
+
+    def estimate(self, count, priority=INTERACTIVE, rate=None):
+        """
+        Estimates how long a request would wait for its bytes.
+
+        Parameters:
+        - count (int): The number of raw bytes the request draws.
+        - priority (str): The priority class of the request.
+        - rate (float): The rate at which the pool fills, in bytes per second.
+
+        Returns:
+        - tuple: The number of draws waiting or being served, and the estimated number of seconds until the request
+          is served, or None without a rate.
+
+        Description:
+        The estimate counts the bytes still needed by the draw being served and by the waiting draws of the same or a
+        higher priority class, less the bytes the pool already holds.
+        """
+        rank = PRIORITIES.index(priority)
+        with self._cond:
+            draws = [draw for _, _, _, draw in self._queue] + ([self._serving] if self._serving else [])
+            ahead = sum(draw.size if draw is self._serving else draw.remaining for draw in draws
+                        if PRIORITIES.index(draw.priority) <= rank or draw is self._serving)
+        needed = max(0, ahead + count - self.source.level)
+        if not needed:
+            return len(draws), 0.0
+        return len(draws), needed / rate if rate else None
+
+    def _enqueue(self, draw):
+        """
+        Gives a draw its virtual finish time and queues it.
+
+        Returns:
+        - tuple: The queue entry of the draw.
+        """
+        with self._cond:
+            weight = self.weights.get(draw.client, 1.0)
+            draw.finish = max(self._virtual, self._finish.get(draw.client, 0.0)) + draw.size / weight
+            self._finish[draw.client] = draw.finish
+            if len(self._finish) > 10000:
+                self._finish = {client: finish for client, finish in self._finish.items() if finish > self._virtual}
+            entry = (PRIORITIES.index(draw.priority), draw.finish, next(self._sequence), draw)
+            heapq.heappush(self._queue, entry)
+            self._dispatch()
+            self._cond.notify_all()
+            return entry
+
+    def _dispatch(self):
+        """
+        Hands the pool to the draw next in line if it belongs to a coroutine, which cannot wait on the condition. The
+        caller holds the condition.
+        """
+        if self._serving is None and self._queue and self._queue[0][3].loop is not None:
+            draw = heapq.heappop(self._queue)[3]
+            self._serving = draw
+            self._virtual = draw.finish
+            draw.loop.call_soon_threadsafe(_resolve, draw.turn)
+
+    def _acquire(self, entry, deadline):
+        """
+        Waits until the queued draw is next in line and hands the pool to it.
+
+        Raises:
+        - GenerationError: If the deadline passes first. The draw leaves the queue.
+        """
+        with self._cond:
+            ready = self._cond.wait_for(lambda: self._serving is None and self._queue[0] is entry,
+                                        None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if not ready:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._dispatch()
+                self._cond.notify_all()
+                raise GenerationError("Timed out waiting for random data.")
+            heapq.heappop(self._queue)
+            self._serving = entry[3]
+            self._virtual = entry[3].finish
+
+    def _release(self, entry, requeue):
+        """
+        Takes the pool back from a draw, which queues again with its finish time if requeue is set.
+        """
+        with self._cond:
+            self._serving = None
+            if requeue:
+                if entry[3].loop is not None:
+                    entry[3].turn = entry[3].loop.create_future()
+                heapq.heappush(self._queue, entry)
+            self._dispatch()
+            self._cond.notify_all()
+
+    async def _acquire_async(self, entry, deadline):
+        """
+        Waits on the event loop until _dispatch() hands the pool to the queued draw of a coroutine.
+
+        Raises:
+        - GenerationError: If the deadline passes first. The draw leaves the queue, and so it does if the waiting task
+          is cancelled.
+        """
+        draw = entry[3]
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            await asyncio.wait((draw.turn,), timeout=timeout)
+        except BaseException:
+            self._withdraw(entry)
+            raise
+        if not self._withdraw(entry, keep_turn=True):
+            raise GenerationError("Timed out waiting for random data.")
+
+    def _withdraw(self, entry, keep_turn=False):
+        """
+        Takes a draw out of the queue, or the pool back from it once it has been handed the pool, unless keep_turn is
+        set. Returns True if the draw holds the pool afterwards.
+        """
+        with self._cond:
+            if self._serving is entry[3]:
+                if keep_turn:
+                    return True
+                self._serving = None
+            else:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            self._dispatch()
+            self._cond.notify_all()
+            return False
+
+    def take(self, count, timeout=pool.POOL_TIMEOUT, atomic=False):
+        """
+        Removes and returns exactly count bytes from the pool, in turns with the other draws.
+
+        Parameters:
+        - count (int): The number of bytes to take. Must not exceed the high-water mark of the pool.
+        - timeout (float): Maximum time in seconds to wait for the bytes. For bulk draws it only counts the time spent
+          next in line, so a capture is not failed for waiting behind interactive requests.
+        - atomic (bool): Take all bytes in one turn, so either all of them are removed from the pool or none.
+
+        Returns:
+        - bytes: The requested bytes.
+
+        Raises:
+        - GenerationError, SystemError: As for pool.EntropyPool.take.
+
+        Description:
+        The draw which is next in line waits for the pool to fill in slices of SCHEDULER_SLICE seconds and queues
+        again in between, so a draw of a higher priority class, or with an earlier finish time, which arrives
+        meanwhile is served first, for example from the reserve.
+        """
+        client, priority = _context.get()
+        deadline = None if priority == BULK else time.monotonic() + timeout
+        reserve = self.reserve if priority == BULK else 0
+        chunks = []
+        remaining = count
+        while remaining > 0:
+            size = remaining if atomic else min(remaining, max(self.quantum, self.source.level - reserve),
+                                                self.source.high_water - reserve)
+            if priority == BULK:
+                self._throttle(client, size * 8)
+            start = time.perf_counter()
+            entry = self._enqueue(_Draw(client, priority, size, remaining))
+            waited = 0.0
+            data = None
+            while data is None:
+                self._acquire(entry, deadline)
+                slice_start = time.monotonic()
+                wait = SCHEDULER_SLICE if deadline is None else min(SCHEDULER_SLICE, deadline - slice_start)
+                try:
+                    data = self.source.try_take(size, max(0.0, wait), reserve)
+                except BaseException:
+                    self._release(entry, False)
+                    raise
+                waited += time.monotonic() - slice_start
+                expired = waited >= timeout if deadline is None else time.monotonic() >= deadline
+                self._release(entry, data is None and not expired)
+                if data is None and expired:
+                    raise GenerationError("Timed out waiting for random data.")
+            SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - start, priority=priority)
+            chunks.append(data)
+            remaining -= size
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    async def take_async(self, count, timeout=pool.POOL_TIMEOUT, atomic=False):
+        """
+        Removes and returns exactly count bytes from the pool like take(), but waits on the event loop.
+
+        Parameters:
+        - count (int): The number of bytes to take. Must not exceed the high-water mark of the pool.
+        - timeout (float): Maximum time in seconds to wait for the bytes, see take().
+        - atomic (bool): Take all bytes in one turn, see take().
+
+        Returns:
+        - bytes: The requested bytes.
+
+        Raises:
+        - GenerationError, SystemError: As for pool.EntropyPool.take.
+
+        Description:
+        The draws of coroutines are queued with the draws of threads and served by the same priority classes and finish
+        times, so a client which queues thousands of requests on the event loop only delays its own. A waiting
+        coroutine does not occupy a thread, and the draw which holds the pool waits for its bytes with
+        pool.EntropyPool.try_take_async.
+        """
+        client, priority = _context.get()
+        deadline = None if priority == BULK else time.monotonic() + timeout
+        reserve = self.reserve if priority == BULK else 0
+        loop = asyncio.get_running_loop()
+        chunks = []
+        remaining = count
+        while remaining > 0:
+            size = remaining if atomic else min(remaining, max(self.quantum, self.source.level - reserve),
+                                                self.source.high_water - reserve)
+            if priority == BULK:
+                await self._throttle_async(client, size * 8)
+            start = time.perf_counter()
+            entry = self._enqueue(_Draw(client, priority, size, remaining, loop))
+            waited = 0.0
+            data = None
+            while data is None:
+                await self._acquire_async(entry, deadline)
+                slice_start = time.monotonic()
+                wait = SCHEDULER_SLICE if deadline is None else min(SCHEDULER_SLICE, deadline - slice_start)
+                try:
+                    data = await self.source.try_take_async(size, max(0.0, wait), reserve)
+                except BaseException:
+                    self._release(entry, False)
+                    raise
+                waited += time.monotonic() - slice_start
+                expired = waited >= timeout if deadline is None else time.monotonic() >= deadline
+                self._release(entry, data is None and not expired)
+                if data is None and expired:
+                    raise GenerationError("Timed out waiting for random data.")
+            SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - start, priority=priority)
+            chunks.append(data)
+            remaining -= size
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    def depth(self):
+        """
+        Returns the number of waiting draws per priority class.
+        """
+        with self._cond:
+            return {priority: sum(1 for _, _, _, draw in self._queue if draw.priority == priority)
+                    for priority in PRIORITIES}
+
+
+scheduler = Scheduler(pool.pool)
+metrics.Gauge('trng_scheduler_queue_depth', 'Draws waiting for their turn at the entropy pool.',
+              lambda: {(priority,): depth for priority, depth in scheduler.depth().items()}, ('priority',))
@@ -0,0 +1,211 @@
+"""
+This module contains a simulated TRNG board, which stands in for the serial device when no hardware is connected.
+
+The simulator implements the part of the pyserial interface used by system.Device, so it can be selected with
+TRANSPORT=simulator in the .env file. Like the firmware, it only emits bytes between the 'on' and 'off' commands. The
+output rate and faults can be configured, which makes it possible to measure the whole API and to exercise the health
+tests on a plain machine:
+
+- SIMULATOR_RATE: Bytes per second, 30 like the firmware by default. 0 emits as fast as the reader drains.
+- SIMULATOR_FAULT: 'none', 'stuck' (every byte is SIMULATOR_STUCK_VALUE) or 'bias' (every bit is one with probability
+  SIMULATOR_BIAS).
+- SIMULATOR_SEED: Seed of the output, for reproducible runs. The output is unpredictable if omitted.
+- SIMULATOR_FIRMWARE: 'framed' for the current firmware, 'legacy' for firmware without the framed protocol.
+"""
+
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+import numpy as np
+import serial
+
+import protocol
+
+load_dotenv()
+SIMULATOR_RATE = float(os.getenv("SIMULATOR_RATE", "30"))  # Bytes per second, 0 for unthrottled
+SIMULATOR_FAULT = os.getenv("SIMULATOR_FAULT", "none")  # 'none', 'stuck' or 'bias'
+SIMULATOR_STUCK_VALUE = int(os.getenv("SIMULATOR_STUCK_VALUE", "0"))  # Byte emitted by a stuck board
+SIMULATOR_BIAS = float(os.getenv("SIMULATOR_BIAS", "0.6"))  # Probability of a one bit on a biased board
+SIMULATOR_SEED = os.getenv("SIMULATOR_SEED")
+SIMULATOR_FIRMWARE = os.getenv("SIMULATOR_FIRMWARE", "framed")  # 'framed' or 'legacy'
+
+CHUNK_SIZE = 4096  # Bytes an unthrottled board has ready per read
+FRAME_PAYLOAD = 32  # Payload bytes per data frame, as sent by the firmware
+STATUS_INTERVAL = 1.0  # Seconds between the status frames of the firmware
+
+FAULTS = ('none', 'stuck', 'bias')
+
+
+class SimulatedSerial:
+    """
+    A simulated TRNG board with the interface of serial.Serial.
+
+    Attributes:
+    - port (str): The port name, kept for error messages only.
+    - timeout (float): The read timeout in seconds, as for serial.Serial.
+    - rate (float): The output rate in bytes per second, 0 for unthrottled.
+    - fault (str): The injected fault, one of FAULTS. It can be changed while the board is running.
+    - framed_firmware (bool): True to simulate the current firmware, which supports the framed protocol, False to
+      simulate the older firmware, which only sends bare bytes.
+    - is_open (bool): False once the port has been closed.
+
+    Description:
+    The board accrues rate bytes per second while it is on. read() returns the accrued bytes, waiting up to the timeout
+    for at least one. In framed mode, the bytes are sent in data frames of FRAME_PAYLOAD bytes once a frame is full.
+    Closing the port makes further reads raise serial.SerialException, like a cut connection.
+    """
+    def __init__(self, port=None, baudrate=9600, timeout=None, rate=None, fault=None, bias=None, seed=None,
+                 framed_firmware=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.rate = SIMULATOR_RATE if rate is None else rate
+        self.fault = SIMULATOR_FAULT if fault is None else fault
+        self.bias = SIMULATOR_BIAS if bias is None else bias
+        if self.fault not in FAULTS:
+            raise ValueError(f"Unknown simulator fault '{self.fault}'")
+        seed = SIMULATOR_SEED if seed is None else seed
+        self.is_open = True
+        self._rng = np.random.default_rng(None if seed is None else int(seed))
+        self.framed_firmware = SIMULATOR_FIRMWARE == 'framed' if framed_firmware is None else framed_firmware
+        self._on = False
+        self._framed = False
+        self._sequence = 0
+        self._status_at = 0.0
+        self._started = 0.0
+        self._emitted = 0
+        self._output = bytearray()
+        self._lock = threading.Lock()
+
+    def _accrued(self):
+        if not self._on:
+            return 0
+        if self.rate <= 0:
+            return CHUNK_SIZE
+        return int((time.monotonic() - self._started) * self.rate) - self._emitted
+
+    def _fill(self):
+        """
+        Moves the bytes accrued so far into the output buffer, as bare bytes or in whole data frames.
+        """
+        count = self._accrued()
+        if self._framed:
+            if time.monotonic() - self._status_at >= STATUS_INTERVAL:
+                self._status()
+            frames = count // FRAME_PAYLOAD
+            for _ in range(frames):
+                self._output += protocol.encode_frame(protocol.DATA, self._sequence, self._generate(FRAME_PAYLOAD))
+                self._sequence += 1
+            self._emitted += frames * FRAME_PAYLOAD
+        elif count > 0:
+            self._output += self._generate(count)
+            self._emitted += count
+
+    def _status(self):
+        self._status_at = time.monotonic()
+        self._output += protocol.encode_status(self._sequence, int(self.rate * 8), self.baudrate)
+        self._sequence += 1
+
+    @property
+    def in_waiting(self):
+        """
+        Returns the number of bytes ready to be read.
+        """
+        with self._lock:
+            self._fill()
+            return len(self._output)
+
+    def write(self, data):
+        """
+        Receives commands, separated by newlines. Besides 'on' and 'off', the framed firmware understands 'frames',
+        'baud <rate>', 'interval <microseconds>' and 'rate'. The simulated sample interval follows from the configured
+        rate, so 'interval' is only answered with a status frame.
+        """
+        self._check_open()
+        with self._lock:
+            for command in bytes(data).decode('ascii', 'replace').split('\n'):
+                self._command(command.strip())
+        return len(data)
+
+    def _command(self, command):
+        if command == 'on' and not self._on:
+            self._on = True
+            self._started = time.monotonic()
+            self._emitted = 0
+        elif command == 'off':
+            self._on = False
+            self._framed = False
+            self._output.clear()
+        elif not self.framed_firmware:
+            return
+        elif command == 'frames':
+            self._fill()
+            self._framed = True
+            self._sequence = 0
+            self._status()
+        elif command.startswith('baud ') and self._framed:
+            self.baudrate = int(command[5:])
+            self._status()
+        elif (command == 'rate' or command.startswith('interval ')) and self._framed:
+            self._status()
+
+    def read(self, size=1):
+        """
+        Reads up to size bytes, waiting up to the timeout for the first one.
+        """
+        buffer = bytearray(size)
+        return bytes(buffer[:self.readinto(buffer)])
+
+    def readinto(self, buffer):
+        """
+        Reads into a writable buffer, waiting up to the timeout for the first byte. Returns the number of bytes read.
+        """
+        view = memoryview(buffer).cast('B')
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            self._check_open()
+            with self._lock:
+                self._fill()
+                if self._output:
+                    count = min(len(view), len(self._output))
+                    view[:count] = self._output[:count]
+                    del self._output[:count]
+                    return count
+                wait = 1 / self.rate if self._on and self.rate > 0 else 0.01
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return 0
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def _generate(self, count):
+        if self.fault == 'stuck':
+            return bytes([SIMULATOR_STUCK_VALUE]) * count
+        if self.fault == 'bias':
+            return np.packbits(self._rng.random(count * 8) < self.bias).tobytes()
+        return self._rng.bytes(count)
+
+    def _check_open(self):
+        if not self.is_open:
+            raise serial.SerialException(f"Simulated port {self.port} is closed")
+
+    def reset_input_buffer(self):
+        """
+        Discards the bytes accrued so far.
+        """
+        with self._lock:
+            if self._on and self.rate > 0:
+                self._emitted += max(self._accrued(), 0)
+            self._output.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Closes the port.
+        """
+        self.is_open = False
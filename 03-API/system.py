@@ -1,152 +1,704 @@
 """
 This module contains the system control functions for the application.
+
+Several TRNG boards can be connected at the same time. Every board is managed by its own Device with its own reader
+thread and health tests, and the bytes of all boards are combined into the shared entropy pool, either one after the
+other ('concat') or XORed together ('xor'). A board whose connection is cut or whose health tests report a total
+failure stops contributing, while the others keep serving requests.
 """
 
 import os
 import threading
 import serial
 import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
-from exceptions import SystemError
+from exceptions import GenerationError, SystemError
+import drbg
+import health
+import metrics
+import pool
+import protocol
+import quality
 
-ser = None
 load_dotenv()
 PORT = os.getenv("PORT")
+PORTS = [port.strip() for port in os.getenv("PORTS", PORT or "").split(",") if port.strip()] or [PORT]
 BAUD_RATE = int(os.getenv("BAUD_RATE", "9600"))
-lock = threading.Lock()
-is_initialized = False
+READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", "0.5"))
+READ_BUFFER_BYTES = int(os.getenv("READ_BUFFER_BYTES", "4096"))  # Maximum number of bytes taken by a single read
+TRANSPORT = os.getenv("TRANSPORT", "serial")  # 'serial' for the board, 'simulator' for simulator.SimulatedSerial
+MIX_MODE = os.getenv("MIX_MODE", "concat")  # 'concat' or 'xor', how the bytes of several boards are combined
+MIX_STALE_SECONDS = float(os.getenv("MIX_STALE_SECONDS", str(4 * READ_TIMEOUT)))  # Silence before 'xor' skips a board
+MIX_BUFFER_BYTES = int(os.getenv("MIX_BUFFER_BYTES", "65536"))  # Bytes buffered per board in 'xor' mode
+EXTRACTOR = os.getenv("EXTRACTOR", "none")  # 'none', 'von_neumann', 'peres' or 'toeplitz', see extractors.py
+EXTRACTORS = ('none', 'von_neumann', 'peres', 'toeplitz')
+WARMUP = os.getenv("WARMUP", "false").lower() == "true"  # Load the statistics stack in the background at startup
+PROTOCOL = os.getenv("PROTOCOL", "auto")  # 'auto', 'framed' or 'legacy', see protocol.py
+FRAMED_BAUD_RATE = int(os.getenv("FRAMED_BAUD_RATE", "115200"))  # Baud rate requested once the board sends frames
+SAMPLE_INTERVAL_US = os.getenv("SAMPLE_INTERVAL_US")  # Optional sample interval of the board in microseconds
+PROTOCOL_TIMEOUT = float(os.getenv("PROTOCOL_TIMEOUT", "2"))  # Seconds to wait for the board to answer in frames
+
+SERIAL_ERRORS = metrics.Counter('trng_serial_errors_total', 'Serial connection errors which stopped the reader.',
+                                ('device',))
 
 
-def setup_serial():
+def open_transport(port, baud_rate):
     """
-    Sets up the serial connection using global PORT and BAUD_RATE variables.
+    Opens the connection to a board with the transport selected by TRANSPORT.
 
-    Description:
-    The function uses the globally defined port and baud rate to establish a serial connection.
-    This function does not take any arguments and does not return any values.
+    Parameters:
+    - port (str): The serial port of the board.
+    - baud_rate (int): The baud rate of the serial connection.
+
+    Returns:
+    - serial.Serial or simulator.SimulatedSerial: The open connection.
 
     Raises:
-    - SystemError: If the serial connection could not be established.
+    - serial.SerialException: If the connection could not be established.
     """
-    global ser, is_initialized
-    try:
-        ser = serial.Serial(PORT, BAUD_RATE)
-    except serial.SerialException:
-        raise SystemError("Serial connection error")
+    if TRANSPORT == 'simulator':
+        import simulator  # Loads NumPy, which is not needed with the hardware
+        return simulator.SimulatedSerial(port, baud_rate, timeout=READ_TIMEOUT)
+    return serial.Serial(port, baud_rate, timeout=READ_TIMEOUT)
+
+
+def make_extractor():
+    """
+    Creates the extractor selected by EXTRACTOR.
+
+    Returns:
+    - extractors.Extractor: The extractor, or None if EXTRACTOR is 'none'.
+    """
+    if EXTRACTOR == 'none':
+        return None
+    import extractors  # Loads NumPy, which is not needed without an extractor
+    return extractors.create(EXTRACTOR)
 
 
-def test_serial():
+class Device:
     """
-    Checks if the serial connection is available and updates the global is_initialized flag.
+    Owns the serial connection to one TRNG board and the reader thread which drains it into the entropy pool.
+
+    Attributes:
+    - port (str): The serial port of the board.
+    - baud_rate (int): The baud rate of the serial connection.
+    - ser (serial.Serial): The open serial connection, or None while the device is in standby.
+    - error (str): Explanation of the last connection error, or None.
+    - monitor (health.HealthMonitor): The health tests of the board's raw data.
+    - bytes_read (int): The number of bytes read since the reader started.
+    - decoder (protocol.FrameDecoder): The decoder of the framed protocol, or None while the board sends bare bytes.
+    - extractor (extractors.Extractor): The extractor applied to the bytes which passed the health tests, or None.
 
     Description:
-    The function checks if the serial connection is available by sending a test message.
-    If the message is sent successfully, it sets the global flag is_initialized to True, otherwise, it sets it to False.
-    This function does not take any arguments and does not return any values.
+    The device counts as initialized while its reader thread is alive. The reader stops as soon as pyserial reports an
+    error, so the connection state is derived from the reads themselves instead of from probe writes. Only the control
+    commands 'on' and 'off' are serialized by the control lock; requests read from the entropy pool without taking it.
     """
-    global is_initialized, ser
-    with lock:
+    def __init__(self, port, baud_rate):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.ser = None
+        self.error = None
+        self.monitor = health.HealthMonitor()
+        self.bytes_read = 0
+        self.decoder = None
+        self.extractor = None
+        self.control_lock = threading.RLock()
+        self._started_at = None
+        self._reader = None
+        self._stop_event = threading.Event()
+
+    @property
+    def is_initialized(self):
+        """
+        Returns True while the device is on and its reader thread is alive.
+        """
+        return self._reader is not None and self._reader.is_alive()
+
+    @property
+    def is_healthy(self):
+        """
+        Returns True while the device is on and its health tests do not report a total failure.
+        """
+        return self.is_initialized and not self.monitor.total_failure
+
+    def rate(self):
+        """
+        Returns the average number of bytes read per second since the reader started, or None while it is off.
+        """
+        if self._started_at is None or not self.is_initialized:
+            return None
+        return self.bytes_read / max(time.monotonic() - self._started_at, 1e-6)
+
+    def status(self):
+        """
+        Returns the state of the device.
+
+        Returns:
+        - dict: The port, the connection and health state, the read rate, the health test counters and the protocol
+          counters, suitable for a JSON response. The protocol version is 0 while the board sends bare bytes. The
+          extractor statistics are None without an extractor.
+        """
+        return {
+            'port': self.port,
+            'initialized': self.is_initialized,
+            'healthy': self.is_healthy,
+            'error': self.error,
+            'bytes_read': self.bytes_read,
+            'rate': self.rate(),
+            'health': self.monitor.stats(),
+            'protocol': self.decoder.stats() if self.decoder is not None else {'version': 0},
+            'extractor': self.extractor.stats() if self.extractor is not None else None,
+        }
+
+    def setup_serial(self):
+        """
+        Opens the serial connection.
+
+        Raises:
+        - SystemError: If the serial connection could not be established.
+        """
         try:
-            ser.write('check'.encode())
-            is_initialized = True
-        except (serial.SerialException, OSError, AttributeError):
-            is_initialized = False
-        finally:
-            time.sleep(3)
+            self.ser = open_transport(self.port, self.baud_rate)
+        except serial.SerialException:
+            raise SystemError("Serial connection error")
+
+    def close_serial(self):
+        """
+        Closes the serial connection, ignoring errors of a connection that has already been cut.
+        """
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.ser = None
+
+    def _await_frame(self, decoder, condition):
+        """
+        Reads from the board until condition(decoder) holds or PROTOCOL_TIMEOUT passes. The payload read is discarded.
+
+        Returns:
+        - bool: True if the condition was met in time.
+        """
+        deadline = time.monotonic() + PROTOCOL_TIMEOUT
+        while not condition(decoder):
+            if time.monotonic() >= deadline:
+                return False
+            decoder.feed(self.ser.read(max(1, self.ser.in_waiting)))
+        return True
+
+    def _negotiate(self):
+        """
+        Switches the board to the framed protocol, see protocol.py, and raises the baud rate to FRAMED_BAUD_RATE.
+
+        Raises:
+        - SystemError: If PROTOCOL is 'framed' and the board does not answer in frames.
+        - serial.SerialException: If the connection fails.
+
+        Description:
+        Boards with older firmware ignore the 'frames' command and keep sending bare bytes. With PROTOCOL 'auto', the
+        device then falls back to reading bare bytes as before. If the board does not confirm the new baud rate, the
+        device stays at the current one.
+        """
+        self.decoder = None
+        if PROTOCOL == 'legacy':
+            return
+        decoder = protocol.FrameDecoder()
+        self.ser.write(b'frames\n')
+        if not self._await_frame(decoder, lambda d: d.baud_rate is not None):
+            if PROTOCOL == 'framed':
+                raise SystemError("The device does not support the framed protocol")
+            return
+        if FRAMED_BAUD_RATE != decoder.baud_rate:
+            decoder.baud_rate = None
+            self.ser.write(f'baud {FRAMED_BAUD_RATE}\n'.encode())
+            if self._await_frame(decoder, lambda d: d.baud_rate == FRAMED_BAUD_RATE):
+                # The board switches after sending the status frame
+                self.ser.flush()
+                self.ser.baudrate = FRAMED_BAUD_RATE
+        if SAMPLE_INTERVAL_US:
+            self.ser.write(f'interval {int(SAMPLE_INTERVAL_US)}\n'.encode())
+        # Count the protocol errors of the session from here on, not the bytes sent around the switch
+        self.ser.reset_input_buffer()
+        self.decoder = protocol.FrameDecoder()
+
+    def _read_serial(self, stop_event):
+        """
+        Drains the serial device through the health tests into the pool until stop_event is set or the connection fails.
+
+        Parameters:
+        - stop_event (threading.Event): Event signalling the reader to stop.
+
+        Description:
+        Every read blocks until at least one byte arrives or READ_TIMEOUT passes, and then takes all bytes waiting, so
+        the reader sleeps in the kernel while the board is slow instead of polling. The bytes are read into a buffer
+        allocated once per reader; everything downstream copies what it keeps.
+        """
+        ser = self.ser
+        buffer = memoryview(bytearray(READ_BUFFER_BYTES))
+        while not stop_event.is_set():
+            if not pool.pool.wait_for_space(READ_TIMEOUT):
+                mixer.touch(self)
+                continue
+            try:
+                with metrics.SERIAL_READ_SECONDS.time():
+                    count = ser.readinto(buffer[:min(max(1, ser.in_waiting), READ_BUFFER_BYTES)])
+                data = buffer[:count]
+            except (serial.SerialException, OSError, TypeError):
+                if not stop_event.is_set():
+                    SERIAL_ERRORS.inc(device=self.port)
+                    self.error = "The serial connection has been cut. Please check the device."
+                    mixer.drop(self)
+                    update_pool_state()
+                return
+            if data:
+                metrics.SERIAL_BYTES.inc(len(data), device=self.port)
+                if self.decoder is not None:
+                    data = self.decoder.feed(data)
+                self.bytes_read += len(data)
+                released = self.monitor.feed(data)
+                if self.extractor is not None:
+                    released = self.extractor.feed(released)
+                combined = mixer.add(self, released)
+                pool.pool.put(combined)
+                quality.record(combined)
+                update_pool_state()
+
+    @contextmanager
+    def control(self):
+        """
+        Holds the control lock for the enclosed block and records how long it took to acquire it.
+        """
+        start = time.perf_counter()
+        with self.control_lock:
+            metrics.CONTROL_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            yield
+
+    def start_reader(self):
+        """
+        Starts the background thread that drains the serial device into the pool.
+
+        Description:
+        The health tests and the extractor of the device restart before the reader starts. If no other device is on, the
+        bytes left over from a previous session are discarded and the quality history restarts as well.
+        """
+        self.stop_reader()
+        if not any(other.is_initialized for other in devices if other is not self):
+            pool.pool.clear()
+            quality.reset()
+        self.monitor.reset()
+        self.extractor = make_extractor()
+        self.error = None
+        self.bytes_read = 0
+        self._started_at = time.monotonic()
+        self._stop_event = threading.Event()
+        self._reader = threading.Thread(target=self._read_serial, args=(self._stop_event,),
+                                        name=f"entropy-reader-{self.port}", daemon=True)
+        mixer.join(self)
+        self._reader.start()
+
+    def stop_reader(self):
+        """
+        Stops the background reader thread and waits for it to finish its current read.
+        """
+        if self._reader is not None:
+            self._stop_event.set()
+            self._reader.join()
+            self._reader = None
+        mixer.drop(self)
+
+    def initialize(self):
+        """
+        Initializes the device by sending the 'on' command, negotiates the protocol and starts the reader.
 
+        Returns:
+        - bool: True if the device was initialized successfully.
 
-def initialize():
+        Raises:
+        - SystemError: If the device is already on or if there is an initialization error.
+        """
+        with self.control():
+            if self.is_initialized:
+                raise SystemError("System already on")
+            # Clean up after a reader which stopped because the connection was cut
+            self.stop_reader()
+            self.close_serial()
+            try:
+                self.setup_serial()
+                self.ser.write('on'.encode())
+                self.ser.reset_input_buffer()
+                time.sleep(1)
+                self._negotiate()
+                self.start_reader()
+                update_pool_state()
+                return True
+            except SystemError:
+                self.close_serial()
+                raise
+            except serial.SerialException:
+                self.close_serial()
+                raise SystemError("Initialization error")
+
+    def shutdown(self):
+        """
+        Stops the reader and puts the device in standby by sending the 'off' command.
+
+        Returns:
+        - bool: True if the device was shut down successfully.
+
+        Raises:
+        - SystemError: If the device is already in standby or if there is a serial connection error.
+
+        Description:
+        A device whose reader stopped because its connection was cut can be shut down as well, which closes the
+        connection. The DRBG state is discarded once the last device is shut down.
+        """
+        with self.control():
+            if self.ser is None:
+                raise SystemError("System already in standby")
+            self.stop_reader()
+            if not any(other.is_initialized for other in devices):
+                drbg.reset()
+            update_pool_state()
+            try:
+                self.ser.write('off'.encode())
+            except (serial.SerialException, OSError):
+                raise SystemError("Serial connection error")
+            finally:
+                self.close_serial()
+            return True
+
+    def restart(self):
+        """
+        Shuts the device down and initializes it again, for example after it was dropped.
+
+        Returns:
+        - bool: True if the device was restarted successfully.
+
+        Raises:
+        - SystemError: If the device is in standby or if there is a serial connection error.
+        """
+        with self.control():
+            if self.ser is None:
+                raise SystemError("System already in standby")
+            try:
+                self.shutdown()
+            except SystemError:
+                # A cut connection cannot receive 'off'; it is closed anyway and opened again below
+                pass
+            return self.initialize()
+
+    def prep(self):
+        """
+        Puts the device in standby at the beginning of the system start.
+
+        Raises:
+        - SystemError: If the serial connection could not be established.
+
+        Description:
+        Since the preparation runs in the background, a device may already have been initialized by a request. It is
+        left running.
+        """
+        with self.control():
+            if self.ser is not None:
+                return
+            try:
+                self.setup_serial()
+                self.ser.write('off'.encode())
+            except serial.SerialException:
+                raise SystemError("Serial connection error")
+            finally:
+                self.close_serial()
+
+
+class Mixer:
+    """
+    Combines the bytes of several devices into one stream.
+
+    Attributes:
+    - mode (str): 'concat' passes the bytes of every device through as they arrive. 'xor' XORs equal amounts of bytes
+      from all contributing devices, so the output is at least as unpredictable as the best device, at the rate of the
+      slowest one.
+
+    Description:
+    A device contributes from the start of its reader until it is dropped because its reader stopped or its health tests
+    report a total failure, and again once its health tests recover. Bytes a dropped device still had buffered are
+    discarded.
+
+    In 'xor' mode, a device from which nothing has been read for MIX_STALE_SECONDS is skipped, so a board which stays
+    connected but sends nothing does not stop the output, and it contributes again as soon as it sends. A reader which
+    waits for space in the full pool counts as active. Every buffer holds at most MIX_BUFFER_BYTES bytes; the oldest
+    bytes are discarded beyond that.
+    """
+    def __init__(self, mode=MIX_MODE):
+        if mode not in ('concat', 'xor'):
+            raise ValueError(f"Unknown mix mode '{mode}'")
+        self.mode = mode
+        self._buffers = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def add(self, device, data):
+        """
+        Adds bytes of a device.
+
+        Parameters:
+        - device (Device): The device the bytes come from.
+        - data (bytes): The bytes, after the health tests. It is called for every read from the device, also if the
+          health tests did not release any bytes yet.
+
+        Returns:
+        - bytes: The combined bytes which are ready for the pool.
+        """
+        if self.mode == 'concat':
+            return data
+        with self._lock:
+            if not device.is_healthy:
+                self._buffers.pop(device, None)
+                return b''
+            now = time.monotonic()
+            self._seen[device] = now
+            buffer = self._buffers.setdefault(device, bytearray())
+            buffer.extend(data)
+            if len(buffer) > MIX_BUFFER_BYTES:
+                del buffer[:len(buffer) - MIX_BUFFER_BYTES]
+            active = []
+            for dev, buffer in self._buffers.items():
+                if now - self._seen.get(dev, now) <= MIX_STALE_SECONDS:
+                    active.append(buffer)
+                else:
+                    buffer.clear()
+            count = min(len(buffer) for buffer in active)
+            if count == 0:
+                return b''
+            combined = 0
+            for buffer in active:
+                combined ^= int.from_bytes(buffer[:count], 'big')
+                del buffer[:count]
+            return combined.to_bytes(count, 'big')
+
+    def join(self, device):
+        """
+        Waits for bytes of a device from now on.
+        """
+        with self._lock:
+            self._buffers[device] = bytearray()
+            self._seen[device] = time.monotonic()
+
+    def touch(self, device):
+        """
+        Marks a device as active although nothing was read from it, because its reader waits for space in the pool.
+        """
+        with self._lock:
+            if device in self._seen:
+                self._seen[device] = time.monotonic()
+
+    def drop(self, device):
+        """
+        Stops waiting for bytes of a device.
+        """
+        with self._lock:
+            self._buffers.pop(device, None)
+            self._seen.pop(device, None)
+
+
+devices = [Device(port, BAUD_RATE) for port in PORTS]
+device = devices[0]
+mixer = Mixer()
+if EXTRACTOR not in EXTRACTORS:
+    raise ValueError(f"Unknown extractor '{EXTRACTOR}'")
+_group_lock = threading.RLock()
+
+
+def update_pool_state():
+    """
+    Lets the pool fail requests while no device delivers healthy data, and serve them again once one does.
+
+    Description:
+    A device which is on but reports a total failure fails the pool with a GenerationError, a device whose connection
+    was cut with a SystemError, so single board setups report the same errors as before.
+    """
+    if any(dev.is_healthy for dev in devices):
+        pool.pool.recover()
+    elif any(dev.is_initialized for dev in devices):
+        pool.pool.fail("Total failure detected.", GenerationError)
+    else:
+        errors = [dev.error for dev in devices if dev.error]
+        if errors:
+            pool.pool.fail(errors[0])
+
+
+def find_device(port):
+    """
+    Returns the device connected to a port, or None if there is none.
+    """
+    return next((dev for dev in devices if dev.port == port), None)
+
+
+def _selected(port):
+    if port is None:
+        return devices
+    dev = find_device(port)
+    if dev is None:
+        raise SystemError(f"Unknown device '{port}'")
+    return [dev]
+
+
+def health_stats():
+    """
+    Returns the health test counters of all devices combined, see health.combined_stats.
+    """
+    return health.combined_stats([dev.monitor.stats() for dev in devices if dev.is_initialized])
+
+
+def device_status():
+    """
+    Returns the state of every device, see Device.status.
+    """
+    return [dev.status() for dev in devices]
+
+
+def source_rate():
+    """
+    Estimates the rate at which the devices fill the entropy pool.
+
+    Returns:
+    - float: Bytes per second, 0 while no device delivers healthy data.
+
+    Description:
+    The read rates of the healthy devices add up with MIX_MODE 'concat', with 'xor' the slowest one sets the pace. The
+    share an extractor keeps is taken into account.
+    """
+    rates = []
+    for dev in devices:
+        rate = dev.rate() if dev.is_healthy else None
+        if rate is not None:
+            efficiency = dev.extractor.efficiency() if dev.extractor is not None else None
+            rates.append(rate * (efficiency if efficiency is not None else 1.0))
+    if not rates:
+        return 0.0
+    return min(rates) if mixer.mode == 'xor' else sum(rates)
+
+
+def is_initialized():
+    """
+    Checks if the system is on and delivering data.
+
+    Returns:
+    - bool: True if at least one device is on and its reader is alive, False otherwise.
+
+    Description:
+    The state is derived from the reader threads, which stop on the first serial error. Unlike a probe write, the check
+    does not touch the serial connections and returns immediately.
+    """
+    return any(dev.is_initialized for dev in devices)
+
+
+def initialize(port=None):
     """
     Initializes the system by sending 'on' command through the serial connection.
 
+    Parameters:
+    - port (str): The port of the device to initialize. All devices which are off are initialized if omitted.
+
     Returns:
     - bool: True if the system was initialized successfully, False otherwise.
 
     Raises:
-    - SystemError: If the system is already on or if there is an initialization error.
+    - SystemError: If the system is already on, if the device is unknown or if there is an initialization error.
 
     Description:
-    The function initializes the system by sending the 'on' command through the serial connection.
-    If the system is already initialized, it raises a SystemError.
+    The function initializes the system by sending the 'on' command through the serial connection and starts the
+    background reader which fills the entropy pool. When all devices are initialized, it succeeds as long as at least
+    one of them could be initialized; the errors of the others are reported in their status. If the system is already
+    initialized, it raises a SystemError.
     """
-    global is_initialized, ser
-    command = 'on'
-    test_serial()
-    with lock:  # Acquire the lock before accessing shared variables
-        try:
-            if not is_initialized:
-                if ser is None: setup_serial()
-                ser.write(command.encode())
-                ser.reset_input_buffer()
-                time.sleep(1)
-                is_initialized = True
-                return True
-            else:
-                raise SystemError("System already on")
-        except serial.SerialException:
-            raise SystemError(f"Initialization error")
-    return False
+    with _group_lock:
+        selected = [dev for dev in _selected(port) if not dev.is_initialized]
+        if not selected:
+            raise SystemError("System already on")
+        errors = []
+        for dev in selected:
+            try:
+                dev.initialize()
+            except SystemError as e:
+                dev.error = str(e)
+                errors.append(e)
+        if len(errors) == len(selected):
+            raise errors[0]
+        return True
 
 
-def shutdown():
+def shutdown(port=None):
     """
     Shuts down the system by sending 'off' command through the serial connection.
 
+    Parameters:
+    - port (str): The port of the device to shut down. All devices are shut down if omitted.
+
     Returns:
     - bool: True if the system was shut down successfully, False otherwise.
 
     Raises:
-    - SystemError: If the system is already in standby or if there is a serial connection error.
+    - SystemError: If the system is already in standby, if the device is unknown or if there is a serial connection
+      error.
 
     Description:
-    The function shuts down the system by sending the 'off' command through the serial connection.
-    If the system is already in standby, it raises a SystemError.
+    The function stops the background readers and shuts down the devices by sending the 'off' command through the
+    serial connection. The DRBG state is discarded once no device is on. If the system is already in standby, it raises
+    a SystemError.
     """
-    global is_initialized, ser
-    command = 'off'
-    test_serial()
-    with lock:
-        try:
-            if is_initialized:
-                if ser is None: setup_serial()
-                ser.write(command.encode())
-                ser.close()
-                ser = None
-                is_initialized = False
-                return True
-            else:
-                raise SystemError("System already in standby")
-        except serial.SerialException:
-            raise SystemError("Serial connection error")
-    return False
+    with _group_lock:
+        selected = [dev for dev in _selected(port) if dev.ser is not None]
+        if not selected:
+            raise SystemError("System already in standby")
+        errors = []
+        for dev in selected:
+            try:
+                dev.shutdown()
+            except SystemError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        return True
 
 
-def restart():
+def restart(port=None):
     """
     Restarts the system by shutting it down first and then initializing it again.
 
+    Parameters:
+    - port (str): The port of the device to restart. All devices which are on or were dropped are restarted if
+      omitted.
+
     Returns:
     - bool: True if the system was restarted successfully, False otherwise.
 
     Raises:
-    - SystemError: If the system is already in standby or if there is a serial connection error.
+    - SystemError: If the system is already in standby, if the device is unknown or if there is a serial connection
+      error.
 
     Description:
-    The function restarts the system by first shutting it down and then initializing it again.
-    If the system is already in standby, it raises a SystemError.
+    The function restarts the devices by first shutting them down and then initializing them again. The control lock
+    of a device is held throughout, so no other control command can run in between. If the system is already in
+    standby, it raises a SystemError.
     """
-    global is_initialized
-    test_serial()
-    try:
-        if is_initialized:
-            shutdown()
-            initialize()
-            return True
-        else:
+    with _group_lock:
+        selected = [dev for dev in _selected(port) if dev.ser is not None]
+        if not selected:
             raise SystemError("System already in standby")
-    except serial.SerialException:
-        raise SystemError("Serial connection error")
+        errors = []
+        for dev in selected:
+            try:
+                dev.restart()
+            except SystemError as e:
+                errors.append(e)
+        if len(errors) == len(selected):
+            raise errors[0]
+        return True
 
 
 def prep():
@@ -154,17 +706,83 @@ def prep():
     Initializes the serial connection at the beginning of the system start.
 
     Raises:
-    - SystemError: If the serial connection could not be established.
+    - SystemError: If no serial connection could be established.
 
     Description:
-    The function initializes the serial connection at the beginning of the system start.
-    This function does not take any arguments and does not return any values.
+    The function opens the serial connection of every device at the beginning of the system start, puts the device in
+    standby by sending the 'off' command and closes the connection again. Devices which cannot be reached are reported
+    and skipped, so the system starts as long as one device is available.
     """
+    errors = []
+    for dev in devices:
+        try:
+            dev.prep()
+        except SystemError as e:
+            print(f"Device {dev.port} is not available: {str(e)}")
+            errors.append(e)
+    if len(errors) == len(devices):
+        raise errors[0]
+
+
+readiness = {'prep': 'pending', 'warmup': 'pending' if WARMUP else 'disabled', 'error': None}
+_prep_thread = None
+_prep_lock = threading.Lock()
+
+
+def _prepare():
     try:
-        global ser
-        ser = serial.Serial(PORT, BAUD_RATE)
-        ser.write('off'.encode())
-        ser.close()
-        ser = None
-    except serial.SerialException:
-        raise SystemError("Serial connection error")
+        prep()
+        readiness['prep'] = 'done'
+    except SystemError as e:
+        readiness['error'] = str(e)
+        readiness['prep'] = 'failed'
+    if WARMUP:
+        quality.warm_up()
+        readiness['warmup'] = 'done'
+
+
+def start_prep():
+    """
+    Runs prep() and, with WARMUP=true, quality.warm_up() in a background thread, once per process.
+
+    Returns:
+    - threading.Thread: The started thread, or the thread of the first call.
+
+    Description:
+    The server answers requests while the devices are prepared, which takes about a second per device. The progress
+    is kept in readiness: 'prep' is 'pending', 'done' or 'failed' (with the error in 'error'), and 'warmup' is
+    'pending', 'done' or 'disabled'. It is called by the server entry points, api.py for the Flask server and the
+    lifespan startup of asgi.py, and does nothing if the preparation has already been started.
+    """
+    global _prep_thread
+    with _prep_lock:
+        if _prep_thread is None:
+            _prep_thread = threading.Thread(target=_prepare, name="prep", daemon=True)
+            _prep_thread.start()
+        return _prep_thread
+
+
+def is_ready():
+    """
+    Returns True once the devices have been prepared successfully, or once the system has been initialized.
+    """
+    return readiness['prep'] == 'done' or is_initialized()
+
+
+metrics.Gauge('trng_device_healthy', '1 while a device delivers healthy data, 0 otherwise.',
+              lambda: {(dev.port,): int(dev.is_healthy) for dev in devices}, ('device',))
+metrics.Gauge('trng_health_rct_failures', 'Windows which failed the Repetition Count Test since the device started.',
+              lambda: {(dev.port,): dev.monitor.rct_failures for dev in devices}, ('device',))
+metrics.Gauge('trng_health_apt_failures', 'Windows which failed the Adaptive Proportion Test since the device started.',
+              lambda: {(dev.port,): dev.monitor.apt_failures for dev in devices}, ('device',))
+metrics.Gauge('trng_health_windows_quarantined', 'Windows quarantined since the device started.',
+              lambda: {(dev.port,): dev.monitor.windows_quarantined for dev in devices}, ('device',))
+metrics.Gauge('trng_health_total_failure', '1 while the health tests of a device report a total failure, 0 otherwise.',
+              lambda: {(dev.port,): int(dev.monitor.total_failure) for dev in devices}, ('device',))
+metrics.Gauge('trng_extractor_efficiency', 'Fraction of the input bits kept by the extractor since the device started.',
+              lambda: {(dev.port,): dev.extractor.efficiency() for dev in devices
+                       if dev.extractor is not None and dev.extractor.input_bits}, ('device',))
+metrics.Gauge('trng_protocol_lost_frames', 'Frames missing from the sequence since the device started.',
+              lambda: {(dev.port,): dev.decoder.lost_frames for dev in devices if dev.decoder is not None}, ('device',))
+metrics.Gauge('trng_protocol_crc_errors', 'Frames discarded because of a checksum mismatch since the device started.',
+              lambda: {(dev.port,): dev.decoder.crc_errors for dev in devices if dev.decoder is not None}, ('device',))
@@ -1,185 +1,477 @@
 """
 Module containing functions for performing various tests on the data.
+
+The statistical tests accept the data as packed bytes, as a NumPy array of bits or as a string of '0' and '1'
+characters, and evaluate it with vectorized NumPy operations. Each test is split into the sufficient statistics it
+needs, which are counted from the bits, and a *_result function which turns these statistics into a result
+dictionary with the pass/fail decision, the test statistic and the p-value.
+
+The frequency, runs, cumulative sums, approximate entropy, longest run and block frequency tests follow NIST SP 800-22,
+the serial (two-bit), poker and autocorrelation tests follow the Handbook of Applied Cryptography (Menezes et al.,
+section 5.4.4). Every test passes if its p-value is at least ALPHA, so ideal random data fails each test with a
+probability of ALPHA. Checking that urandom output passes at the expected rate:
+
+    python tests.py --captures 100 --bits 20000 1000000
+
+SciPy is only imported by the *_result functions which need it, so counting the statistics, which runs in the ingest
+path, does not load it.
 """
 
+import argparse
+import json
 import math
-import scipy.stats as stats
-from collections import Counter
-from scipy.special import gammaincc
-from scipy.stats import chi2
+import os
+import sys
 import numpy as np
-from scipy.special import chdtrc
-
-IDENTICAL_BYTE_LIMIT = 6
 
-def test_total_failure(probe: bytearray) -> bool:
+ALPHA = 0.01  # Significance level of every test
+POKER_M = 4
+SERIAL_M = 2
+AUTOCORRELATION_D = 1
+APPROXIMATE_ENTROPY_M = 10  # Reduced for short data, see approximate_entropy_result
+BLOCK_FREQUENCY_M = 100
+LONGEST_RUN_M = 8  # Block length of the longest run test, with the classes <= 1, 2, 3 and >= 4 of SP 800-22
+LONGEST_RUN_CLASSES = 4
+# The longest run of ones in every byte, and the probability of every class for uniform bytes
+_BYTE_LONGEST_RUNS = np.array([max(len(run) for run in format(value, '08b').split('0')) for value in range(256)])
+_BYTE_RUN_CLASSES = np.clip(_BYTE_LONGEST_RUNS, 1, LONGEST_RUN_CLASSES) - 1
+LONGEST_RUN_PROBABILITIES = np.bincount(_BYTE_RUN_CLASSES, minlength=LONGEST_RUN_CLASSES) / 256
+
+
+def to_bits(data, length=None):
     """
-    Test if a sequence of bytes has identical bytes beyond the limit.
-    Returns True if total failure detected, otherwise False.
+    Converts data into a NumPy array holding one bit per element.
 
     Parameters:
-    - probe (bytearray): The sequence of bytes to test.
+    - data (bytes-like, numpy.ndarray or str): Packed bytes (most significant bit first), an array of bits, or a string
+      of '0' and '1' characters.
+    - length (int): Optional number of bits to keep. All bits are kept if omitted.
 
     Returns:
-    - bool: Returns True if any byte occurs more than the limit in the probe. Returns False otherwise.
+    - numpy.ndarray: A uint8 array of zeros and ones.
 
     Description:
-    The function first checks if the input is of bytearray type. If not, it raises a ValueError.
-    Then it counts the occurrences of each byte in the probe using a Counter from the collections module.
-    It iterates over the count of each byte, and if any byte count exceeds the limit, it returns True indicating a failure.
-    If no byte count exceeds the limit, it returns False indicating no failure.
-    """
-    if not isinstance(probe, bytearray):
-        raise ValueError("Input should be of bytearray type.")
-    byte_counts = Counter(probe)
-    for count in byte_counts.values():
-        if count > IDENTICAL_BYTE_LIMIT:
-            return True
-    return False
-
-
-# Further Tests Implementations...
-def run_tests(binary_string):
-                print(binary_string)
-                print("Frequency: ", frequency_test(binary_string))
-                print("Runs: ", runs_test(binary_string))
-                print("Serial: ", serial_test(binary_string))
-                print("Poker: ", poker_test(binary_string))
-                print("Cumulative: ", cumulative_sums_test(binary_string))
-                print("Auto: ", autocorrelation_test(binary_string))
-                print("Entropy: ", approximate_entropy_test(binary_string))
-                print("Blockrun: ", longest_run_ones_in_a_block_test(binary_string))
-                print("Blockfrequency: ", frequency_test_within_a_block(binary_string))
-def frequency_test(binary_string):
-    frequency = binary_string.count("1")
-    total_bits = len(binary_string)
-    return abs(frequency - total_bits / 2) / (total_bits) ** 0.5 <= 1.96
-
-
-def runs_test(binary_string):
-    n = len(binary_string)
-    pi = binary_string.count('1') / n
-    tau = 2 / (3 * n) ** 0.5
-
-    if abs(pi - 0.5) >= tau:
-        return False
-
-    vobs = len(''.join(binary_string.split('0')).split('1')) - 1
-    p_val = stats.norm.cdf((vobs - 2 * n * pi * (1 - pi)) / (2 * pi * (1 - pi) * (2 * n * pi * (1 - pi)) ** 0.5))
-
-    if p_val < 0.01:
-        return False
+    Packed bytes are expanded with np.unpackbits, strings are decoded without a per-character loop and arrays are
+    assumed to already hold one bit per element. The result can be passed to every test in this module so the
+    conversion only has to happen once per data set.
+    """
+    if isinstance(data, np.ndarray):
+        bits = data.astype(np.uint8, copy=False)
+    elif isinstance(data, str):
+        bits = np.frombuffer(data.encode('ascii'), dtype=np.uint8) - ord('0')
     else:
-        return True
-
-
-def poker_test(binary_string, m=4):
-    n = len(binary_string)
-    num_m_bit_blocks = n // m
-    expected_count = num_m_bit_blocks / (2 ** m)
-
-    blocks = [binary_string[i * m:(i + 1) * m] for i in range(num_m_bit_blocks)]
-    actual_counts = Counter(blocks)
-    chi_square = sum((f - expected_count) ** 2 / expected_count for f in actual_counts.values())
-
-    return chi_square <= 9.49  # 95% confidence level, DOF=2^m-1=15
-
-
-def serial_test(binary_string, m=2):
-    n = len(binary_string)
-    expected_count = n - m + 1
-    actual_counts = Counter([binary_string[i:i + m] for i in range(n - m + 1)])
-    chi_square = sum((f - expected_count) ** 2 / expected_count for f in actual_counts.values())
-    return chi_square <= 9.21  # 95% confidence level, DOF=m^2-1=3
-
-
-def cumulative_sums_test(binary_string):
-    n = len(binary_string)
-    x = [(-1) ** (int(bit) - 0.5) for bit in binary_string]
-    s = np.cumsum(x)
-    s_abs = np.abs(s)
-    z = max(s_abs)
-
-    # Calculate P-value
-    sum_term = 0
-    for k in range(-(n - 1), n):
-        start = (4 * k - 1) / 4
-        stop = (4 * k + 1) / 4
-        sum_term += (-1) ** k * (np.exp(-2 * (start ** 2) * (z ** 2)) - np.exp(-2 * (stop ** 2) * (z ** 2)))
-
-    p_val = 1 - sum_term
-
-    return p_val >= 0.01  # 99% confidence
-
-
-def autocorrelation_test(binary_string, d=1):
-    n = len(binary_string)
-    b = [int(bit) for bit in binary_string]
-    b_ac = [b[i] * b[i + d] for i in range(n - d)]
-    p = sum(b_ac) / (n - d) - 0.25
-    v = (13 * (n - d) + 3) * 0.5 ** 2
-    z = p / (v) ** 0.5
-    return abs(z) <= 1.96  # 95% confidence interval
-
-
-def approximate_entropy_test(binary_string, m=10):
-    n = len(binary_string)
-    phi_m = compute_phi(binary_string, m)
-    phi_m_plus_one = compute_phi(binary_string, m + 1)
-    ap_en = phi_m - phi_m_plus_one
-    x = 2.0 * n * (math.log(math.factorial(m)) - math.log(math.factorial(m + 1)) - ap_en)
-    p_value = gammaincc(2 ** (m - 1), x / 2.0)
-    return p_value > 0.01
-
-
-def compute_phi(binary_string, m):
-    n = len(binary_string)
-    counts = {}
-    for i in range(n - m + 1):
-        key = binary_string[i:i + m]
-        if key not in counts:
-            counts[key] = 0
-        counts[key] += 1
-    counts = np.array(list(counts.values()))
-    return np.sum(counts * np.log(counts / float(n - m + 1)))
-
-
-def longest_run_ones_in_a_block_test(binary_string):
-    K = 6
-    Pi = [0.2148, 0.3672, 0.2305, 0.1250, 0.0467, 0.0150, 0]
-    V = np.zeros(K + 1, dtype=int)
-    longest_run = 0
-    current_run = 0
-    for bit in binary_string:
-        if bit == '1':
-            current_run += 1
-            longest_run = max(longest_run, current_run)
-        else:
-            if current_run > 0:
-                if current_run <= 1:
-                    V[0] += 1
-                elif current_run == 2:
-                    V[1] += 1
-                elif current_run == 3:
-                    V[2] += 1
-                elif current_run == 4:
-                    V[3] += 1
-                elif current_run == 5:
-                    V[4] += 1
-                else:
-                    V[5] += 1
-            current_run = 0
-    P = np.sum(V * Pi)
-    x = np.sum((V - P) ** 2 / P)
-    p_value = chdtrc(K, x)
-    return p_value > 0.01
-
-
-def frequency_test_within_a_block(binary_string, M=100):
-    n = len(binary_string)
-    N = n // M
-    blocks = [binary_string[i * M:(i + 1) * M] for i in range(N)]
-    proportions = [(block.count('1') / M) for block in blocks]
-    chi_squared = 4.0 * M * sum([(proportion - 0.5) ** 2 for proportion in proportions])
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    if length is not None:
+        bits = bits[:length]
+    return bits
+
+
+def pattern_counts(bits, m):
+    """
+    Counts the occurrences of every overlapping m-bit pattern.
+
+    Parameters:
+    - bits (numpy.ndarray): Array of bits as returned by to_bits.
+    - m (int): The pattern length.
+
+    Returns:
+    - numpy.ndarray: Array of length 2 ** m where index v holds the number of windows whose bits spell v.
+    """
+    count = bits.size - m + 1
+    if count <= 0:
+        return np.zeros(2 ** m, dtype=np.int64)
+    values = np.zeros(count, dtype=np.int32 if m < 31 else np.int64)
+    for offset in range(m):
+        values = (values << 1) | bits[offset:offset + count]
+    return np.bincount(values, minlength=2 ** m)
+
+
+def cyclic_counts(counts, head, tail, m):
+    """
+    Completes the pattern counts of a sequence to the counts of the sequence read as a cycle.
+
+    Parameters:
+    - counts (numpy.ndarray): The overlapping m-bit pattern counts, see pattern_counts.
+    - head, tail (numpy.ndarray): At least the first and the last m - 1 bits of the sequence.
+    - m (int): The pattern length.
+
+    Returns:
+    - numpy.ndarray: The counts of all n windows, including the m - 1 windows which wrap around to the start.
+
+    Description:
+    In the cyclic counts every bit starts exactly one window, so the counts of shorter patterns follow from them by
+    summing, see marginal_counts.
+    """
+    if m < 2:
+        return counts
+    return counts + pattern_counts(np.concatenate((tail[len(tail) - (m - 1):], head[:m - 1])), m)
+
+
+def marginal_counts(counts, k):
+    """
+    Reduces cyclic pattern counts to the counts of their first k bits.
+    """
+    return counts.reshape(2 ** k, -1).sum(axis=1)
+
+
+def _result(passed, statistic, p_value=None):
+    """
+    Builds the result dictionary of a test, mapping NaN values to None so the result can be serialized as JSON.
+    """
+    def clean(value):
+        if value is None or math.isnan(value):
+            return None
+        return float(value)
+    return {'passed': bool(passed), 'statistic': clean(statistic), 'p_value': clean(p_value)}
+
+
+def poker_counts(bits, m=POKER_M):
+    """
+    Counts the occurrences of every non-overlapping m-bit block.
+
+    Parameters:
+    - bits (numpy.ndarray): Array of bits as returned by to_bits.
+    - m (int): The block length.
+
+    Returns:
+    - numpy.ndarray: Array of length 2 ** m where index v holds the number of blocks whose bits spell v.
+    """
+    num_blocks = bits.size // m
+    blocks = bits[:num_blocks * m].reshape(num_blocks, m).astype(np.int64)
+    return np.bincount(blocks @ (1 << np.arange(m - 1, -1, -1)), minlength=2 ** m)
+
+
+def max_excursion(bits):
+    """
+    Returns the maximum absolute value of the random walk which steps +1 for every one and -1 for every zero.
+    """
+    if bits.size == 0:
+        return 0
+    return int(np.max(np.abs(np.cumsum(2 * bits.astype(np.int64) - 1))))
+
+
+def lag_differences(bits, d=AUTOCORRELATION_D):
+    """
+    Returns the number of positions i for which bit i and bit i + d differ. For d = 1 these are the boundaries between
+    runs.
+    """
+    return int(np.count_nonzero(bits[:max(bits.size - d, 0)] != bits[d:]))
+
+
+def longest_runs(bits, M=LONGEST_RUN_M):
+    """
+    Counts the complete M-bit blocks by the class of their longest run of ones.
+
+    Parameters:
+    - bits (numpy.ndarray): Array of bits as returned by to_bits.
+    - M (int): The block length. Only blocks of 8 bits are supported, whose longest runs are looked up per byte.
+
+    Returns:
+    - numpy.ndarray: Array of length LONGEST_RUN_CLASSES where index i holds the number of blocks whose longest run is
+      i + 1, with runs of 0 counted in the first class and longer runs in the last.
+    """
+    if M != 8:
+        raise ValueError("The longest run test supports blocks of 8 bits.")
+    values = np.packbits(bits[:bits.size // M * M])
+    return np.bincount(_BYTE_RUN_CLASSES[values], minlength=LONGEST_RUN_CLASSES)
+
+
+def block_squares(bits, M=BLOCK_FREQUENCY_M):
+    """
+    Returns the number of complete M-bit blocks and the sum of the squared deviations of their proportions of ones
+    from 0.5.
+    """
+    N = bits.size // M
+    proportions = bits[:N * M].reshape(N, M).sum(axis=1) / M
+    return N, float(np.sum((proportions - 0.5) ** 2))
+
+
+def frequency_result(n, ones):
+    statistic = abs(2 * ones - n) / n ** 0.5
+    p_value = math.erfc(statistic / math.sqrt(2))
+    return _result(p_value >= ALPHA, statistic, p_value)
+
+
+def runs_result(n, ones, transitions):
+    """
+    Evaluates the runs test of SP 800-22 from the number of boundaries between runs.
+    """
+    pi = ones / n
+    if abs(pi - 0.5) >= 2 / n ** 0.5:
+        # The frequency test fails, so the runs test is not applicable
+        return _result(False, None, 0.0)
+    vobs = transitions + 1
+    p_value = math.erfc(abs(vobs - 2 * n * pi * (1 - pi)) / (2 * math.sqrt(2 * n) * pi * (1 - pi)))
+    return _result(p_value >= ALPHA, vobs, p_value)
+
+
+def poker_result(counts):
+    """
+    Evaluates the poker test, a chi-square test of the non-overlapping blocks with 2^m - 1 degrees of freedom.
+    """
+    k = int(np.sum(counts))
+    chi_square = counts.size / k * np.sum(counts.astype(np.float64) ** 2) - k
+    from scipy.stats import chi2
+    p_value = chi2.sf(chi_square, counts.size - 1)
+    return _result(p_value >= ALPHA, chi_square, p_value)
+
+
+def serial_result(n, counts, head, tail):
+    """
+    Evaluates the serial test from the overlapping m-bit pattern counts.
+
+    Description:
+    The statistic is the first difference psi^2_m - psi^2_(m-1) of SP 800-22, computed from the cyclic counts, which
+    has 2^(m-1) degrees of freedom. For m = 2 it is the two-bit test of the Handbook of Applied Cryptography.
+    """
+    m = int(math.log2(counts.size))
+    counts = cyclic_counts(counts, head, tail, m).astype(np.float64)
+
+    def psi_square(k):
+        if k == 0:
+            return 0.0
+        return 2 ** k / n * np.sum(marginal_counts(counts, k) ** 2) - n
+
+    statistic = psi_square(m) - psi_square(m - 1)
+    from scipy.stats import chi2
+    p_value = chi2.sf(statistic, 2 ** (m - 1))
+    return _result(p_value >= ALPHA, statistic, p_value)
+
+
+def cumulative_sums_result(n, z):
+    """
+    Evaluates the cumulative sums test of SP 800-22 in forward mode from the maximum excursion of the random walk.
+    """
+    if z == 0:
+        return _result(False, z, 0.0)
+    from scipy.stats import norm
+    root = math.sqrt(n)
+    # Terms with |4k z| beyond 10 sqrt(n) vanish and are skipped
+    k_max = int(10 * root / (4 * z)) + 2
+
+    def terms(low, high, a, b):
+        k = np.arange(max(math.floor(low), -k_max), min(math.floor(high), k_max) + 1)
+        return np.sum(norm.cdf((4 * k + a) * z / root) - norm.cdf((4 * k + b) * z / root))
+
+    p_value = (1 - terms((-n / z + 1) / 4, (n / z - 1) / 4, 1, -1)
+               + terms((-n / z - 3) / 4, (n / z - 1) / 4, 3, 1))
+    return _result(p_value >= ALPHA, z, p_value)
+
+
+def autocorrelation_result(n, d, differences):
+    """
+    Evaluates the autocorrelation test, which compares the number of bits differing from the bit d positions later
+    with its expected value (n - d) / 2.
+    """
+    z = 2 * (differences - (n - d) / 2) / (n - d) ** 0.5
+    p_value = math.erfc(abs(z) / math.sqrt(2))
+    return _result(p_value >= ALPHA, z, p_value)
+
+
+def approximate_entropy_result(n, counts, head, tail, m=APPROXIMATE_ENTROPY_M):
+    """
+    Evaluates the approximate entropy test of SP 800-22.
+
+    Parameters:
+    - n (int): The number of bits.
+    - counts (numpy.ndarray): The overlapping pattern counts of length m + 1, see pattern_counts.
+    - head, tail (numpy.ndarray): At least the first and the last m bits.
+    - m (int): The block length.
+
+    Description:
+    SP 800-22 requires m < log2(n) - 5. For shorter data the block length is reduced accordingly, and the counts of
+    the shorter blocks follow from the cyclic counts.
+    """
+    m = min(m, int(math.log2(n)) - 6) if n else 0
+    if m < 1:
+        return _result(False, None, None)
+    counts = cyclic_counts(counts, head, tail, int(math.log2(counts.size)))
+    phi = [_phi(marginal_counts(counts, k)) for k in (m, m + 1)]
+    ap_en = phi[0] - phi[1]
+    chi_square = 2.0 * n * (math.log(2) - ap_en)
+    from scipy.special import gammaincc
+    p_value = gammaincc(2 ** (m - 1), chi_square / 2.0)
+    return _result(p_value >= ALPHA, chi_square, p_value)
+
+
+def longest_run_result(counts):
+    """
+    Evaluates the longest run of ones in a block test of SP 800-22 with blocks of LONGEST_RUN_M bits.
+    """
+    N = int(np.sum(counts))
+    expected = N * LONGEST_RUN_PROBABILITIES
+    chi_square = np.sum((counts - expected) ** 2 / expected)
+    from scipy.stats import chi2
+    p_value = chi2.sf(chi_square, counts.size - 1)
+    return _result(p_value >= ALPHA, chi_square, p_value)
+
+
+def block_frequency_result(M, N, squares):
+    chi_squared = 4.0 * M * squares
+    from scipy.stats import chi2
     p_value = chi2.sf(chi_squared, N)
-    return p_value > 0.01
+    return _result(p_value >= ALPHA, chi_squared, p_value)
+
+
+def sufficient_statistics(bits):
+    """
+    Counts everything the test battery needs from a bit array.
+
+    Parameters:
+    - bits (numpy.ndarray): Array of bits as returned by to_bits.
+
+    Returns:
+    - dict: The sufficient statistics of all tests, as expected by evaluate.
+    """
+    block_count, squares = block_squares(bits)
+    return {
+        'n': bits.size,
+        'ones': int(np.count_nonzero(bits)),
+        'transitions': lag_differences(bits, 1),
+        'poker_counts': poker_counts(bits),
+        'serial_counts': pattern_counts(bits, SERIAL_M),
+        'max_excursion': max_excursion(bits),
+        'lag_differences': lag_differences(bits),
+        'entropy_counts': pattern_counts(bits, APPROXIMATE_ENTROPY_M + 1),
+        'longest_runs': longest_runs(bits),
+        'block_count': block_count,
+        'block_squares': squares,
+        'head': bits[:APPROXIMATE_ENTROPY_M].copy(),
+        'tail': bits[-APPROXIMATE_ENTROPY_M:].copy(),
+    }
+
+
+def evaluate(statistics):
+    """
+    Evaluates the test battery from its sufficient statistics.
+
+    Parameters:
+    - statistics (dict): The statistics as returned by sufficient_statistics.
+
+    Returns:
+    - dict: The result of every test, keyed by test name.
+    """
+    n = statistics['n']
+    head, tail = statistics['head'], statistics['tail']
+    return {
+        'frequency': frequency_result(n, statistics['ones']),
+        'runs': runs_result(n, statistics['ones'], statistics['transitions']),
+        'serial': serial_result(n, statistics['serial_counts'], head, tail),
+        'poker': poker_result(statistics['poker_counts']),
+        'cumulative_sums': cumulative_sums_result(n, statistics['max_excursion']),
+        'autocorrelation': autocorrelation_result(n, AUTOCORRELATION_D, statistics['lag_differences']),
+        'approximate_entropy': approximate_entropy_result(n, statistics['entropy_counts'], head, tail),
+        'longest_run': longest_run_result(statistics['longest_runs']),
+        'block_frequency': block_frequency_result(BLOCK_FREQUENCY_M, statistics['block_count'],
+                                                  statistics['block_squares']),
+    }
+
+
+def run_battery(data, length=None):
+    """
+    Runs the whole test battery on the data.
+
+    Parameters:
+    - data (bytes-like, numpy.ndarray or str): The data, see to_bits.
+    - length (int): Optional number of bits to test.
+
+    Returns:
+    - dict: The result of every test, keyed by test name. Each result holds 'passed', 'statistic' and 'p_value'.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return evaluate(sufficient_statistics(to_bits(data, length)))
+
+
+def run_tests(data, length=None):
+    for name, result in run_battery(data, length).items():
+        print(f"{name}: ", result['passed'])
+
+
+def frequency_test(data):
+    bits = to_bits(data)
+    return frequency_result(bits.size, np.count_nonzero(bits))['passed']
+
+
+def runs_test(data):
+    bits = to_bits(data)
+    return runs_result(bits.size, np.count_nonzero(bits), lag_differences(bits, 1))['passed']
+
+
+def poker_test(data, m=POKER_M):
+    return poker_result(poker_counts(to_bits(data), m))['passed']
+
+
+def serial_test(data, m=SERIAL_M):
+    bits = to_bits(data)
+    return serial_result(bits.size, pattern_counts(bits, m), bits[:m], bits[-m:])['passed']
+
+
+def cumulative_sums_test(data):
+    bits = to_bits(data)
+    return cumulative_sums_result(bits.size, max_excursion(bits))['passed']
+
+
+def autocorrelation_test(data, d=AUTOCORRELATION_D):
+    bits = to_bits(data)
+    return autocorrelation_result(bits.size, d, lag_differences(bits, d))['passed']
+
+
+def approximate_entropy_test(data, m=APPROXIMATE_ENTROPY_M):
+    bits = to_bits(data)
+    return approximate_entropy_result(bits.size, pattern_counts(bits, m + 1), bits[:m], bits[-m:], m)['passed']
+
+
+def _phi(counts):
+    total = float(np.sum(counts))
+    proportions = counts[counts > 0] / total
+    return float(np.sum(proportions * np.log(proportions)))
+
+
+def compute_phi(data, m):
+    bits = to_bits(data)
+    return _phi(cyclic_counts(pattern_counts(bits, m), bits[:m], bits[-m:], m))
+
+
+def longest_run_ones_in_a_block_test(data):
+    return longest_run_result(longest_runs(to_bits(data)))['passed']
+
+
+def frequency_test_within_a_block(data, M=BLOCK_FREQUENCY_M):
+    N, squares = block_squares(to_bits(data), M)
+    return block_frequency_result(M, N, squares)['passed']
+
+
+def self_check(num_bits, captures):
+    """
+    Runs the test battery over urandom captures and checks that every test passes at the rate expected for ideal data.
+
+    Parameters:
+    - num_bits (int): The number of bits per capture.
+    - captures (int): The number of captures.
+
+    Returns:
+    - dict: The proportion of passing captures of every test, and whether all proportions reach the minimum.
+
+    Description:
+    A single capture of ideal data fails each test with a probability of ALPHA, so the check uses the acceptance
+    criterion of SP 800-22 for the proportion of passing sequences: at least 1 - ALPHA - 3 sqrt(ALPHA (1 - ALPHA) / k)
+    for k captures.
+    """
+    passes = {}
+    for _ in range(captures):
+        for name, result in run_battery(os.urandom(-(-num_bits // 8)), num_bits).items():
+            passes[name] = passes.get(name, 0) + result['passed']
+    minimum = 1 - ALPHA - 3 * math.sqrt(ALPHA * (1 - ALPHA) / captures)
+    proportions = {name: count / captures for name, count in passes.items()}
+    return {'numBits': num_bits, 'captures': captures, 'minimum': minimum,
+            'passed': all(proportion >= minimum for proportion in proportions.values()), 'proportions': proportions}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that urandom output passes the test battery.")
+    parser.add_argument('--captures', type=int, default=100, help="captures per size, default: 100")
+    parser.add_argument('--bits', type=int, nargs='+', default=[20000, 1000000], help="bits per capture")
+    args = parser.parse_args()
+    reports = [self_check(num_bits, args.captures) for num_bits in args.bits]
+    print(json.dumps(reports, indent=2))
+    sys.exit(0 if all(report['passed'] for report in reports) else 1)
@@ -9,6 +9,7 @@ import { catchError } from 'rxjs/operators';
 })
 export class ApiService {
   private baseApiUrl = 'https://172.16.78.59:8443/trng/randomNum'; // Base URL for the API
+  private jobsApiUrl = 'https://172.16.78.59:8443/trng/jobs'; // Base URL for the test data jobs
 
   constructor(private http: HttpClient) {} // Dependency Injection of HttpClient
 
@@ -44,7 +45,7 @@ export class ApiService {
     );
   }
 
-  // Generate test data by making a GET request to the API
+  // Start generating test data by making a GET request to the API, the response contains the job ID
   generateTestdata(numBits?: string, filetype: string = 'bin'): Observable<any> {
     const url = `${this.baseApiUrl}/generateTestdata?numBits=${numBits}&filetype=${filetype}`;
     return this.http.get(url).pipe(
@@ -52,6 +53,19 @@ export class ApiService {
     );
   }
 
+  // Get the progress of a test data job
+  getJob(jobId: string): Observable<any> {
+    const url = `${this.jobsApiUrl}/${jobId}`;
+    return this.http.get(url).pipe(
+      catchError(error => this.handleError(error)) // Handle any errors from the request
+    );
+  }
+
+  // Get the download URL for the file of a finished test data job
+  getJobResultUrl(jobId: string): string {
+    return `${this.jobsApiUrl}/${jobId}/result`;
+  }
+
   // Handle any errors that may come from the API
   private handleError(error: any): Observable<never> {
     let errorMessage = 'Unknown error occurred';
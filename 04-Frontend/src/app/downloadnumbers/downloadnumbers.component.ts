@@ -13,6 +13,8 @@ export class DownloadnumbersComponent {
   showDownloadButton: boolean = false; // State to control the visibility of the download button
   status: string = ''; // String to hold status message
   error: string = ''; // String to hold error message
+  downloadUrl: string = ''; // URL of the file of the finished job
+  private pollInterval = 2000; // Milliseconds between two progress requests
 
   constructor(private api: ApiService) { } // Dependency Injection of ApiService
 
@@ -22,18 +24,34 @@ export class DownloadnumbersComponent {
     this.showStatusContainer = true;
     this.error = ""
     this.status = 'Downloadable file is being generated...'
-    // Call to ApiService's generateTestdata method
+    // Call to ApiService's generateTestdata method, which starts a job on the server
     this.api.generateTestdata(numBits, filetype).subscribe(
-      (response: any) => {
-        this.status = response.message;
-        this.showDownloadButton = true;
-        this.showStatusContainer = true;
+      (response: any) => this.pollJob(response.job_id),
+      (error) => this.showError(error));
+  }
+
+  // Method to poll the progress of a job until its file is ready for download
+  private pollJob(jobId: string): void {
+    this.api.getJob(jobId).subscribe(
+      (job: any) => {
+        if (job.status === 'finished') {
+          this.status = 'Generation successful';
+          this.downloadUrl = this.api.getJobResultUrl(jobId);
+          this.showDownloadButton = true;
+        } else if (job.status === 'failed') {
+          this.showError(job.error);
+        } else {
+          this.status = `Downloadable file is being generated... (${job.bits_collected} of ${job.numBits} bits)`;
+          setTimeout(() => this.pollJob(jobId), this.pollInterval);
+        }
       },
-      (error) => {
-        // Update error message with actual error message from the server
-        this.error = error;
-        this.status = 'An error occurred while generating the downloadable file: ';
-        this.showStatusContainer = true;
-      });
+      (error) => this.showError(error));
+  }
+
+  // Method to show an error message from the server
+  private showError(error: string): void {
+    this.error = error;
+    this.status = 'An error occurred while generating the downloadable file: ';
+    this.showStatusContainer = true;
   }
 }